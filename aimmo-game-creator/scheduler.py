@@ -0,0 +1,210 @@
+import logging
+from collections import namedtuple
+
+from eventlet.semaphore import Semaphore
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SCHEDULER_SETTINGS = {
+    # CPU (millicores) and memory (MiB) asked for by a game we have no figures for yet
+    'BASE_CPU': 100,
+    'BASE_MEMORY': 64,
+    # Extra CPU for each avatar in the game
+    'CPU_PER_AVATAR': 25,
+    # Multiple of the memory a game has been seen using that we ask for
+    'MEMORY_HEADROOM': 1.25,
+    # Fraction of a host's CPU or memory that may be handed out to games
+    'MAX_UTILISATION': 0.9,
+    # A game with a p95 turn time over this many seconds is slow. A host
+    # where most of several games are slow is running hot.
+    'SLOW_TURN_TIME': 0.25,
+    # Most games moved in a single rebalance, as moving a game restarts it
+    'MAX_MOVES': 1,
+}
+
+Demand = namedtuple('Demand', ['cpu', 'memory'])
+
+
+class GameLoad(object):
+    """Load figures from the 'load' section of a game's /metrics/, and how many are watching."""
+
+    def __init__(self, avatars=0, turn_time=None, memory=None, viewers=0):
+        self.avatars = avatars
+        self.turn_time = turn_time
+        self.memory = memory
+        self.viewers = viewers
+
+    @classmethod
+    def from_metrics(cls, metrics):
+        load = metrics.get('load', {})
+        return cls(
+            avatars=load.get('avatars', 0),
+            turn_time=load.get('turn_time', {}).get('p95'),
+            memory=load.get('memory'),
+            viewers=metrics.get('viewers', 0),
+        )
+
+
+class GameHost(object):
+    def __init__(self, name, cpu, memory):
+        self.name = name
+        self.cpu = cpu
+        self.memory = memory
+        # Game id -> Demand
+        self.games = {}
+
+    @property
+    def used_cpu(self):
+        return sum(demand.cpu for demand in self.games.values())
+
+    @property
+    def used_memory(self):
+        return sum(demand.memory for demand in self.games.values())
+
+    def utilisation(self, extra=Demand(0, 0)):
+        """The fuller of the host's CPU and memory, as a fraction."""
+        return max(float(self.used_cpu + extra.cpu) / self.cpu,
+                   float(self.used_memory + extra.memory) / self.memory)
+
+
+class Scheduler(object):
+    """
+    Places games onto a fixed set of game hosts, sizing each game from the
+    load figures it reports rather than giving every game the same share.
+
+    New games go to the host that they fill the most (best fit), placing
+    bigger games first, so that games are packed onto as few hosts as
+    possible and the rest stay free for big games. A host that is over
+    MAX_UTILISATION, or where most of its games turn slowly, is hot: each
+    rebalance moves its smallest game that fits onto another host. Games
+    being watched are never moved, as moving a game restarts it.
+
+    With no hosts, games are still sized but are left for the cluster to place.
+
+    This class is thread safe
+    """
+
+    def __init__(self, hosts=(), settings=None):
+        new_settings = DEFAULT_SCHEDULER_SETTINGS.copy()
+        new_settings.update(settings or {})
+        self.settings = new_settings
+        self._hosts = [GameHost(host['name'], host['cpu'], host['memory']) for host in hosts]
+        self._loads = {}
+        self._lock = Semaphore()
+
+    def demand_for(self, load=None):
+        settings = self.settings
+        if load is None:
+            return Demand(settings['BASE_CPU'], settings['BASE_MEMORY'])
+        cpu = settings['BASE_CPU'] + settings['CPU_PER_AVATAR'] * load.avatars
+        memory = settings['BASE_MEMORY']
+        if load.memory is not None:
+            memory = max(memory, int(load.memory * settings['MEMORY_HEADROOM']))
+        return Demand(cpu, memory)
+
+    def _host_of(self, game_id):
+        assert self._lock.locked
+        for host in self._hosts:
+            if game_id in host.games:
+                return host
+        return None
+
+    def _best_fit(self, demand, exclude=None):
+        assert self._lock.locked
+        max_utilisation = self.settings['MAX_UTILISATION']
+        candidates = [host for host in self._hosts
+                      if host is not exclude and host.utilisation(demand) <= max_utilisation]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda host: host.utilisation(demand))
+
+    def _place(self, game_id):
+        assert self._lock.locked
+        host = self._host_of(game_id)
+        if host is not None:
+            return host
+        demand = self.demand_for(self._loads.get(game_id))
+        host = self._best_fit(demand)
+        if host is not None:
+            host.games[game_id] = demand
+        elif self._hosts:
+            LOGGER.warning('No game host has room for game %s', game_id)
+        return host
+
+    def place(self, game_ids):
+        """Place each of the games, biggest first, onto a host."""
+        with self._lock:
+            by_size = sorted(game_ids, key=lambda game_id: self.demand_for(self._loads.get(game_id)),
+                             reverse=True)
+            for game_id in by_size:
+                self._place(game_id)
+
+    def get_placement(self, game_id):
+        """The name of the game's host (None if it has none), and its demand."""
+        with self._lock:
+            host = self._place(game_id)
+            if host is not None:
+                return host.name, host.games[game_id]
+            return None, self.demand_for(self._loads.get(game_id))
+
+    def remove(self, game_id):
+        with self._lock:
+            self._loads.pop(game_id, None)
+            host = self._host_of(game_id)
+            if host is not None:
+                del host.games[game_id]
+
+    def update_load(self, game_id, load):
+        with self._lock:
+            self._loads[game_id] = load
+            host = self._host_of(game_id)
+            if host is not None:
+                host.games[game_id] = self.demand_for(load)
+
+    def _is_slow(self, game_id):
+        load = self._loads.get(game_id)
+        return (load is not None and load.turn_time is not None and
+                load.turn_time > self.settings['SLOW_TURN_TIME'])
+
+    def _is_watched(self, game_id):
+        load = self._loads.get(game_id)
+        return load is not None and load.viewers > 0
+
+    def _is_hot(self, host):
+        assert self._lock.locked
+        if host.utilisation() > self.settings['MAX_UTILISATION']:
+            return True
+        # Moving a game that is slow on its own won't make it any faster
+        if len(host.games) < 2:
+            return False
+        num_slow = sum(1 for game_id in host.games if self._is_slow(game_id))
+        return num_slow * 2 > len(host.games)
+
+    def hot_hosts(self):
+        with self._lock:
+            return [host.name for host in self._hosts if self._is_hot(host)]
+
+    def rebalance(self):
+        """
+        Move games off hot hosts. Returns the ids of the games moved, which
+        need restarting on their new host.
+        """
+        moved = []
+        with self._lock:
+            hot_hosts = sorted((host for host in self._hosts if self._is_hot(host)),
+                               key=lambda host: host.utilisation(), reverse=True)
+            for hot_host in hot_hosts:
+                if len(moved) >= self.settings['MAX_MOVES']:
+                    break
+                for game_id, demand in sorted(hot_host.games.items(), key=lambda item: item[1]):
+                    if self._is_watched(game_id):
+                        continue
+                    new_host = self._best_fit(demand, exclude=hot_host)
+                    if new_host is not None and not self._is_hot(new_host):
+                        LOGGER.info('Moving game %s from hot host %s to %s',
+                                    game_id, hot_host.name, new_host.name)
+                        del hot_host.games[game_id]
+                        new_host.games[game_id] = demand
+                        moved.append(game_id)
+                        break
+        return moved
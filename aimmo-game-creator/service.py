@@ -1,14 +1,19 @@
 #!/usr/bin/env python
 import logging
 import os
+from json import loads
 
+from scheduler import Scheduler
 from worker_manager import WORKER_MANAGERS
 
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
     WorkerManagerClass = WORKER_MANAGERS[os.environ['WORKER_MANAGER']]
-    worker_manager = WorkerManagerClass(os.environ['GAME_API_URL'])
+    # A JSON list of {"name": <node name>, "cpu": <millicores>, "memory": <MiB>}
+    scheduler = Scheduler(loads(os.environ.get('GAME_HOSTS', '[]')),
+                          loads(os.environ.get('SCHEDULER_SETTINGS', '{}')))
+    worker_manager = WorkerManagerClass(os.environ['GAME_API_URL'], scheduler)
     worker_manager.run()
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+
+import unittest
+
+from scheduler import Demand, GameLoad, Scheduler
+
+
+def load(avatars=0, turn_time=None, memory=None, viewers=0):
+    return GameLoad(avatars=avatars, turn_time=turn_time, memory=memory, viewers=viewers)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(
+            [
+                {'name': 'small', 'cpu': 500, 'memory': 512},
+                {'name': 'big', 'cpu': 1000, 'memory': 1024},
+            ],
+            {'BASE_CPU': 100, 'BASE_MEMORY': 64, 'CPU_PER_AVATAR': 50, 'MEMORY_HEADROOM': 1.0},
+        )
+
+    def host_of(self, game_id):
+        return self.scheduler.get_placement(game_id)[0]
+
+    def test_demand_from_load(self):
+        self.assertEqual(self.scheduler.demand_for(None), Demand(100, 64))
+        self.assertEqual(self.scheduler.demand_for(load(avatars=4, memory=200)), Demand(300, 200))
+        # Never less than a new game asks for
+        self.assertEqual(self.scheduler.demand_for(load(memory=10)), Demand(100, 64))
+
+    def test_games_packed_onto_fullest_host(self):
+        self.scheduler.place(['1', '2', '3', '4'])
+        self.assertEqual({self.host_of(str(i)) for i in range(1, 5)}, {'small'})
+        # 'small' can't take a fifth game without going over 90% CPU
+        self.scheduler.place(['5'])
+        self.assertEqual(self.host_of('5'), 'big')
+
+    def test_biggest_games_placed_first(self):
+        self.scheduler.update_load('1', load(avatars=2))
+        self.scheduler.update_load('2', load(avatars=14))
+        self.scheduler.place(['1', '2'])
+        # The 800m game only fits on 'big', then the small one fits best on 'small'
+        self.assertEqual(self.host_of('2'), 'big')
+        self.assertEqual(self.host_of('1'), 'small')
+
+    def test_no_room(self):
+        self.scheduler.update_load('1', load(avatars=100))
+        self.scheduler.place(['1'])
+        self.assertEqual(self.scheduler.get_placement('1'), (None, Demand(5100, 64)))
+
+    def test_no_hosts(self):
+        scheduler = Scheduler()
+        scheduler.place(['1'])
+        self.assertEqual(scheduler.get_placement('1'), (None, Demand(100, 64)))
+        self.assertEqual(scheduler.rebalance(), [])
+
+    def test_removed_game_frees_room(self):
+        self.scheduler.update_load('1', load(avatars=6))
+        self.scheduler.place(['1'])
+        self.assertEqual(self.host_of('1'), 'small')
+        self.scheduler.remove('1')
+        self.scheduler.update_load('2', load(avatars=6))
+        self.scheduler.place(['2'])
+        self.assertEqual(self.host_of('2'), 'small')
+
+    def test_overfull_host_rebalanced(self):
+        self.scheduler.place(['1', '2', '3'])
+        self.assertEqual(self.scheduler.hot_hosts(), [])
+        self.scheduler.update_load('1', load(avatars=5))
+        self.assertEqual(self.scheduler.hot_hosts(), ['small'])
+        # The smallest game moves, which is enough to cool the host
+        moved = self.scheduler.rebalance()
+        self.assertEqual(len(moved), 1)
+        self.assertNotEqual(moved[0], '1')
+        self.assertEqual(self.host_of(moved[0]), 'big')
+        self.assertEqual(self.scheduler.hot_hosts(), [])
+        self.assertEqual(self.scheduler.rebalance(), [])
+
+    def test_watched_games_not_moved(self):
+        self.scheduler.place(['1', '2', '3'])
+        self.scheduler.update_load('2', load(viewers=1))
+        self.scheduler.update_load('3', load(viewers=2))
+        self.scheduler.update_load('1', load(avatars=5))
+        self.assertEqual(self.scheduler.rebalance(), ['1'])
+
+    def test_hot_host_of_watched_games_left(self):
+        self.scheduler.place(['1', '2'])
+        self.scheduler.update_load('1', load(avatars=5, viewers=1))
+        self.scheduler.update_load('2', load(avatars=3, viewers=1))
+        self.assertEqual(self.scheduler.hot_hosts(), ['small'])
+        self.assertEqual(self.scheduler.rebalance(), [])
+
+    def test_host_with_slow_turns_rebalanced(self):
+        self.scheduler.place(['1', '2'])
+        self.scheduler.update_load('1', load(turn_time=0.4))
+        self.assertEqual(self.scheduler.hot_hosts(), [])
+        self.scheduler.update_load('2', load(turn_time=0.4))
+        self.assertEqual(self.scheduler.hot_hosts(), ['small'])
+        self.assertEqual(len(self.scheduler.rebalance()), 1)
+        self.assertEqual({self.host_of('1'), self.host_of('2')}, {'small', 'big'})
+
+    def test_lone_slow_game_stays(self):
+        self.scheduler.place(['1'])
+        self.scheduler.update_load('1', load(turn_time=0.4))
+        self.assertEqual(self.scheduler.rebalance(), [])
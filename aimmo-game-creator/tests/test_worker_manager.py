@@ -4,11 +4,15 @@ import cPickle as pickle
 import unittest
 
 from json import dumps, loads
+from urlparse import parse_qs
 
 from httmock import HTTMock
 import mock
+import requests
 
+from scheduler import Scheduler
 from worker_manager import WorkerManager
+from worker_manager import KubernetesWorkerManager
 from worker_manager import LocalWorkerManager
 
 
@@ -100,6 +104,171 @@ class TestWorkerManager(unittest.TestCase):
             self.assertEqual(self.worker_manager.added_workers[str(i)]['name'], 'Game %s' % i)
 
 
+class ChangeFeedMock(object):
+    """A games API with a change feed, serving the next queued response."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.queries = []
+
+    def __call__(self, url, request):
+        self.queries.append(parse_qs(url.query))
+        return dumps(self.responses.pop(0))
+
+
+def listing(game_id, **settings):
+    return {'name': 'Game %s' % game_id, 'settings': dumps(settings)}
+
+
+class TestChangeFeed(unittest.TestCase):
+    def setUp(self):
+        self.worker_manager = ConcreteWorkerManager('http://test/')
+
+    def test_follows_changes(self):
+        mocker = ChangeFeedMock(
+            {'revision': 5, 'snapshot': True, 'games': {'1': listing(1), '2': listing(2)}, 'removed': []},
+            {'revision': 7, 'snapshot': False, 'games': {'3': listing(3)}, 'removed': [1]},
+        )
+        with HTTMock(mocker):
+            self.assertTrue(self.worker_manager.update())
+            self.assertTrue(self.worker_manager.update())
+        self.assertEqual(self.worker_manager.final_workers, {'2', '3'})
+        self.assertEqual([query['since'] for query in mocker.queries], [['0'], ['5']])
+        self.assertEqual(mocker.queries[0]['wait'], [str(WorkerManager.LONG_POLL_WAIT)])
+
+    def test_nothing_changed(self):
+        mocker = ChangeFeedMock(
+            {'revision': 5, 'snapshot': True, 'games': {'1': listing(1)}, 'removed': []},
+            {'revision': 5, 'snapshot': False, 'games': {}, 'removed': []},
+        )
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            self.worker_manager.update()
+        self.assertEqual(self.worker_manager.added_workers, {})
+        self.assertEqual(self.worker_manager.removed_workers, [])
+        self.assertEqual(self.worker_manager.final_workers, {'1'})
+
+    def test_reconfigured_game_restarted(self):
+        mocker = ChangeFeedMock(
+            {'revision': 5, 'snapshot': True, 'games': {'1': listing(1, test=1)}, 'removed': []},
+            {'revision': 6, 'snapshot': False, 'games': {'1': listing(1, test=1)}, 'removed': []},
+            {'revision': 7, 'snapshot': False, 'games': {'1': listing(1, test=2)}, 'removed': []},
+        )
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            self.worker_manager.update()
+            self.assertEqual(self.worker_manager.added_workers, {})
+            self.worker_manager.update()
+        self.assertEqual(self.worker_manager.removed_workers, ['1'])
+        self.assertEqual(loads(self.worker_manager.added_workers['1']['settings']), {'test': 2})
+
+    def test_sleeps_without_change_feed(self):
+        with HTTMock(RequestMock(1)):
+            self.assertFalse(self.worker_manager.update())
+
+
+class MetricsMock(RequestMock):
+    """Serves the games list, and each game's load figures."""
+
+    def __init__(self, num_games):
+        super(MetricsMock, self).__init__(num_games)
+        self.avatars = {}
+        self.viewers = {}
+        self.checkpoints_given = {}
+
+    def __call__(self, url, request):
+        self.urls_requested.append(url.geturl())
+        if url.netloc.startswith('game-'):
+            game_id = url.netloc[len('game-'):]
+            if url.path == '/checkpoint/':
+                if request.method == 'PUT':
+                    self.checkpoints_given[game_id] = loads(request.body)
+                return dumps({'game': game_id})
+            return dumps({'load': {'avatars': self.avatars.get(game_id, 0)},
+                          'viewers': self.viewers.get(game_id, 0)})
+        return dumps(self.value)
+
+
+class LoadReportingWorkerManager(ConcreteWorkerManager):
+    def get_game_url(self, game_id):
+        return 'http://game-%s' % game_id
+
+
+class TestLoadBalancing(unittest.TestCase):
+    def setUp(self):
+        scheduler = Scheduler(
+            [{'name': 'a', 'cpu': 1000, 'memory': 1024}, {'name': 'b', 'cpu': 1000, 'memory': 1024}],
+            {'BASE_CPU': 100, 'CPU_PER_AVATAR': 100},
+        )
+        self.worker_manager = LoadReportingWorkerManager('http://test/', scheduler)
+        self.scheduler = scheduler
+
+    def test_games_packed_onto_one_host(self):
+        with HTTMock(MetricsMock(3)):
+            self.worker_manager.update()
+        self.assertEqual({self.scheduler.get_placement(str(i))[0] for i in xrange(3)}, {'a'})
+
+    def test_game_moved_off_hot_host(self):
+        mocker = MetricsMock(3)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            mocker.avatars['0'] = 7
+            self.worker_manager.update()
+        self.assertEqual(len(self.worker_manager.added_workers), 1)
+        moved_game = self.worker_manager.added_workers.keys()[0]
+        self.assertEqual(self.worker_manager.removed_workers, [moved_game])
+        self.assertEqual(self.scheduler.get_placement(moved_game)[0], 'b')
+        self.assertEqual(self.worker_manager.added_workers[moved_game]['name'], 'Game %s' % moved_game)
+        self.assertEqual(mocker.checkpoints_given, {moved_game: {'game': moved_game}})
+
+    def test_watched_game_not_moved(self):
+        mocker = MetricsMock(3)
+        mocker.viewers = {'0': 1, '1': 1, '2': 1}
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            mocker.avatars['0'] = 7
+            self.worker_manager.update()
+        self.assertEqual(self.worker_manager.added_workers, {})
+
+    def test_moved_game_started_over_without_checkpoint(self):
+        mocker = MetricsMock(3)
+
+        def failing_hand_over(url, request):
+            if url.path == '/checkpoint/' and request.method == 'PUT':
+                raise requests.exceptions.ConnectionError()
+            return mocker(url, request)
+        self.worker_manager.HAND_OVER_TIMEOUT = 0
+        with HTTMock(failing_hand_over):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            mocker.avatars['0'] = 7
+            self.worker_manager.update()
+        self.assertEqual(len(self.worker_manager.added_workers), 1)
+        self.assertEqual(mocker.checkpoints_given, {})
+
+    def test_removed_game_unscheduled(self):
+        mocker = MetricsMock(2)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            del mocker.value['1']
+            self.worker_manager.update()
+        self.assertEqual(self.scheduler.get_placement('0')[0], 'a')
+        self.assertNotIn('1', self.worker_manager._game_data)
+
+    def test_removed_game_checkpoint_discarded(self):
+        mocker = MetricsMock(2)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            del mocker.value['1']
+            self.worker_manager.update()
+        self.assertIn('http://game-1/checkpoint/', mocker.urls_requested)
+        self.assertNotIn('http://game-0/checkpoint/', mocker.urls_requested)
+
+
 class TestLocalWorkerManager(unittest.TestCase):
 
     def test_create_worker(self):
@@ -140,3 +309,58 @@ class TestLocalWorkerManager(unittest.TestCase):
 
         self.assertTrue(self.killed)
         self.assertTrue(1 not in localWorkerManager.workers)
+
+
+class FakePod(object):
+    def __init__(self, name, ip, node='node-1', phase='Running'):
+        self.name = name
+        self.obj = {
+            'metadata': {'labels': {'app': 'aimmo-game-standby'}},
+            'spec': {'nodeName': node},
+            'status': {'phase': phase, 'podIP': ip},
+        }
+        self.updated = False
+        self.deleted = False
+
+    def update(self):
+        self.updated = True
+
+    def delete(self):
+        self.deleted = True
+
+
+class TestStandbyGames(unittest.TestCase):
+    def setUp(self):
+        with mock.patch('pykube.HTTPClient'), mock.patch('pykube.KubeConfig'):
+            self.worker_manager = KubernetesWorkerManager(
+                'http://test/', Scheduler([{'name': 'node-2', 'cpu': 1000, 'memory': 1024}]))
+        self.pods = []
+        self.configured = {}
+
+    def claim(self, game_id='1', status_code=200):
+        def configure(url, request):
+            self.configured[url.netloc] = loads(request.body)
+            return {'status_code': status_code}
+        environment = self.worker_manager._game_environment(game_id, {'settings': '{}', 'name': 'Game'})
+        with mock.patch('pykube.Pod.objects') as objects, HTTMock(configure):
+            objects.return_value.filter.return_value = self.pods
+            return self.worker_manager._claim_standby(game_id, environment)
+
+    def test_ready_standby_claimed(self):
+        self.pods = [FakePod('starting', None, phase='Pending'), FakePod('ready', '10.0.0.2', node='node-2')]
+        self.assertTrue(self.claim())
+        self.assertEqual(self.pods[1].obj['metadata']['labels'], {'app': 'aimmo-game', 'game_id': '1'})
+        self.assertTrue(self.pods[1].updated)
+        self.assertFalse(self.pods[0].updated)
+        config = self.configured['10.0.0.2:5000']
+        self.assertEqual((config['GAME_ID'], config['GAME_URL'], config['settings']), ('1', 'http://game-1', '{}'))
+
+    def test_standby_on_other_host_not_claimed(self):
+        self.pods = [FakePod('elsewhere', '10.0.0.1', node='node-1')]
+        self.assertFalse(self.claim())
+        self.assertFalse(self.pods[0].updated)
+
+    def test_standby_that_fails_to_configure_removed(self):
+        self.pods = [FakePod('broken', '10.0.0.2', node='node-2')]
+        self.assertFalse(self.claim(status_code=500))
+        self.assertTrue(self.pods[0].deleted)
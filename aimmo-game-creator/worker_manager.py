@@ -9,6 +9,8 @@ import requests
 from eventlet.greenpool import GreenPool
 from eventlet.semaphore import Semaphore
 
+from scheduler import GameLoad, Scheduler
+
 LOGGER = logging.getLogger(__name__)
 
 
@@ -36,6 +38,13 @@ class _WorkerManagerData(object):
                 self._remove_game(u)
             return unknown_games
 
+    def remove_games(self, game_ids):
+        with self._lock:
+            removed_games = self._games & frozenset(game_ids)
+            for r in removed_games:
+                self._remove_game(r)
+            return removed_games
+
     def get_games(self):
         with self._lock:
             for g in self._games:
@@ -56,7 +65,12 @@ class WorkerManager(object):
     __metaclass__ = ABCMeta
     daemon = True
 
-    def __init__(self, games_url):
+    #: How long the games API may hold each request open waiting for changes, in seconds
+    LONG_POLL_WAIT = 25
+    #: How long a moved game has to start before we give up handing it its checkpoint, in seconds
+    HAND_OVER_TIMEOUT = 120
+
+    def __init__(self, games_url, scheduler=None):
         """
 
         :param thread_pool:
@@ -64,6 +78,9 @@ class WorkerManager(object):
         self._data = _WorkerManagerData()
         self.games_url = games_url
         self._pool = GreenPool(size=3)
+        self._scheduler = scheduler if scheduler is not None else Scheduler()
+        self._game_data = {}
+        self._revision = 0
         super(WorkerManager, self).__init__()
 
     def get_persistent_state(self, player_id):
@@ -83,6 +100,11 @@ class WorkerManager(object):
 
         raise NotImplemented
 
+    def get_game_url(self, game_id):
+        """Where the game can be reached from here, or None if it can't."""
+
+        return None
+
     # TODO handle failure
     def spawn(self, game_id, game_data):
         # Kill worker
@@ -92,36 +114,143 @@ class WorkerManager(object):
         # Spawn worker
         LOGGER.info("Spawning worker for game %s" % game_data['name'])
         game_data['GAME_API_URL'] = '{}{}/'.format(self.games_url, game_id)
+        self._game_data[game_id] = game_data
         self.create_worker(game_id, game_data)
 
+    def _discard_checkpoint(self, game_id):
+        """Have the game delete any checkpoint, so it can't carry on if it's recreated."""
+        game_url = self.get_game_url(game_id)
+        if game_url is None:
+            return
+        try:
+            requests.delete(game_url + '/checkpoint/', timeout=2).raise_for_status()
+        except requests.RequestException as err:
+            LOGGER.warning('Could not discard checkpoint of game %s: %s', game_id, err)
+
+    def _remove_game(self, game_id):
+        self._discard_checkpoint(game_id)
+        self.remove_worker(game_id)
+        self._scheduler.remove(game_id)
+        self._game_data.pop(game_id, None)
+
+    def _update_load(self, game_id):
+        game_url = self.get_game_url(game_id)
+        if game_url is None:
+            return
+        try:
+            metrics = requests.get(game_url + '/metrics/', timeout=2).json()
+        except (requests.RequestException, ValueError) as err:
+            LOGGER.debug('No load figures for game %s: %s', game_id, err)
+        else:
+            self._scheduler.update_load(game_id, GameLoad.from_metrics(metrics))
+
+    def _rebalance(self):
+        self._parallel_map(self._update_load, list(self._data.get_games()))
+        for game_id in self._scheduler.rebalance():
+            self._move(game_id)
+
+    def _move(self, game_id):
+        """Restart the game on its new host, carrying on from where it was."""
+        checkpoint = self._take_checkpoint(game_id)
+        self.spawn(game_id, self._game_data[game_id])
+        if checkpoint is not None:
+            self._hand_over_checkpoint(game_id, checkpoint)
+
+    def _take_checkpoint(self, game_id):
+        game_url = self.get_game_url(game_id)
+        if game_url is None:
+            return None
+        try:
+            response = requests.get(game_url + '/checkpoint/', timeout=5)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as err:
+            LOGGER.warning('Could not checkpoint game %s before moving it, it will start over: %s', game_id, err)
+            return None
+
+    def _hand_over_checkpoint(self, game_id, checkpoint):
+        deadline = time.time() + self.HAND_OVER_TIMEOUT
+        while True:
+            try:
+                response = requests.put(self.get_game_url(game_id) + '/checkpoint/', json=checkpoint, timeout=5)
+                if response.status_code == 409:
+                    LOGGER.warning('Game %s refused its checkpoint: %s', game_id, response.text)
+                    return
+                response.raise_for_status()
+                LOGGER.info('Game %s carried on from its checkpoint', game_id)
+                return
+            except requests.RequestException as err:
+                # Most likely still starting
+                if time.time() >= deadline:
+                    LOGGER.warning('Could not hand game %s its checkpoint, it will start over: %s', game_id, err)
+                    return
+            time.sleep(1)
+
     def _parallel_map(self, func, *iterable_args):
         list(self._pool.imap(func, *iterable_args))
 
     def run(self):
         while True:
-            self.update()
-            LOGGER.info("Sleeping")
-            time.sleep(10)
+            if not self.update():
+                LOGGER.info("Sleeping")
+                time.sleep(10)
+
+    def _fetch_games(self):
+        """
+        The games added or changed since the last fetch, the ids of those
+        removed, and whether the games given are all of them.
+
+        The games API holds the request open until there are changes. If it
+        doesn't have a change feed, it sends every game each time instead.
+        """
+        response = requests.get(
+            self.games_url,
+            params={'since': self._revision, 'wait': self.LONG_POLL_WAIT},
+            timeout=self.LONG_POLL_WAIT + 10,
+        ).json()
+        if 'revision' not in response:
+            return response, [], True
+        self._revision = response['revision']
+        removed = [str(game_id) for game_id in response['removed']]
+        return response['games'], removed, response['snapshot']
+
+    def _is_reconfigured(self, game_id, game_data):
+        old_data = self._game_data.get(game_id, {})
+        return any(old_data.get(key) != game_data[key] for key in ('name', 'settings'))
 
     def update(self):
+        """
+        Start, restart and stop games to match the games API. Returns whether
+        the API waited for changes, so it can be asked again straight away.
+        """
         try:
             LOGGER.info("Waking up")
-            games = requests.get(self.games_url).json()
+            games, removed_games, all_games = self._fetch_games()
         except (requests.RequestException, ValueError) as err:
             LOGGER.error("Failed to obtain game data : %s", err)
-        else:
-            games_to_add = {id: games[id]
-                            for id in self._data.add_new_games(games.keys())}
-            LOGGER.debug("Need to add games: %s" % games_to_add)
+            return False
+
+        new_games = self._data.add_new_games(games.keys())
+        reconfigured_games = [game_id for game_id in games
+                              if game_id not in new_games and self._is_reconfigured(game_id, games[game_id])]
+        games_to_spawn = {id: games[id] for id in list(new_games) + reconfigured_games}
+        LOGGER.debug("Need to add or restart games: %s" % games_to_spawn)
+
+        # Add missing games, and restart those with new settings
+        self._scheduler.place(games_to_spawn.keys())
+        self._parallel_map(self.spawn, games_to_spawn.keys(), games_to_spawn.values())
 
-            # Add missing games
-            self._parallel_map(self.spawn, games_to_add.keys(), games_to_add.values())
+        # Delete extra games
+        if all_games:
+            removed_games = self._data.remove_unknown_games(set(games.keys()))
+        else:
+            removed_games = self._data.remove_games(removed_games)
+        LOGGER.debug("Removing games: %s" % removed_games)
+        self._parallel_map(self._remove_game, removed_games)
 
-            # Delete extra games
-            known_games = set(games.keys())
-            removed_user_ids = self._data.remove_unknown_games(known_games)
-            LOGGER.debug("Removing users: %s" % removed_user_ids)
-            self._parallel_map(self.remove_worker, removed_user_ids)
+        # Move games off hosts running hot
+        self._rebalance()
+        return self._revision != 0
 
 
 class LocalWorkerManager(WorkerManager):
@@ -138,9 +267,16 @@ class LocalWorkerManager(WorkerManager):
         self.workers = {}
         super(LocalWorkerManager, self).__init__(*args, **kwargs)
 
+    @staticmethod
+    def _port(game_id):
+        return 6001 + int(game_id) * 1000
+
+    def get_game_url(self, game_id):
+        return 'http://127.0.0.1:%d' % self._port(game_id)
+
     def create_worker(self, game_id, game_data):
         assert(game_id not in self.workers)
-        port = str(6001 + int(game_id) * 1000)
+        port = str(self._port(game_id))
         process_args = [
             'python',
             self.worker_path,
@@ -168,14 +304,152 @@ class KubernetesWorkerManager(WorkerManager):
 
     def __init__(self, *args, **kwargs):
         self._api = pykube.HTTPClient(pykube.KubeConfig.from_service_account())
+        # Game servers kept booted, with no game, to be given new games straight away
+        self.standby_games = int(os.environ.get('STANDBY_GAMES', 0))
         super(KubernetesWorkerManager, self).__init__(*args, **kwargs)
-
-    def _create_game_rc(self, id, environment_variables):
-        environment_variables['SOCKETIO_RESOURCE'] = "game/%s/socket.io" % id
+        if self.standby_games:
+            self._create_standby_rc()
+
+    def get_game_url(self, game_id):
+        return 'http://game-%s' % game_id
+
+    @staticmethod
+    def _game_pod_spec(host, demand):
+        """Where the game's pod may run, and the resources it asks for."""
+        spec = {
+            'resources': {
+                'limits': {
+                    'cpu': '1000m',
+                    'memory': '%dMi' % max(128, 2 * demand.memory),
+                },
+                'requests': {
+                    'cpu': '%dm' % demand.cpu,
+                    'memory': '%dMi' % demand.memory,
+                },
+            },
+        }
+        if host is not None:
+            spec['nodeSelector'] = {'kubernetes.io/hostname': host}
+        return spec
+
+    @staticmethod
+    def _common_environment():
+        environment_variables = {
+            'PYKUBE_KUBERNETES_SERVICE_HOST': 'kubernetes',
+            'IMAGE_SUFFIX': os.environ.get('IMAGE_SUFFIX', 'latest'),
+        }
+        for name in ('WORKER_POOL_SIZE', 'WORKER_RUNTIME'):
+            if name in os.environ:
+                environment_variables[name] = os.environ[name]
+        return environment_variables
+
+    def _game_environment(self, id, game_data):
+        environment_variables = dict(game_data, **self._common_environment())
         environment_variables['GAME_ID'] = id
         environment_variables['GAME_URL'] = "http://game-%s" % id
-        environment_variables['PYKUBE_KUBERNETES_SERVICE_HOST'] = 'kubernetes'
-        environment_variables['IMAGE_SUFFIX'] = os.environ.get('IMAGE_SUFFIX', 'latest')
+        return environment_variables
+
+    def _create_standby_rc(self):
+        environment_variables = dict(self._common_environment(), GAME_STANDBY='1')
+        pod_spec = self._game_pod_spec(None, self._scheduler.demand_for(None))
+        rc = pykube.ReplicationController(
+            self._api,
+            {
+                'kind': 'ReplicationController',
+                'apiVersion': 'v1',
+                'metadata': {
+                    'name': 'game-standby',
+                    'namespace': 'default',
+                    'labels': {
+                        'app': 'aimmo-game-standby',
+                    },
+                },
+                'spec': {
+                    'replicas': self.standby_games,
+                    'selector': {
+                        'app': 'aimmo-game-standby',
+                    },
+                    'template': {
+                        'metadata': {
+                            'labels': {
+                                'app': 'aimmo-game-standby',
+                            },
+                        },
+                        'spec': {
+                            'containers': [
+                                {
+                                    'env': [
+                                        {
+                                            'name': env_name,
+                                            'value': env_value,
+                                        } for env_name, env_value in environment_variables.items()
+                                    ],
+                                    'image': 'ocadotechnology/aimmo-game:%s' % os.environ.get('IMAGE_SUFFIX', 'latest'),
+                                    'ports': [
+                                        {
+                                            'containerPort': 5000,
+                                        },
+                                    ],
+                                    'name': 'aimmo-game',
+                                    'resources': pod_spec['resources'],
+                                },
+                            ],
+                        },
+                    },
+                },
+            },
+        )
+        try:
+            rc.create()
+        except pykube.exceptions.HTTPError as err:
+            if 'already exists' not in err.message:
+                raise
+            rc.reload()
+            rc.obj['spec']['replicas'] = self.standby_games
+            rc.update()
+
+    @staticmethod
+    def _is_standby_ready(pod, host):
+        status = pod.obj.get('status', {})
+        return (status.get('phase') == 'Running' and status.get('podIP') and
+                (host is None or pod.obj['spec'].get('nodeName') == host))
+
+    def _claim_standby(self, id, environment_variables):
+        """
+        Give one of the standby game servers this game, if one is ready (on
+        the game's host, if it has one). Returns whether one was.
+
+        The claimed pod is relabelled as the game's, so the standby
+        replication controller starts another in its place, and the game's
+        own replication controller adopts it rather than starting a new pod.
+        """
+        host = self._scheduler.get_placement(id)[0]
+        for pod in pykube.Pod.objects(self._api).filter(selector={'app': 'aimmo-game-standby'}):
+            if not self._is_standby_ready(pod, host):
+                continue
+            pod.obj['metadata']['labels'] = {
+                'app': 'aimmo-game',
+                'game_id': id,
+            }
+            try:
+                pod.update()
+            except pykube.exceptions.HTTPError as err:
+                LOGGER.debug('Could not claim standby pod %s: %s', pod.name, err)
+                continue
+            try:
+                requests.post('http://%s:5000/configure/' % pod.obj['status']['podIP'],
+                              json=environment_variables, timeout=10).raise_for_status()
+            except requests.RequestException as err:
+                LOGGER.warning('Could not configure standby pod %s for game %s: %s', pod.name, id, err)
+                pod.delete()
+                return False
+            LOGGER.info('Standby pod %s given game %s', pod.name, id)
+            return True
+        return False
+
+    def _create_game_rc(self, id, environment_variables):
+        host, demand = self._scheduler.get_placement(id)
+        pod_spec = self._game_pod_spec(host, demand)
         rc = pykube.ReplicationController(
             self._api,
             {
@@ -218,18 +492,10 @@ class KubernetesWorkerManager(WorkerManager):
                                         },
                                     ],
                                     'name': 'aimmo-game',
-                                    'resources': {
-                                        'limits': {
-                                            'cpu': '1000m',
-                                            'memory': '128Mi',
-                                        },
-                                        'requests': {
-                                            'cpu': '100m',
-                                            'memory': '64Mi',
-                                        },
-                                    },
+                                    'resources': pod_spec['resources'],
                                 },
                             ],
+                            'nodeSelector': pod_spec.get('nodeSelector', {}),
                         },
                     },
                 },
@@ -269,7 +535,7 @@ class KubernetesWorkerManager(WorkerManager):
         service.create()
 
     def remove_worker(self, game_id):
-        for object_type in (pykube.ReplicationController, pykube.Service):
+        for object_type in (pykube.ReplicationController, pykube.Service, pykube.Pod):
             for game in object_type.objects(self._api).\
                 filter(selector={'app': 'aimmo-game',
                                  'game_id': game_id}):
@@ -284,8 +550,13 @@ class KubernetesWorkerManager(WorkerManager):
                 LOGGER.warning('Service for game %s already existed', id)
             else:
                 raise
-        self._create_game_rc(id, data)
-        LOGGER.info("Worker started for %s", id)
+        environment_variables = self._game_environment(id, data)
+        if self.standby_games and self._claim_standby(id, environment_variables):
+            boot = 'standby server'
+        else:
+            boot = 'new server'
+        self._create_game_rc(id, environment_variables)
+        LOGGER.info("Worker started for %s on host %s (%s)", id, self._scheduler.get_placement(id)[0], boot)
 
 
 WORKER_MANAGERS = {
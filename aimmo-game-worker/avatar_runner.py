@@ -0,0 +1,103 @@
+import imp
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from simulation.avatar.avatar_state import AvatarState
+from simulation.world_map import WorldMap
+
+LOGGER = logging.getLogger(__name__)
+
+# Largest snapshot, as encoded JSON, we pass back to the game to keep
+MAX_STATE_SIZE = 64 * 1024
+
+try:
+    cpu_time = time.process_time
+except AttributeError:
+    # Python 2: on Unix, clock() is the processor time used by this process
+    cpu_time = time.clock
+
+
+class TurnTimer(object):
+    """
+    Records the wall and CPU time spent in each stage of a turn:
+        - decode: parsing the request and building the world map.
+        - user_code: the player's handle_turn.
+        - encode: serialising the chosen action.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def measure(self, stage):
+        start_wall, start_cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            timing = self.timings.setdefault(stage, {'wall': 0.0, 'cpu': 0.0})
+            timing['wall'] += time.time() - start_wall
+            timing['cpu'] += cpu_time() - start_cpu
+
+
+def load_avatar(code, options, module_name='avatar', state=None):
+    """
+    Compile a player's code into its own module and instantiate its Avatar,
+    giving it back any state snapshotted from its previous worker.
+    """
+    module = imp.new_module(module_name)
+    exec(compile(code, '{}.py'.format(module_name), 'exec'), module.__dict__)
+    avatar = module.Avatar(**options)
+    restore_avatar(avatar, state)
+    return avatar
+
+
+def snapshot_avatar(avatar, max_size=MAX_STATE_SIZE):
+    """
+    The state an avatar wants to keep across worker restarts, from its
+    optional get_state(). None if it has none, or if it cannot be encoded as
+    JSON in under `max_size` bytes.
+    """
+    get_state = getattr(avatar, 'get_state', None)
+    if get_state is None:
+        return None
+    try:
+        state = get_state()
+        encoded = json.dumps(state)
+    except Exception as err:
+        LOGGER.info('Could not snapshot avatar: %r', err)
+        return None
+    if len(encoded) > max_size:
+        LOGGER.info('Avatar state too large to keep (%d bytes)', len(encoded))
+        return None
+    return state
+
+
+def restore_avatar(avatar, state):
+    """Hand a snapshot to the avatar's optional set_state()."""
+    set_state = getattr(avatar, 'set_state', None)
+    if state is None or set_state is None:
+        return
+    try:
+        set_state(state)
+    except Exception as err:
+        # The avatar can still play, it just has to warm up again
+        LOGGER.info('Avatar could not restore its state: %r', err)
+
+
+def process_turn(avatar, data, timer=None):
+    if timer is None:
+        timer = TurnTimer()
+
+    with timer.measure('decode'):
+        world_map = WorldMap(**data['world_map'])
+        avatar_state = AvatarState(**data['avatar_state'])
+
+    with timer.measure('user_code'):
+        action = avatar.handle_turn(avatar_state, world_map)
+
+    with timer.measure('encode'):
+        serialised_action = action.serialise()
+
+    return {'action': serialised_action, 'timings': timer.timings}
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Compares how quickly each worker runtime can answer its first turn, and how
+much memory it uses once it has.
+
+    python benchmark-startup.py [runs]
+"""
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+CODE = '''
+class Avatar(object):
+    def handle_turn(self, avatar_state, world_map):
+        from simulation.action import WaitAction
+        return WaitAction()
+'''
+
+avatar = {'location': {'x': 0, 'y': 0}, 'health': 5, 'score': 0, 'events': []}
+TURN_DATA = {
+    'avatar_state': avatar,
+    'world_map': {
+        'cells': [
+            {'location': {'x': 0, 'y': 0}, 'habitable': True, 'avatar': avatar, 'pickup': None},
+        ],
+    },
+}
+
+RUNTIMES = {
+    'flask': 'service.py',
+    'minimal': 'minimal_service.py',
+}
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def rss_kb(pid):
+    with open('/proc/{}/status'.format(pid)) as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+def time_to_first_turn(script, directory):
+    port = free_port()
+    url = 'http://127.0.0.1:{}/turn/'.format(port)
+    env = dict(os.environ, PYTHONPATH=directory)
+    start = time.time()
+    process = subprocess.Popen([sys.executable, script, '127.0.0.1', str(port), directory], env=env)
+    try:
+        while True:
+            try:
+                requests.post(url, json=TURN_DATA).raise_for_status()
+                break
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.005)
+        return time.time() - start, rss_kb(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(runs):
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, 'avatar.py'), 'w') as avatar_file:
+            avatar_file.write(CODE)
+        with open(os.path.join(directory, 'options.json'), 'w') as options_file:
+            json.dump({}, options_file)
+        for name, script in sorted(RUNTIMES.items()):
+            results = [time_to_first_turn(script, directory) for _ in range(runs)]
+            times = sorted(seconds for (seconds, _) in results)
+            print('{:8} first turn: median {:.3f}s, best {:.3f}s; RSS {} kB'.format(
+                name, times[len(times) // 2], times[0], max(rss for (_, rss) in results)))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
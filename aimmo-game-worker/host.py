@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+"""
+Serves many players' avatars from one process.
+
+Flask and the simulation helpers are imported once by this supervisor; each
+player's code then runs in a forked child which shares those pages with the
+supervisor, so a player costs a few MB rather than a whole Python runtime.
+Turns are passed to the children over pipes.
+
+The children are forked by a spawner process, itself forked as this module is
+imported, before the supervisor starts any threads (see Spawner).
+
+Where the operator allows it (SHARE_AVATARS), players whose avatars are
+identical and seem to keep no state share a single child, so a class of
+players all starting from the same example code costs about as much as one
+player.
+"""
+import ast
+import errno
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing import reduction
+
+import _multiprocessing
+
+import flask
+from werkzeug.serving import WSGIRequestHandler
+
+from avatar_runner import load_avatar, process_turn, restore_avatar, snapshot_avatar
+
+app = flask.Flask(__name__)
+LOGGER = logging.getLogger(__name__)
+
+TURN_TIMEOUT = float(os.environ.get('TURN_TIMEOUT', 1.0))
+# Seconds a new child has to load the player's code
+LOAD_TIMEOUT = float(os.environ.get('LOAD_TIMEOUT', 5.0))
+# Whether players with identical code may share a child. The check that
+# their code keeps no state can be got around, so this is only for when the
+# players trust each other, such as a class working through the examples.
+SHARE_AVATARS = bool(os.environ.get('SHARE_AVATARS'))
+
+
+class AvatarProcessError(Exception):
+    pass
+
+
+class AvatarTimeoutError(AvatarProcessError):
+    pass
+
+
+def _is_docstring(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Str)
+
+
+def is_shareable(code):
+    """
+    Whether one instance of this code's Avatar can play for many players.
+
+    An Avatar class can say so itself with `shared = True` (or refuse with
+    `shared = False`). Otherwise we only share code that plainly keeps no
+    state: a module of just imports, functions and classes, whose classes
+    only define methods, and which never assigns to an attribute or a global.
+
+    This is a guess, which determined code can get around (with mutable
+    default arguments, say), so sharing has to be allowed by SHARE_AVATARS too.
+    """
+    try:
+        module = ast.parse(code)
+    except SyntaxError:
+        return False
+    avatar_class = next((node for node in module.body
+                         if isinstance(node, ast.ClassDef) and node.name == 'Avatar'), None)
+    if avatar_class is None:
+        return False
+    for node in avatar_class.body:
+        if isinstance(node, ast.Assign) and [getattr(target, 'id', None) for target in node.targets] == ['shared']:
+            try:
+                return bool(ast.literal_eval(node.value))
+            except ValueError:
+                return False
+
+    for node in module.body:
+        if not (isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)) or _is_docstring(node)):
+            return False
+    for node in ast.walk(module):
+        if isinstance(node, ast.ClassDef):
+            if not all(isinstance(item, ast.FunctionDef) or _is_docstring(item) for item in node.body):
+                return False
+        elif isinstance(node, ast.Global):
+            return False
+        elif isinstance(node, ast.Attribute) and not isinstance(node.ctx, ast.Load):
+            return False
+        elif isinstance(node, ast.Call) and getattr(node.func, 'id', None) in ('setattr', 'delattr'):
+            return False
+    return True
+
+
+def _share_key(code, options):
+    return hashlib.sha1(json.dumps([code, options], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _serve_avatar(connection, code, options, state, shared):
+    try:
+        avatar = load_avatar(code, options, state=state)
+    except Exception as err:
+        avatar, load_error = None, 'Could not load avatar: %r' % err
+    connection.send({'loaded': True} if avatar is not None else {'error': load_error})
+    while True:
+        command, data = connection.recv()
+        if avatar is None:
+            connection.send({'error': load_error})
+            continue
+        try:
+            if shared:
+                # So nothing one player's turn leaves on it is seen by the next
+                avatar = avatar.__class__(**options)
+            if command == 'snapshot':
+                result = {'state': snapshot_avatar(avatar)}
+            elif command == 'restore':
+                restore_avatar(avatar, data)
+                result = {}
+            else:
+                result = process_turn(avatar, data)
+        except Exception as err:
+            result = {'error': repr(err)}
+        connection.send(result)
+
+
+def _run_spawner(connection):
+    # Children are reaped as they exit, as nothing here waits for them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    supervisor_pid = os.getppid()
+    while True:
+        try:
+            args = connection.recv()
+        except EOFError:
+            return
+        parent_connection, child_connection = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                connection.close()
+                parent_connection.close()
+                _serve_avatar(child_connection, *args)
+            finally:
+                os._exit(0)
+        child_connection.close()
+        connection.send(pid)
+        reduction.send_handle(connection, parent_connection.fileno(), supervisor_pid)
+        parent_connection.close()
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno != errno.ESRCH
+    return True
+
+
+class Spawner(object):
+    """
+    Forks the avatar children from a process of its own. The supervisor
+    serves requests from many threads, and forking it could copy a lock some
+    other thread holds into the child, which would then wait for it forever.
+    The spawner only ever has the one thread, so it must be started before
+    the supervisor starts any others; the child's end of its pipe is passed
+    back to the supervisor.
+
+    This class is thread safe
+    """
+
+    def __init__(self):
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_run_spawner, args=(child_connection,),
+                                                name='avatar-spawner')
+        self._process.daemon = True
+        self._process.start()
+        child_connection.close()
+        self._lock = threading.Lock()
+
+    def spawn(self, code, options, state, shared):
+        """Fork a child serving the avatar. Returns its pid and a connection to it."""
+        with self._lock:
+            try:
+                self._connection.send((code, options, state, shared))
+                pid = self._connection.recv()
+                handle = reduction.recv_handle(self._connection)
+            except (EOFError, IOError) as err:
+                raise AvatarProcessError('Could not start avatar process: %r' % err)
+        return pid, _multiprocessing.Connection(handle)
+
+
+spawner = Spawner()
+
+
+class AvatarProcess(object):
+    """
+    A forked child running a single player's avatar, or the avatar shared
+    by several players, which is made afresh for each turn. It is started
+    straight away, and has loaded the code by the time this is created: if
+    it could not, load_error says why.
+    """
+
+    def __init__(self, player_id, code, options, state=None, shared=False):
+        self.player_id = player_id
+        self.code = code
+        self.options = options
+        self.shared = shared
+        # Given to the child again whenever it has to be restarted
+        self.state = state
+        self.pid = None
+        self.load_error = None
+        self._connection = None
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self.pid, self._connection = spawner.spawn(self.code, self.options, self.state, self.shared)
+        try:
+            if not self._connection.poll(LOAD_TIMEOUT):
+                raise AvatarProcessError('Avatar took longer than %ss to load' % LOAD_TIMEOUT)
+            self.load_error = self._connection.recv().get('error')
+        except (AvatarProcessError, EOFError, IOError) as err:
+            # Tried again on its next turn
+            self.stop()
+            self.load_error = str(err) or 'Avatar process exited while loading'
+
+    def is_alive(self):
+        return self.pid is not None and _is_running(self.pid)
+
+    def process_turn(self, data, timeout=TURN_TIMEOUT):
+        return self._call('turn', data, timeout)
+
+    def snapshot(self, timeout=TURN_TIMEOUT):
+        self.state = self._call('snapshot', None, timeout)['state']
+        return self.state
+
+    def restore(self, state, timeout=TURN_TIMEOUT):
+        """Give the avatar state snapshotted from the one it replaces."""
+        self.state = state
+        try:
+            self._call('restore', state, timeout)
+        except AvatarProcessError as err:
+            # Restarted (or restarting) with the state anyway
+            LOGGER.info('Could not restore state of avatar %s: %s', self.player_id, err)
+
+    def _call(self, command, data, timeout):
+        with self._lock:
+            if not self.is_alive():
+                LOGGER.warning('Avatar process for %s died, restarting', self.player_id)
+                self.stop()
+                self._start()
+            if self.load_error is not None:
+                raise AvatarProcessError(self.load_error)
+            try:
+                self._connection.send((command, data))
+                if not self._connection.poll(timeout):
+                    # The late reply would be read as the next turn's action
+                    LOGGER.warning('Avatar %s timed out, restarting', self.player_id)
+                    self.stop()
+                    self._start()
+                    raise AvatarTimeoutError('Avatar took longer than %ss' % timeout)
+                result = self._connection.recv()
+            except (EOFError, IOError):
+                self.stop()
+                self._start()
+                raise AvatarProcessError('Avatar process exited during its turn')
+        if 'error' in result:
+            raise AvatarProcessError(result['error'])
+        return result
+
+    def stop(self):
+        """Kill the child, if it's running, waiting for it to go."""
+        if self._connection is None:
+            return
+        self._connection.close()
+        self._connection = None
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        # The spawner reaps it; until then it's still there
+        while _is_running(self.pid):
+            time.sleep(0.01)
+
+
+class AvatarHost(object):
+    """
+    The set of avatars served by this host.
+    This class is thread safe
+    """
+
+    def __init__(self, share_avatars=SHARE_AVATARS):
+        self.share_avatars = share_avatars
+        self._avatars = {}
+        # Children that play for every player with the same shareable code
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    def _stop_if_unused(self, avatar):
+        assert self._lock.locked()
+        if avatar is None or avatar in self._avatars.values():
+            return None
+        for key, shared_avatar in list(self._shared.items()):
+            if shared_avatar is avatar:
+                del self._shared[key]
+        return avatar
+
+    def add_avatar(self, player_id, code, options, state=None, process=None):
+        """
+        Serve the player with the code, in place of any avatar it had.
+        `process` is an AvatarProcess already started with the code and
+        state, to use rather than starting another.
+        """
+        share_key = None
+        if self.share_avatars and state is None and is_shareable(code):
+            share_key = _share_key(code, options)
+            if process is not None and not process.shared:
+                process.stop()
+                process = None
+        # Children are started outside the lock, as loading takes a while
+        while True:
+            with self._lock:
+                new_avatar = self._shared.get(share_key, process)
+                if new_avatar is not None:
+                    if share_key is not None:
+                        self._shared[share_key] = new_avatar
+                    old_avatar = self._avatars.get(player_id)
+                    self._avatars[player_id] = new_avatar
+                    unused_avatars = [self._stop_if_unused(old_avatar)]
+                    if process is not new_avatar:
+                        unused_avatars.append(process)
+                    break
+            if share_key is None:
+                process = AvatarProcess(player_id, code, options, state)
+            else:
+                process = AvatarProcess('shared-%s' % share_key[:8], code, options, shared=True)
+        for unused_avatar in unused_avatars:
+            if unused_avatar is not None:
+                unused_avatar.stop()
+
+    def process_turn(self, player_id, data, timeout=TURN_TIMEOUT):
+        """
+        Have the player's avatar take its turn. A shared child whose turn for
+        the player times out has to be restarted. No other player loses
+        anything by that, as the child keeps no avatar between turns. The
+        player is then given a child of its own, so that it can't hold up
+        the others again.
+        """
+        avatar = self.get_avatar(player_id)
+        try:
+            return avatar.process_turn(data, timeout)
+        except AvatarTimeoutError:
+            if avatar.shared:
+                self._unshare(player_id, avatar)
+            raise
+
+    def _unshare(self, player_id, shared_avatar):
+        LOGGER.info('Moving avatar %s out of its shared process', player_id)
+        own_avatar = AvatarProcess(player_id, shared_avatar.code, shared_avatar.options)
+        with self._lock:
+            if self._avatars.get(player_id) is shared_avatar:
+                self._avatars[player_id] = own_avatar
+                unused_avatar = self._stop_if_unused(shared_avatar)
+            else:
+                # Its code changed, or it left, meanwhile
+                unused_avatar = own_avatar
+        if unused_avatar is not None:
+            unused_avatar.stop()
+
+    def remove_avatar(self, player_id):
+        with self._lock:
+            unused_avatar = self._stop_if_unused(self._avatars.pop(player_id, None))
+        if unused_avatar is not None:
+            unused_avatar.stop()
+
+    def get_avatar(self, player_id):
+        with self._lock:
+            return self._avatars[player_id]
+
+    @property
+    def player_ids(self):
+        with self._lock:
+            return list(self._avatars)
+
+    @property
+    def process_count(self):
+        with self._lock:
+            return len(set(self._avatars.values()))
+
+
+avatar_host = AvatarHost()
+
+
+@app.route('/')
+def healthcheck():
+    return flask.jsonify(players=avatar_host.player_ids, processes=avatar_host.process_count)
+
+
+@app.route('/players/<int:player_id>/', methods=['PUT'])
+def add_player(player_id):
+    data = flask.request.get_json()
+    avatar_host.add_avatar(player_id, data['code'], data.get('options', {}), data.get('state'))
+    return 'ADDED'
+
+
+@app.route('/players/<int:player_id>/snapshot/')
+def snapshot_player(player_id):
+    try:
+        avatar = avatar_host.get_avatar(player_id)
+    except KeyError:
+        flask.abort(404)
+    try:
+        state = avatar.snapshot()
+    except AvatarProcessError as err:
+        LOGGER.info('Could not snapshot avatar %s: %s', player_id, err)
+        state = avatar.state
+    return flask.jsonify(state=state)
+
+
+@app.route('/players/<int:player_id>/reload/', methods=['POST'])
+def reload_player(player_id):
+    if player_id not in avatar_host.player_ids:
+        flask.abort(404)
+    data = flask.request.get_json()
+    code, options = data['code'], data.get('options', {})
+    # Only replace the running avatar with code that loads, which is found
+    # out in a child of its own, as the code is the player's
+    try:
+        new_avatar = AvatarProcess(player_id, code, options)
+    except AvatarProcessError as err:
+        return flask.jsonify(error=str(err)), 500
+    if new_avatar.load_error is not None:
+        new_avatar.stop()
+        LOGGER.info('Keeping old avatar for %s, new code failed to load: %s', player_id, new_avatar.load_error)
+        return flask.jsonify(error=new_avatar.load_error), 400
+    try:
+        old_avatar = avatar_host.get_avatar(player_id)
+    except KeyError:
+        # Removed while the new code was loading
+        new_avatar.stop()
+        flask.abort(404)
+    try:
+        state = old_avatar.snapshot()
+    except AvatarProcessError:
+        state = old_avatar.state
+    if state is not None:
+        new_avatar.restore(state)
+    avatar_host.add_avatar(player_id, code, options, state, process=new_avatar)
+    return 'RELOADED'
+
+
+@app.route('/players/<int:player_id>/', methods=['DELETE'])
+def remove_player(player_id):
+    avatar_host.remove_avatar(player_id)
+    return 'REMOVED'
+
+
+@app.route('/players/<int:player_id>/turn/', methods=['POST'])
+def player_turn(player_id):
+    try:
+        result = avatar_host.process_turn(player_id, flask.request.get_json())
+    except KeyError:
+        flask.abort(404)
+    except AvatarProcessError as err:
+        LOGGER.info('Avatar %s failed to take its turn: %s', player_id, err)
+        return flask.jsonify(error=str(err)), 500
+    return flask.jsonify(**result)
+
+
+def run(host, port):
+    logging.basicConfig(level=logging.INFO)
+    app.config['DEBUG'] = False
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    app.run(host, port, threaded=True)
+
+if __name__ == '__main__':
+    run(host=sys.argv[1], port=int(sys.argv[2]))
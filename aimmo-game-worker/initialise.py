@@ -25,6 +25,12 @@ def main(args, url):
     with open('{}/avatar.py'.format(data_dir), 'w') as avatar_file:
         avatar_file.write(code)
 
+    # Left by the player's previous worker
+    state = data.get('state')
+    if state is not None:
+        with open('{}/state.json'.format(data_dir), 'w') as state_file:
+            json.dump(state, state_file)
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     main(sys.argv, url=os.environ['DATA_URL'])
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+A worker with the same HTTP API as service.py, built only on the standard
+library so it starts faster and uses less memory than the Flask worker.
+
+Nothing beyond the HTTP server is imported until it is needed: the avatar
+runner and simulation helpers on first load of an avatar, and the turn
+stream on the first request for it. When DATA_URL is set, the player's code
+is fetched in this process rather than by a separate initialise.py run.
+"""
+import json
+import logging
+import os
+import sys
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.request import urlopen
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import urlopen
+
+LOGGER = logging.getLogger(__name__)
+
+worker_avatar = None
+stream_server = None
+
+
+def _load_avatar(code, options, state=None):
+    from avatar_runner import load_avatar
+    return load_avatar(code, options, state=state)
+
+
+def _get_stream_server(host):
+    global stream_server
+    if stream_server is None:
+        from stream import TurnStreamServer
+        stream_server = TurnStreamServer((host, 0), lambda: worker_avatar)
+        stream_server.start()
+    return stream_server
+
+
+class WorkerRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 lets the game keep its connection to us open between turns.
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body, content_type='text/html'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data), 'application/json')
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def do_GET(self):
+        if self.path == '/':
+            self._send(200, 'HEALTHY' if worker_avatar is not None else 'IDLE')
+        elif self.path == '/snapshot/':
+            if worker_avatar is None:
+                self._send(404, 'Worker has no avatar yet')
+                return
+            from avatar_runner import snapshot_avatar
+            self._send_json(200, {'state': snapshot_avatar(worker_avatar)})
+        elif self.path == '/stream/':
+            self._send_json(200, {'port': _get_stream_server(self.server.server_address[0]).port})
+        else:
+            self._send(404, 'Not Found')
+
+    def do_POST(self):
+        handlers = {
+            '/turn/': self._turn,
+            '/initialise/': self._initialise,
+            '/reload/': self._reload,
+        }
+        try:
+            handler = handlers[self.path]
+        except KeyError:
+            self._send(404, 'Not Found')
+            return
+        try:
+            handler()
+        except Exception as err:
+            LOGGER.exception('Error while handling %s', self.path)
+            self._send_json(500, {'error': repr(err)})
+
+    def _turn(self):
+        if worker_avatar is None:
+            self._send(503, 'Worker has no avatar yet')
+            return
+        from avatar_runner import TurnTimer, process_turn
+        timer = TurnTimer()
+        with timer.measure('decode'):
+            data = self._read_json()
+        self._send_json(200, process_turn(worker_avatar, data, timer))
+
+    def _initialise(self):
+        global worker_avatar
+        if worker_avatar is not None:
+            self._send(409, 'Worker already has an avatar')
+            return
+        data = self._read_json()
+        worker_avatar = _load_avatar(data['code'], data.get('options', {}), data.get('state'))
+        self._send(200, 'INITIALISED')
+
+    def _reload(self):
+        global worker_avatar
+        from avatar_runner import snapshot_avatar
+        data = self._read_json()
+        try:
+            new_avatar = _load_avatar(data['code'], data.get('options', {}), snapshot_avatar(worker_avatar))
+        except Exception as err:
+            LOGGER.info('Keeping old avatar, new code failed to load: %r', err)
+            self._send_json(400, {'error': repr(err)})
+            return
+        worker_avatar = new_avatar
+        self._send(200, 'RELOADED')
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+
+def load_initial_avatar(directory=None, data_url=None):
+    if directory is not None:
+        with open('{}/options.json'.format(directory)) as option_file:
+            options = json.load(option_file)
+        state = None
+        if os.path.exists('{}/state.json'.format(directory)):
+            with open('{}/state.json'.format(directory)) as state_file:
+                state = json.load(state_file)
+        with open('{}/avatar.py'.format(directory)) as avatar_file:
+            return _load_avatar(avatar_file.read(), options, state)
+    if data_url is not None:
+        data = json.loads(urlopen(data_url).read().decode('utf-8'))
+        return _load_avatar(data['code'], data['options'], data.get('state'))
+    # Started idle, waiting for /initialise/
+    return None
+
+
+class WorkerServer(ThreadingMixIn, HTTPServer):
+    """
+    A thread per connection, as the game keeps its turn connection open and
+    /snapshot/ and /reload/ come in on others.
+    """
+    daemon_threads = True
+
+
+def run(host, port, directory=None, data_url=None):
+    logging.basicConfig(level=logging.INFO)
+    global worker_avatar
+    worker_avatar = load_initial_avatar(directory, data_url)
+    WorkerServer((host, port), WorkerRequestHandler).serve_forever()
+
+if __name__ == '__main__':
+    run(host=sys.argv[1], port=int(sys.argv[2]),
+        directory=sys.argv[3] if len(sys.argv) > 3 else None,
+        data_url=os.environ.get('DATA_URL'))
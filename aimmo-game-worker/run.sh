@@ -1,9 +1,18 @@
 #!/bin/bash
 
-#TODO: no longer needed?
-
 set -e
 
+# WORKER_RUNTIME=minimal selects the stdlib-only worker, which starts faster
+# and fetches its own code from DATA_URL.
+if [ "$WORKER_RUNTIME" = "minimal" ]; then
+    exec python ./minimal_service.py $1 $2
+fi
+
+# Pooled workers are started without a player and given one via /initialise/
+if [ -z "$DATA_URL" ]; then
+    exec python ./service.py $1 $2
+fi
+
 dir=$(mktemp -d)
 
 python ./initialise.py $dir
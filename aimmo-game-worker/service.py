@@ -1,43 +1,104 @@
 #!/usr/bin/env python
 import json
 import logging
+import os
 import sys
 
 import flask
+from werkzeug.serving import WSGIRequestHandler
 
-from simulation.avatar.avatar_state import AvatarState
-from simulation.world_map import WorldMap
+from avatar_runner import TurnTimer, load_avatar, process_turn as run_turn, restore_avatar, snapshot_avatar
+from stream import TurnStreamServer
 
 app = flask.Flask(__name__)
 LOGGER = logging.getLogger(__name__)
 
 worker_avatar = None
+stream_server = None
 
 
-@app.route('/turn/', methods=['POST'])
-def process_turn():
-    LOGGER.info('Calculating action')
+@app.route('/')
+def healthcheck():
+    return 'HEALTHY' if worker_avatar is not None else 'IDLE'
+
+
+@app.route('/initialise/', methods=['POST'])
+def initialise():
+    """Give an idle (pooled) worker a player's code and options."""
+    global worker_avatar
+    if worker_avatar is not None:
+        flask.abort(409)
+    data = flask.request.get_json()
+    worker_avatar = load_avatar(data['code'], data.get('options', {}), state=data.get('state'))
+    return 'INITIALISED'
+
+
+@app.route('/reload/', methods=['POST'])
+def reload_avatar():
+    """Swap in new code for the avatar, keeping the old one if it doesn't load."""
+    global worker_avatar
     data = flask.request.get_json()
+    try:
+        new_avatar = load_avatar(data['code'], data.get('options', {}),
+                                 state=snapshot_avatar(worker_avatar))
+    except Exception as err:
+        LOGGER.info('Keeping old avatar, new code failed to load: %r', err)
+        return flask.jsonify(error=repr(err)), 400
+    # Turns already under way finish with the avatar they started with
+    worker_avatar = new_avatar
+    return 'RELOADED'
 
-    world_map = WorldMap(**data['world_map'])
-    avatar_state = AvatarState(**data['avatar_state'])
 
-    action = worker_avatar.handle_turn(avatar_state, world_map)
+@app.route('/snapshot/')
+def snapshot():
+    """The avatar's state, for the game to give to a replacement worker."""
+    if worker_avatar is None:
+        flask.abort(404)
+    return flask.jsonify(state=snapshot_avatar(worker_avatar))
 
-    return flask.jsonify(action=action.serialise())
 
+@app.route('/stream/')
+def stream_details():
+    """Where to open a persistent turn channel instead of POSTing turns."""
+    if stream_server is None:
+        flask.abort(404)
+    return flask.jsonify(port=stream_server.port)
 
-def run(host, port, directory):
+
+@app.route('/turn/', methods=['POST'])
+def process_turn():
+    if worker_avatar is None:
+        flask.abort(503)
+    LOGGER.info('Calculating action')
+    timer = TurnTimer()
+    with timer.measure('decode'):
+        data = flask.request.get_json()
+
+    return flask.jsonify(**run_turn(worker_avatar, data, timer))
+
+
+def run(host, port, directory=None):
     logging.basicConfig(level=logging.DEBUG)
 
-    with open('{}/options.json'.format(directory)) as option_file:
-        options = json.load(option_file)
-    from avatar import Avatar
-    global worker_avatar
-    worker_avatar = Avatar(**options)
+    # Without a directory we start idle and wait for /initialise/
+    if directory is not None:
+        with open('{}/options.json'.format(directory)) as option_file:
+            options = json.load(option_file)
+        from avatar import Avatar
+        global worker_avatar
+        worker_avatar = Avatar(**options)
+        if os.path.exists('{}/state.json'.format(directory)):
+            with open('{}/state.json'.format(directory)) as state_file:
+                restore_avatar(worker_avatar, json.load(state_file))
+
+    global stream_server
+    stream_server = TurnStreamServer((host, 0), lambda: worker_avatar)
+    stream_server.start()
 
     app.config['DEBUG'] = False
+    # HTTP/1.1 lets the game keep its connection to us open between turns.
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
     app.run(host, port)
 
 if __name__ == '__main__':
-    run(host=sys.argv[1], port=int(sys.argv[2]), directory=sys.argv[3])
+    run(host=sys.argv[1], port=int(sys.argv[2]), directory=sys.argv[3] if len(sys.argv) > 3 else None)
@@ -1,42 +1,200 @@
+import heapq
+from collections import Mapping
+from collections import deque
+
 from geography.cell import Cell
+from geography.direction import ALL_DIRECTIONS
+from geography.location import Location
+
+
+def _manhattan_distance(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+class _Cells(Mapping):
+    """The map's cells by location, read-only and built as they are looked up."""
+
+    def __init__(self, world_map):
+        self._world_map = world_map
+
+    def __getitem__(self, location):
+        try:
+            key = (location.x, location.y)
+        except AttributeError:
+            raise KeyError(location)
+        return self._world_map._get_cell_by_key(key)
+
+    def __contains__(self, location):
+        try:
+            return self._world_map.is_visible(location)
+        except AttributeError:
+            return False
+
+    def __iter__(self):
+        return (Location(*key) for key in self._world_map._cell_data)
+
+    def __len__(self):
+        return len(self._world_map._cell_data)
+
+    def __repr__(self):
+        return repr(dict(self))
 
 
 class WorldMap(object):
 
     """
     The non-player world state.
+
+    The raw cell data sent by the game is only indexed by coordinates here;
+    Cell objects are built the first time they are looked at, as most avatars
+    only look at a handful of cells around them.
+
+    The map is rebuilt every turn, so the results of the (more expensive)
+    spatial queries below are remembered for the rest of the turn.
     """
 
     def __init__(self, cells):
-        self.cells = {}
+        self._cell_data = {}
+        self._pickup_keys = []
+        self._avatar_keys = []
         for cell_data in cells:
-            cell = Cell(**cell_data)
-            self.cells[cell.location] = cell
+            location = cell_data['location']
+            key = (location['x'], location['y'])
+            self._cell_data[key] = cell_data
+            if cell_data.get('pickup'):
+                self._pickup_keys.append(key)
+            if cell_data.get('avatar'):
+                self._avatar_keys.append(key)
+        self._cells = {}
+        self._query_cache = {}
+
+    def _get_cell_by_key(self, key):
+        try:
+            return self._cells[key]
+        except KeyError:
+            cell = Cell(**self._cell_data[key])
+            self._cells[key] = cell
+            return cell
+
+    def _is_habitable(self, key):
+        data = self._cell_data.get(key)
+        return data is not None and bool(data.get('habitable', False))
+
+    def _neighbours(self, key):
+        for direction in ALL_DIRECTIONS:
+            neighbour = (key[0] + direction.x, key[1] + direction.y)
+            if self._is_habitable(neighbour):
+                yield neighbour
+
+    def _cached(self, query, compute):
+        try:
+            return self._query_cache[query]
+        except KeyError:
+            result = compute()
+            self._query_cache[query] = result
+            return result
+
+    @property
+    def cells(self):
+        return _Cells(self)
 
     def all_cells(self):
-        return self.cells.values()
+        return [self._get_cell_by_key(key) for key in self._cell_data]
 
     def pickup_cells(self):
-        return (c for c in self.all_cells() if getattr(c, 'pickup', False))
+        return (self._get_cell_by_key(key) for key in self._pickup_keys)
+
+    def avatar_cells(self):
+        return (self._get_cell_by_key(key) for key in self._avatar_keys)
 
     def partially_fogged_cells(self):
-        return (c for c in self.all_cells() if c.partially_fogged)
+        return (self._get_cell_by_key(key) for (key, data) in self._cell_data.items()
+                if data.get('partially_fogged'))
 
     def is_visible(self, location):
-        return location in self.cells
+        return (location.x, location.y) in self._cell_data
 
     def get_cell(self, location):
-        cell = self.cells[location]
+        cell = self._get_cell_by_key((location.x, location.y))
         assert cell.location == location, 'location lookup mismatch: arg={}, found={}'.format(
             location, cell.location)
         return cell
 
     def can_move_to(self, target_location):
         try:
-            cell = self.get_cell(target_location)
+            data = self._cell_data[(target_location.x, target_location.y)]
         except KeyError:
             return False
-        return getattr(cell, 'habitable', False) and not getattr(cell, 'avatar', False)
+        return bool(data.get('habitable', False)) and not data.get('avatar', False)
+
+    def _nearest(self, keys, location, count):
+        origin = (location.x, location.y)
+        nearest = heapq.nsmallest(count, (key for key in keys if key != origin),
+                                  key=lambda key: _manhattan_distance(key, origin))
+        return [self._get_cell_by_key(key) for key in nearest]
+
+    def nearest_pickups(self, location, count=1):
+        """The `count` pickup cells closest (as the crow walks) to `location`."""
+        return self._cached(('pickups', location.x, location.y, count),
+                            lambda: self._nearest(self._pickup_keys, location, count))
+
+    def nearest_avatars(self, location, count=1):
+        """The `count` cells with other avatars closest to `location`."""
+        return self._cached(('avatars', location.x, location.y, count),
+                            lambda: self._nearest(self._avatar_keys, location, count))
+
+    def distance_field(self, source):
+        """
+        The number of moves from `source` to every habitable cell it can reach,
+        as a dict of Location to distance.
+        """
+        def compute():
+            start = (source.x, source.y)
+            distances = {start: 0}
+            frontier = deque([start])
+            while frontier:
+                key = frontier.popleft()
+                for neighbour in self._neighbours(key):
+                    if neighbour not in distances:
+                        distances[neighbour] = distances[key] + 1
+                        frontier.append(neighbour)
+            return {Location(*key): distance for (key, distance) in distances.items()}
+        return self._cached(('distance_field', source.x, source.y), compute)
+
+    def shortest_path(self, source, target):
+        """
+        The locations to move through to get from `source` to `target` over
+        habitable cells (excluding `source`), or None if it can't be reached.
+        """
+        def compute():
+            start, goal = (source.x, source.y), (target.x, target.y)
+            came_from = {start: None}
+            cost = {start: 0}
+            frontier = [(_manhattan_distance(start, goal), start)]
+            while frontier:
+                _, key = heapq.heappop(frontier)
+                if key == goal:
+                    path = []
+                    while key != start:
+                        path.append(Location(*key))
+                        key = came_from[key]
+                    return list(reversed(path))
+                for neighbour in self._neighbours(key):
+                    new_cost = cost[key] + 1
+                    if neighbour not in cost or new_cost < cost[neighbour]:
+                        cost[neighbour] = new_cost
+                        came_from[neighbour] = key
+                        heapq.heappush(frontier, (new_cost + _manhattan_distance(neighbour, goal), neighbour))
+            return None
+        return self._cached(('path', source.x, source.y, target.x, target.y), compute)
+
+    def direction_towards(self, source, target):
+        """The direction of the first move on a shortest path, or None."""
+        path = self.shortest_path(source, target)
+        if not path:
+            return None
+        step = path[0] - source
+        return next(d for d in ALL_DIRECTIONS if (d.x, d.y) == (step.x, step.y))
 
     def __repr__(self):
         return repr(self.cells)
@@ -0,0 +1,87 @@
+"""
+A persistent channel for turns, as an alternative to a POST per turn.
+
+Frames are a 4-byte big-endian length followed by that many bytes of JSON.
+The game sends {'seq': n, 'state': ...} and we reply with {'seq': n, ...} so
+the game can drop replies that arrive after it has given up on a turn.
+"""
+import json
+import logging
+import socket
+import struct
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from avatar_runner import TurnTimer, process_turn
+
+LOGGER = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+
+
+def _read_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError('Connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame(sock):
+    (size,) = _HEADER.unpack(_read_exactly(sock, _HEADER.size))
+    return json.loads(_read_exactly(sock, size).decode('utf-8'))
+
+
+def write_frame(sock, data):
+    payload = json.dumps(data).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+class _TurnStreamHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                frame = read_frame(self.request)
+            except EOFError:
+                return
+            write_frame(self.request, self.server.process_frame(frame))
+
+
+class TurnStreamServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, get_avatar):
+        socketserver.TCPServer.__init__(self, address, _TurnStreamHandler)
+        self._get_avatar = get_avatar
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def process_frame(self, frame):
+        reply = {'seq': frame.get('seq')}
+        avatar = self._get_avatar()
+        if avatar is None:
+            reply['error'] = 'Worker has no avatar yet'
+            return reply
+        timer = TurnTimer()
+        try:
+            reply.update(process_turn(avatar, frame['state'], timer))
+        except Exception as err:
+            LOGGER.exception('Error while processing turn')
+            reply['error'] = repr(err)
+        return reply
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
@@ -45,6 +45,21 @@ class TestWorldMap(TestCase):
         map = WorldMap(cells)
         self.assertLocationsEqual(map.pickup_cells(), (Location(-1, -1), Location(1, 1)))
 
+    def test_cells_by_location(self):
+        map = WorldMap(self._generate_cells())
+        cell = map.cells[Location(1, 0)]
+        self.assertEqual(cell.location, Location(1, 0))
+        # The same cell each time, so changes to it stick
+        self.assertIs(map.cells[Location(1, 0)], cell)
+        self.assertIn(Location(0, 0), map.cells)
+        self.assertNotIn(Location(2, 0), map.cells)
+        self.assertEqual(len(map.cells), 9)
+        self.assertEqual(set(map.cells), {Location(x, y) for x in range(-1, 2) for y in range(-1, 2)})
+        with self.assertRaises(KeyError):
+            map.cells[Location(2, 0)]
+        with self.assertRaises(TypeError):
+            map.cells[Location(0, 0)] = cell
+
     def test_location_is_visible(self):
         map = WorldMap(self._generate_cells())
         for x in (0, 1):
@@ -107,3 +122,93 @@ class TestWorldMap(TestCase):
         cells[1]['avatar'] = self.AVATAR
         map = WorldMap(cells)
         self.assertFalse(map.can_move_to(Location(-1, 0)))
+
+    def test_cells_built_lazily(self):
+        map = WorldMap(self._generate_cells())
+        self.assertEqual(map._cells, {})
+        map.get_cell(Location(0, 0))
+        self.assertEqual(list(map._cells), [(0, 0)])
+
+    def test_same_cell_returned_on_each_access(self):
+        map = WorldMap(self._generate_cells())
+        self.assertIs(map.get_cell(Location(1, 0)), map.get_cell(Location(1, 0)))
+
+    def test_can_move_to_does_not_build_cells(self):
+        map = WorldMap(self._generate_cells())
+        self.assertTrue(map.can_move_to(Location(1, 1)))
+        self.assertEqual(map._cells, {})
+
+    def test_pickup_cells_only_builds_pickup_cells(self):
+        cells = self._generate_cells()
+        cells[0]['pickup'] = {'health_restored': 5}
+        map = WorldMap(cells)
+        list(map.pickup_cells())
+        self.assertEqual(list(map._cells), [(-1, -1)])
+
+    def _generate_map(self, rows):
+        """Build a map from rows of text, top row first: '#' is a wall, 'p' a pickup, 'a' an avatar."""
+        cells = []
+        for y, row in enumerate(reversed(rows)):
+            for x, char in enumerate(row):
+                cells.append({
+                    'location': {'x': x, 'y': y},
+                    'habitable': char != '#',
+                    'avatar': self.AVATAR if char == 'a' else None,
+                    'pickup': {'health_restored': 3} if char == 'p' else None,
+                })
+        return WorldMap(cells)
+
+    def test_nearest_pickups(self):
+        map = self._generate_map(['p...',
+                                  '....',
+                                  '...p',
+                                  'p...'])
+        self.assertLocationsEqual(map.nearest_pickups(Location(3, 0)), [Location(3, 1)])
+        self.assertLocationsEqual(map.nearest_pickups(Location(3, 0), count=2),
+                                  [Location(3, 1), Location(0, 0)])
+
+    def test_nearest_avatars_excludes_own_cell(self):
+        map = self._generate_map(['a..a',
+                                  'a...'])
+        self.assertLocationsEqual(map.nearest_avatars(Location(0, 0)), [Location(0, 1)])
+
+    def test_nearest_with_nothing_visible(self):
+        map = self._generate_map(['...'])
+        self.assertEqual(map.nearest_pickups(Location(0, 0)), [])
+
+    def test_distance_field_goes_around_walls(self):
+        map = self._generate_map(['...',
+                                  '.#.',
+                                  '.#.'])
+        distances = map.distance_field(Location(0, 0))
+        self.assertEqual(distances[Location(2, 0)], 6)
+        self.assertEqual(distances[Location(1, 2)], 3)
+        self.assertNotIn(Location(1, 1), distances)
+
+    def test_shortest_path(self):
+        map = self._generate_map(['...',
+                                  '.#.',
+                                  '.#.'])
+        path = map.shortest_path(Location(0, 0), Location(2, 0))
+        self.assertEqual(len(path), 6)
+        self.assertEqual(path[-1], Location(2, 0))
+        for a, b in zip([Location(0, 0)] + path, path):
+            self.assertEqual(abs(a.x - b.x) + abs(a.y - b.y), 1)
+            self.assertTrue(map.get_cell(b).habitable)
+
+    def test_no_path_to_enclosed_cell(self):
+        map = self._generate_map(['.#.',
+                                  '.#.'])
+        self.assertIsNone(map.shortest_path(Location(0, 0), Location(2, 0)))
+        self.assertIsNone(map.direction_towards(Location(0, 0), Location(2, 0)))
+
+    def test_direction_towards(self):
+        map = self._generate_map(['...',
+                                  '.#.'])
+        direction = map.direction_towards(Location(0, 0), Location(2, 0))
+        self.assertEqual((direction.x, direction.y), (0, 1))
+
+    def test_queries_remembered_for_the_turn(self):
+        map = self._generate_map(['p..'])
+        self.assertIs(map.distance_field(Location(2, 0)), map.distance_field(Location(2, 0)))
+        self.assertIs(map.nearest_pickups(Location(2, 0)), map.nearest_pickups(Location(2, 0)))
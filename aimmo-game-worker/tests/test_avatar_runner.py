@@ -0,0 +1,67 @@
+from unittest import TestCase
+
+from avatar_runner import TurnTimer, load_avatar, restore_avatar, snapshot_avatar
+
+STATEFUL_CODE = '''
+class Avatar(object):
+    def __init__(self):
+        self.turns = 0
+
+    def get_state(self):
+        return {'turns': self.turns}
+
+    def set_state(self, state):
+        self.turns = state['turns']
+'''
+
+
+class TestTurnTimer(TestCase):
+    def test_stage_recorded(self):
+        timer = TurnTimer()
+        with timer.measure('stage'):
+            sum(range(1000))
+        self.assertEqual(sorted(timer.timings['stage']), ['cpu', 'wall'])
+        self.assertGreaterEqual(timer.timings['stage']['wall'], 0)
+
+    def test_repeated_stage_accumulates(self):
+        timer = TurnTimer()
+        with timer.measure('stage'):
+            pass
+        first = timer.timings['stage']['wall']
+        with timer.measure('stage'):
+            sum(range(1000))
+        self.assertGreater(timer.timings['stage']['wall'], first)
+
+    def test_stage_recorded_on_error(self):
+        timer = TurnTimer()
+        with self.assertRaises(ValueError):
+            with timer.measure('stage'):
+                raise ValueError()
+        self.assertIn('stage', timer.timings)
+
+
+class TestPersistentState(TestCase):
+    def test_snapshot_and_restore(self):
+        avatar = load_avatar(STATEFUL_CODE, {})
+        avatar.turns = 3
+        replacement = load_avatar(STATEFUL_CODE, {}, state=snapshot_avatar(avatar))
+        self.assertEqual(replacement.turns, 3)
+
+    def test_avatar_without_state(self):
+        avatar = object()
+        self.assertIsNone(snapshot_avatar(avatar))
+        restore_avatar(avatar, {'turns': 3})
+
+    def test_large_state_dropped(self):
+        avatar = load_avatar(STATEFUL_CODE, {})
+        avatar.turns = 'x' * 100
+        self.assertIsNone(snapshot_avatar(avatar, max_size=50))
+
+    def test_unencodable_state_dropped(self):
+        avatar = load_avatar(STATEFUL_CODE, {})
+        avatar.turns = object()
+        self.assertIsNone(snapshot_avatar(avatar))
+
+    def test_failed_restore_still_loads(self):
+        avatar = load_avatar(STATEFUL_CODE, {}, state={'wrong': 'keys'})
+        self.assertEqual(avatar.turns, 0)
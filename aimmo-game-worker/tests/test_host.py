@@ -0,0 +1,304 @@
+import json
+import multiprocessing
+import os
+from unittest import TestCase
+
+import host
+
+WAIT_CODE = '''
+class Avatar(object):
+    def handle_turn(self, avatar_state, world_map):
+        from simulation.action import WaitAction
+        return WaitAction()
+'''
+
+COUNTING_CODE = '''
+class Avatar(object):
+    def __init__(self, step=1):
+        self.turns = 0
+        self.step = step
+
+    def handle_turn(self, avatar_state, world_map):
+        from simulation.action import MoveAction
+        from simulation.geography.direction import Direction
+        self.turns += self.step
+        return MoveAction(Direction(self.turns, 0))
+'''
+
+STATEFUL_COUNTING_CODE = COUNTING_CODE + '''
+    def get_state(self):
+        return {'turns': self.turns}
+
+    def set_state(self, state):
+        self.turns = state['turns']
+'''
+
+SLOW_CODE = '''
+class Avatar(object):
+    def handle_turn(self, avatar_state, world_map):
+        while True:
+            pass
+'''
+
+AVATAR = {'location': {'x': 0, 'y': 0}, 'health': 5, 'score': 0, 'events': []}
+TURN_DATA = {
+    'avatar_state': AVATAR,
+    'world_map': {
+        'cells': [
+            {'location': {'x': 0, 'y': 0}, 'habitable': True, 'avatar': AVATAR, 'pickup': None},
+        ],
+    },
+}
+
+
+class TestIsShareable(TestCase):
+    def test_dumb_avatar_shared(self):
+        with open(os.path.join(os.path.dirname(__file__), '../../players/avatar_examples/dumb_avatar.py')) as avatar_file:
+            self.assertTrue(host.is_shareable(avatar_file.read()))
+
+    def test_wait_avatar_shared(self):
+        self.assertTrue(host.is_shareable(WAIT_CODE))
+
+    def test_avatar_keeping_state_not_shared(self):
+        self.assertFalse(host.is_shareable(COUNTING_CODE))
+
+    def test_module_state_not_shared(self):
+        self.assertFalse(host.is_shareable('SEEN = []\n' + WAIT_CODE))
+        self.assertFalse(host.is_shareable(WAIT_CODE.replace('from simulation', 'global SEEN; from simulation')))
+
+    def test_class_state_not_shared(self):
+        self.assertFalse(host.is_shareable(WAIT_CODE.replace('class Avatar(object):', 'class Avatar(object):\n    seen = []')))
+
+    def test_opt_in_and_out(self):
+        self.assertTrue(host.is_shareable(COUNTING_CODE.replace('class Avatar(object):', 'class Avatar(object):\n    shared = True')))
+        self.assertFalse(host.is_shareable(WAIT_CODE.replace('class Avatar(object):', 'class Avatar(object):\n    shared = False')))
+
+    def test_broken_code_not_shared(self):
+        self.assertFalse(host.is_shareable('not python'))
+        self.assertFalse(host.is_shareable('class NotAnAvatar(object): pass'))
+
+
+class TestAvatarProcess(TestCase):
+    def setUp(self):
+        self.processes = []
+
+    def tearDown(self):
+        for process in self.processes:
+            process.stop()
+
+    def create(self, code, options=None):
+        process = host.AvatarProcess(1, code, options or {})
+        self.processes.append(process)
+        return process
+
+    def test_turn(self):
+        process = self.create(WAIT_CODE)
+        self.assertEqual(process.process_turn(TURN_DATA)['action'], {'action_type': 'wait'})
+
+    def test_avatar_keeps_state_between_turns(self):
+        process = self.create(COUNTING_CODE, {'step': 2})
+        process.process_turn(TURN_DATA)
+        result = process.process_turn(TURN_DATA)
+        self.assertEqual(result['action']['options']['direction'], {'x': 4, 'y': 0})
+
+    def test_snapshot(self):
+        process = self.create(STATEFUL_COUNTING_CODE)
+        process.process_turn(TURN_DATA)
+        self.assertEqual(process.snapshot(), {'turns': 1})
+
+    def test_state_restored_after_restart(self):
+        process = self.create(STATEFUL_COUNTING_CODE)
+        process.process_turn(TURN_DATA)
+        process.snapshot()
+        process.stop()
+        result = process.process_turn(TURN_DATA)
+        self.assertEqual(result['action']['options']['direction'], {'x': 2, 'y': 0})
+
+    def test_broken_code_raises(self):
+        process = self.create('this is not python')
+        self.assertIn('Could not load avatar', process.load_error)
+        with self.assertRaises(host.AvatarProcessError):
+            process.process_turn(TURN_DATA)
+
+    def test_slow_loading_code(self):
+        original_timeout = host.LOAD_TIMEOUT
+        host.LOAD_TIMEOUT = 0.1
+        try:
+            process = self.create('while True: pass\n' + WAIT_CODE)
+        finally:
+            host.LOAD_TIMEOUT = original_timeout
+        self.assertIn('to load', process.load_error)
+        self.assertFalse(host._is_running(process.pid))
+
+    def test_restore(self):
+        process = self.create(STATEFUL_COUNTING_CODE)
+        process.restore({'turns': 3})
+        result = process.process_turn(TURN_DATA)
+        self.assertEqual(result['action']['options']['direction'], {'x': 4, 'y': 0})
+
+    def test_timeout_restarts_avatar(self):
+        process = self.create(SLOW_CODE)
+        old_pid = process.pid
+        with self.assertRaises(host.AvatarProcessError):
+            process.process_turn(TURN_DATA, timeout=0.1)
+        self.assertNotEqual(process.pid, old_pid)
+        self.assertFalse(host._is_running(old_pid))
+
+    def test_exited_avatar_restarted(self):
+        process = self.create(WAIT_CODE.replace('return WaitAction()', 'import os; os._exit(1)'))
+        old_pid = process.pid
+        with self.assertRaises(host.AvatarProcessError):
+            process.process_turn(TURN_DATA)
+        self.assertNotEqual(process.pid, old_pid)
+        self.assertFalse(host._is_running(old_pid))
+
+    def test_children_not_forked_by_supervisor(self):
+        process = self.create(WAIT_CODE)
+        self.assertEqual(multiprocessing.active_children(), [host.spawner._process])
+        self.assertTrue(process.is_alive())
+
+
+class TestHostAPI(TestCase):
+    def setUp(self):
+        host.app.config['TESTING'] = True
+        self.app = host.app.test_client()
+        host.avatar_host = host.AvatarHost()
+
+    def tearDown(self):
+        for player_id in host.avatar_host.player_ids:
+            host.avatar_host.remove_avatar(player_id)
+
+    def put_player(self, player_id, code):
+        return self.app.put('/players/%s/' % player_id, data=json.dumps({'code': code, 'options': {}}),
+                            content_type='application/json')
+
+    def turn(self, player_id):
+        return self.app.post('/players/%s/turn/' % player_id, data=json.dumps(TURN_DATA),
+                             content_type='application/json')
+
+    def test_players_are_served_separately(self):
+        self.put_player(1, WAIT_CODE)
+        self.put_player(2, COUNTING_CODE)
+        self.assertEqual(json.loads(self.turn(1).data)['action']['action_type'], 'wait')
+        self.assertEqual(json.loads(self.turn(2).data)['action']['action_type'], 'move')
+        self.assertEqual(sorted(json.loads(self.app.get('/').data)['players']), [1, 2])
+
+    def test_unknown_player(self):
+        self.assertEqual(self.turn(3).status_code, 404)
+
+    def test_remove_player(self):
+        self.put_player(1, WAIT_CODE)
+        self.app.delete('/players/1/')
+        self.assertEqual(self.turn(1).status_code, 404)
+
+    def test_failing_avatar(self):
+        self.put_player(1, 'raise ValueError()')
+        self.assertEqual(self.turn(1).status_code, 500)
+
+    def test_reload_player(self):
+        self.put_player(1, WAIT_CODE)
+        response = self.app.post('/players/1/reload/', data=json.dumps({'code': COUNTING_CODE}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(self.turn(1).data)['action']['action_type'], 'move')
+
+    def test_failed_reload_keeps_player(self):
+        self.put_player(1, WAIT_CODE)
+        response = self.app.post('/players/1/reload/', data=json.dumps({'code': 'not python'}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(self.turn(1).data)['action']['action_type'], 'wait')
+
+    def test_reload_loads_code_outside_supervisor(self):
+        self.put_player(1, WAIT_CODE)
+        for code in ('import os; os._exit(1)\n' + COUNTING_CODE, 'raise SystemExit()\n' + COUNTING_CODE):
+            response = self.app.post('/players/1/reload/', data=json.dumps({'code': code}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(self.turn(1).data)['action']['action_type'], 'wait')
+
+    def test_reload_keeps_state(self):
+        self.put_player(1, STATEFUL_COUNTING_CODE)
+        self.turn(1)
+        self.app.post('/players/1/reload/', data=json.dumps({'code': STATEFUL_COUNTING_CODE}),
+                      content_type='application/json')
+        self.assertEqual(json.loads(self.turn(1).data)['action']['options']['direction'], {'x': 2, 'y': 0})
+        self.assertEqual(json.loads(self.app.get('/players/1/snapshot/').data), {'state': {'turns': 2}})
+
+
+SHARED_COUNTING_CODE = COUNTING_CODE.replace('class Avatar(object):', 'class Avatar(object):\n    shared = True')
+
+SLOW_FOR_SOME_CODE = '''
+class Avatar(object):
+    def handle_turn(self, avatar_state, world_map):
+        from simulation.action import WaitAction
+        while avatar_state.score:
+            pass
+        return WaitAction()
+'''
+
+
+class TestSharedAvatars(TestCase):
+    def setUp(self):
+        self.host = host.AvatarHost(share_avatars=True)
+
+    def tearDown(self):
+        for player_id in self.host.player_ids:
+            self.host.remove_avatar(player_id)
+
+    def test_identical_stateless_avatars_share_a_process(self):
+        for player_id in range(3):
+            self.host.add_avatar(player_id, WAIT_CODE, {})
+        self.assertEqual(self.host.process_count, 1)
+        self.assertEqual(self.host.get_avatar(2).process_turn(TURN_DATA)['action'], {'action_type': 'wait'})
+
+    def test_avatars_keeping_state_are_not_shared(self):
+        for player_id in range(2):
+            self.host.add_avatar(player_id, COUNTING_CODE, {})
+        self.assertEqual(self.host.process_count, 2)
+
+    def test_shared_process_stopped_with_last_player(self):
+        self.host.add_avatar(1, WAIT_CODE, {})
+        self.host.add_avatar(2, WAIT_CODE, {})
+        shared = self.host.get_avatar(1)
+        self.host.remove_avatar(1)
+        self.assertTrue(shared.is_alive())
+        self.host.remove_avatar(2)
+        self.assertFalse(shared.is_alive())
+
+    def test_not_shared_unless_allowed(self):
+        unshared_host = host.AvatarHost(share_avatars=False)
+        try:
+            for player_id in range(2):
+                unshared_host.add_avatar(player_id, WAIT_CODE, {})
+            self.assertEqual(unshared_host.process_count, 2)
+        finally:
+            for player_id in range(2):
+                unshared_host.remove_avatar(player_id)
+
+    def test_fresh_avatar_each_turn(self):
+        for player_id in range(2):
+            self.host.add_avatar(player_id, SHARED_COUNTING_CODE, {})
+        for player_id in (0, 1, 0):
+            result = self.host.process_turn(player_id, TURN_DATA)
+            self.assertEqual(result['action']['options']['direction'], {'x': 1, 'y': 0})
+
+    def test_timed_out_player_moved_to_own_process(self):
+        for player_id in range(3):
+            self.host.add_avatar(player_id, SLOW_FOR_SOME_CODE, {})
+        shared = self.host.get_avatar(0)
+        slow_turn = dict(TURN_DATA, avatar_state=dict(AVATAR, score=1))
+        with self.assertRaises(host.AvatarTimeoutError):
+            self.host.process_turn(2, slow_turn, timeout=0.2)
+        self.assertIs(self.host.get_avatar(0), shared)
+        self.assertIs(self.host.get_avatar(1), shared)
+        self.assertIsNot(self.host.get_avatar(2), shared)
+        self.assertFalse(self.host.get_avatar(2).shared)
+        self.assertEqual(self.host.process_turn(0, TURN_DATA)['action'], {'action_type': 'wait'})
+
+    def test_player_leaves_group_on_new_code(self):
+        self.host.add_avatar(1, WAIT_CODE, {})
+        self.host.add_avatar(2, WAIT_CODE, {})
+        self.host.add_avatar(2, COUNTING_CODE, {})
+        self.assertEqual(self.host.process_count, 2)
+        self.assertEqual(self.host.get_avatar(2).process_turn(TURN_DATA)['action']['action_type'], 'move')
@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+import requests
+
+import minimal_service
+from tests.test_avatar_runner import STATEFUL_CODE
+from tests.test_service import CODE, TURN_DATA
+
+
+class TestMinimalService(TestCase):
+    def setUp(self):
+        minimal_service.worker_avatar = None
+        self.server = minimal_service.WorkerServer(('127.0.0.1', 0), minimal_service.WorkerRequestHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def post(self, path, data):
+        return requests.post(self.url + path, json=data)
+
+    def test_idle_until_initialised(self):
+        self.assertEqual(requests.get(self.url + '/').text, 'IDLE')
+        self.assertEqual(self.post('/turn/', TURN_DATA).status_code, 503)
+
+    def test_initialise_and_turn(self):
+        self.assertEqual(self.post('/initialise/', {'code': CODE, 'options': {'direction_x': -1}}).status_code, 200)
+        self.assertEqual(requests.get(self.url + '/').text, 'HEALTHY')
+        data = self.post('/turn/', TURN_DATA).json()
+        self.assertEqual(data['action']['options']['direction'], {'x': -1, 'y': 0})
+        self.assertEqual(sorted(data['timings']), ['decode', 'encode', 'user_code'])
+
+    def test_cannot_initialise_twice(self):
+        self.post('/initialise/', {'code': CODE})
+        self.assertEqual(self.post('/initialise/', {'code': CODE}).status_code, 409)
+
+    def test_bad_reload_keeps_avatar(self):
+        self.post('/initialise/', {'code': CODE})
+        self.assertEqual(self.post('/reload/', {'code': 'class Avatar(object'}).status_code, 400)
+        self.assertEqual(self.post('/turn/', TURN_DATA).status_code, 200)
+
+    def test_connection_kept_alive(self):
+        self.post('/initialise/', {'code': CODE})
+        accepted = []
+        get_request = self.server.get_request
+
+        def counting_get_request():
+            request = get_request()
+            accepted.append(request)
+            return request
+        self.server.get_request = counting_get_request
+
+        session = requests.Session()
+        first = session.post(self.url + '/turn/', json=TURN_DATA)
+        second = session.post(self.url + '/turn/', json=TURN_DATA)
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual(len(accepted), 1)
+
+    def test_snapshot_while_turn_connection_open(self):
+        self.post('/initialise/', {'code': CODE})
+        session = requests.Session()
+        self.addCleanup(session.close)
+        self.assertEqual(session.post(self.url + '/turn/', json=TURN_DATA).status_code, 200)
+        snapshot = requests.get(self.url + '/snapshot/', timeout=2)
+        self.assertEqual(snapshot.status_code, 200)
+
+    def test_snapshot(self):
+        self.post('/initialise/', {'code': STATEFUL_CODE, 'state': {'turns': 4}})
+        self.assertEqual(requests.get(self.url + '/snapshot/').json(), {'state': {'turns': 4}})
+
+    def test_unknown_path(self):
+        self.assertEqual(requests.get(self.url + '/nothing/').status_code, 404)
+
+
+class TestLoadInitialAvatar(TestCase):
+    def test_idle_without_data(self):
+        self.assertIsNone(minimal_service.load_initial_avatar())
+
+    def test_from_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'avatar.py'), 'w') as avatar_file:
+            avatar_file.write(CODE)
+        with open(os.path.join(directory, 'options.json'), 'w') as options_file:
+            json.dump({'direction_x': -1}, options_file)
+        avatar = minimal_service.load_initial_avatar(directory)
+        self.assertEqual(avatar.direction_x, -1)
@@ -0,0 +1,85 @@
+import json
+from unittest import TestCase
+
+import service
+from tests.test_avatar_runner import STATEFUL_CODE
+
+CODE = '''
+class Avatar(object):
+    def __init__(self, direction_x=1):
+        self.direction_x = direction_x
+
+    def handle_turn(self, avatar_state, world_map):
+        from simulation.action import MoveAction
+        from simulation.geography.direction import Direction
+        return MoveAction(Direction(self.direction_x, 0))
+'''
+
+AVATAR = {'location': {'x': 0, 'y': 0}, 'health': 5, 'score': 0, 'events': []}
+TURN_DATA = {
+    'avatar_state': AVATAR,
+    'world_map': {
+        'cells': [
+            {'location': {'x': 0, 'y': 0}, 'habitable': True, 'avatar': AVATAR, 'pickup': None},
+        ],
+    },
+}
+
+
+class TestIdleWorker(TestCase):
+    def setUp(self):
+        service.app.config['TESTING'] = True
+        self.app = service.app.test_client()
+        service.worker_avatar = None
+
+    def post(self, url, data):
+        return self.app.post(url, data=json.dumps(data), content_type='application/json')
+
+    def test_idle_until_initialised(self):
+        self.assertEqual(self.app.get('/').data, 'IDLE')
+        self.assertEqual(self.post('/turn/', TURN_DATA).status_code, 503)
+
+    def test_initialise(self):
+        response = self.post('/initialise/', {'code': CODE, 'options': {'direction_x': -1}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.get('/').data, 'HEALTHY')
+        action = json.loads(self.post('/turn/', TURN_DATA).data)['action']
+        self.assertEqual(action['options']['direction'], {'x': -1, 'y': 0})
+
+    def test_cannot_initialise_twice(self):
+        self.post('/initialise/', {'code': CODE})
+        self.assertEqual(self.post('/initialise/', {'code': CODE}).status_code, 409)
+
+    def test_turn_timings_returned(self):
+        self.post('/initialise/', {'code': CODE})
+        timings = json.loads(self.post('/turn/', TURN_DATA).data)['timings']
+        self.assertEqual(sorted(timings), ['decode', 'encode', 'user_code'])
+        for timing in timings.values():
+            self.assertGreaterEqual(timing['wall'], 0)
+            self.assertGreaterEqual(timing['cpu'], 0)
+
+    def test_reload_swaps_avatar(self):
+        self.post('/initialise/', {'code': CODE})
+        response = self.post('/reload/', {'code': CODE, 'options': {'direction_x': -1}})
+        self.assertEqual(response.status_code, 200)
+        action = json.loads(self.post('/turn/', TURN_DATA).data)['action']
+        self.assertEqual(action['options']['direction'], {'x': -1, 'y': 0})
+
+    def test_failed_reload_keeps_old_avatar(self):
+        self.post('/initialise/', {'code': CODE})
+        old_avatar = service.worker_avatar
+        response = self.post('/reload/', {'code': 'class Avatar(:'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIs(service.worker_avatar, old_avatar)
+        self.assertEqual(self.post('/turn/', TURN_DATA).status_code, 200)
+
+    def test_snapshot(self):
+        self.assertEqual(self.app.get('/snapshot/').status_code, 404)
+        self.post('/initialise/', {'code': STATEFUL_CODE, 'state': {'turns': 2}})
+        self.assertEqual(json.loads(self.app.get('/snapshot/').data), {'state': {'turns': 2}})
+
+    def test_reload_keeps_state(self):
+        self.post('/initialise/', {'code': STATEFUL_CODE})
+        service.worker_avatar.turns = 5
+        self.post('/reload/', {'code': STATEFUL_CODE})
+        self.assertEqual(service.worker_avatar.turns, 5)
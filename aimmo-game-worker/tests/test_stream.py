@@ -0,0 +1,50 @@
+import socket
+from unittest import TestCase
+
+from avatar_runner import load_avatar
+from stream import TurnStreamServer, read_frame, write_frame
+
+CODE = '''
+class Avatar(object):
+    def handle_turn(self, avatar_state, world_map):
+        from simulation.action import WaitAction
+        return WaitAction()
+'''
+
+AVATAR = {'location': {'x': 0, 'y': 0}, 'health': 5, 'score': 0, 'events': []}
+STATE = {
+    'avatar_state': AVATAR,
+    'world_map': {'cells': []},
+}
+
+
+class TestTurnStreamServer(TestCase):
+    def setUp(self):
+        self.avatar = load_avatar(CODE, {})
+        self.server = TurnStreamServer(('127.0.0.1', 0), lambda: self.avatar)
+        self.server.start()
+        self.socket = socket.create_connection(('127.0.0.1', self.server.port))
+
+    def tearDown(self):
+        self.socket.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_turns_answered_in_order(self):
+        for seq in (1, 2, 3):
+            write_frame(self.socket, {'seq': seq, 'state': STATE})
+            reply = read_frame(self.socket)
+            self.assertEqual(reply['seq'], seq)
+            self.assertEqual(reply['action'], {'action_type': 'wait'})
+            self.assertIn('user_code', reply['timings'])
+
+    def test_bad_state_is_reported(self):
+        write_frame(self.socket, {'seq': 1, 'state': {}})
+        reply = read_frame(self.socket)
+        self.assertEqual(reply['seq'], 1)
+        self.assertIn('error', reply)
+
+    def test_idle_worker_is_reported(self):
+        self.avatar = None
+        write_frame(self.socket, {'seq': 1, 'state': STATE})
+        self.assertIn('error', read_frame(self.socket))
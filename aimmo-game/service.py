@@ -15,56 +15,168 @@ from flask_socketio import SocketIO
 from simulation.turn_manager import state_provider
 from simulation import map_generator
 from simulation.avatar.avatar_manager import AvatarManager
+from simulation.hibernation import Hibernator
 from simulation.turn_manager import ConcurrentTurnManager
 from simulation.worker_manager import WORKER_MANAGERS
-from simulation.state.world_state import WorldState
+from simulation.state.spectators import PolledSpectator
+from simulation.state.spectators import Spectators
+from simulation.state.turn_stream import TurnPublisher
+from simulation.state.turn_stream import TurnSubscriber
+from simulation.state.viewports import DEFAULT_VIEW_RADIUS
+from simulation.state.viewports import FollowAvatar
+from simulation.state.viewports import parse_view
+from simulation.state.world_state import WorldRecorder
+
+LOGGER = logging.getLogger(__name__)
 
 app = flask.Flask(__name__)
 socketio = SocketIO()
 
 worker_manager = None
+turn_manager = None
+hibernator = None
+# Publishes turns for spectator gateways, if there are to be any
+publisher = None
+
+def viewer_count():
+    """Everyone watching, through socket.io, the plain routes or a gateway."""
+    gateway_viewers = publisher.viewers() if publisher is not None else 0
+    return len(spectators) + len(plain_spectators) + gateway_viewers
 
-# Every user has its own world state.
-world_state_manager = {}
+def send_frame(sid, frame, on_delivered):
+    # Straight to the server, as Flask-SocketIO's emit only takes a callback inside a request
+    socketio.server.emit('world-update', frame, room=sid, callback=on_delivered)
+
+recorder = WorldRecorder()
+# Socket.io clients, which share updates with those watching the same view
+spectators = Spectators(send_frame, recorder.players,
+                        settings=loads(os.environ.get('SPECTATOR_SETTINGS', '{}')))
+# Clients of the plain routes, which poll for their own updates
+plain_spectators = {}
 
 # socketio routes
 @socketio.on('connect')
 def world_init():
-    socketio.emit('world-init')
+    # Gateways and standby servers have no game of their own to wake
+    if hibernator is not None:
+        hibernator.touch()
+    socketio.emit('world-init', room=flask.request.sid)
 
 @socketio.on('client-ready')
-def client_ready(client_id):
-    flask.session['id'] = client_id
-    world_state = WorldState(state_provider)
-    world_state_manager[client_id] = world_state
+def client_ready(view):
+    change_view(view)
+
+@socketio.on('change-view')
+def change_view(view):
+    """Watch another view, or pan or zoom this one (see viewports.parse_view)."""
+    try:
+        view = parse_view(view)
+    except ValueError as err:
+        LOGGER.info('Ignoring bad view: %s', err)
+        return
+    spectators.add(flask.request.sid, view)
+
+@socketio.on('resync')
+def resync():
+    """The client has missed an update, so needs a keyframe."""
+    spectators.resync(flask.request.sid)
 
 @socketio.on('exit-game')
 def exit_game(user_id):
-    del world_state_manager[user_id]
+    spectators.remove(flask.request.sid)
 
 def send_world_update():
-    for world_state in world_state_manager.values():
-        socketio.emit(
-            'world-update',
-            world_state.get_updates(),
-            broadcast=True,
-        )
+    with state_provider as game_state:
+        changes = recorder.record(game_state)
+    spectators.apply(changes)
+    if publisher is not None:
+        publisher.publish(changes)
 
 @socketio.on('disconnect')
 def on_disconnect():
-    del world_state_manager[flask.session['id']]
+    spectators.remove(flask.request.sid)
 
 @app.route('/')
 def healthcheck():
     return 'HEALTHY'
 
+@app.route('/metrics/')
+def metrics():
+    # Gateways have no workers, and neither they nor standby servers run a game
+    game_metrics = worker_manager.get_metrics() if worker_manager is not None else {}
+    if turn_manager is not None:
+        with state_provider as game_state:
+            game_metrics['avatars'] = {
+                str(avatar.player_id): avatar.turn_metrics()
+                for avatar in game_state.avatar_manager.avatars
+            }
+        game_metrics['load'] = turn_manager.load_metrics()
+    game_metrics['spectators'] = spectators.metrics()
+    game_metrics['viewers'] = viewer_count()
+    return flask.jsonify(game_metrics)
+
+@app.route('/notify/', methods=['POST'])
+def notify():
+    """The players app telling us our players or their code changed."""
+    if worker_manager is None:
+        return 'Not a game server', 404
+    if hibernator is not None:
+        hibernator.touch()
+    worker_manager.request_update()
+    return 'OK'
+
+@app.route('/configure/', methods=['POST'])
+def configure():
+    """
+    Give a standby game server its game. Takes the environment variables the
+    game would have been started with, e.g. settings and GAME_API_URL.
+    """
+    if turn_manager is not None:
+        return 'Already running a game', 409
+    if worker_manager is None:
+        return 'Not a game server', 404
+    config = {str(key): str(value) for key, value in flask.request.get_json().items()}
+    # For anything that reads them later
+    os.environ.update(config)
+    run_game(worker_manager.port, config)
+    return 'OK'
+
+@app.route('/checkpoint/')
+def get_checkpoint():
+    """The game creator moving this game to another host."""
+    checkpoint = hibernator.take_checkpoint() if hibernator is not None else None
+    if checkpoint is None:
+        return 'No game here', 404
+    return flask.jsonify(checkpoint)
+
+@app.route('/checkpoint/', methods=['PUT'])
+def put_checkpoint():
+    """The game creator handing over this game's checkpoint, after moving it here."""
+    if hibernator is None:
+        return 'No game here', 404
+    if not hibernator.restore_checkpoint(flask.request.get_json()):
+        return 'Checkpoint made with other settings', 409
+    return 'OK'
+
+@app.route('/checkpoint/', methods=['DELETE'])
+def delete_checkpoint():
+    """The game creator removing this game, which mustn't carry on if it's recreated."""
+    if hibernator is not None:
+        hibernator.discard_checkpoint()
+    return 'OK'
+
 @app.route('/player/<player_id>')
 def player_data(player_id):
+    if turn_manager is None:
+        return 'No game here', 404
+    if hibernator is not None and hibernator.hibernating:
+        # Its workers are stopped, so whatever is asking is out of date
+        return 'Game is hibernating', 503
     player_id = int(player_id)
     return flask.jsonify({
         'code': worker_manager.get_code(player_id),
         'options': {},       # Game options
-        'state': None,
+        'state': worker_manager.get_persistent_state(player_id),
     })
 
 # Plain client routes... These are easy to work with and
@@ -72,41 +184,76 @@ def player_data(player_id):
 # as the proxy does not allow communication with them.
 @app.route('/plain/<user_id>/connect')
 def plain_world_init(user_id):
-    world_init()
+    if hibernator is not None:
+        hibernator.touch()
     return 'CONNECT'
 
 @app.route('/plain/<user_id>/client-ready')
 def plain_client_ready(user_id):
-    world_state = WorldState(state_provider)
-    world_state_manager[int(user_id)] = world_state
+    if turn_manager is None:
+        return 'No game here', 404
+    view = FollowAvatar(int(user_id), DEFAULT_VIEW_RADIUS)
+    plain_spectators[int(user_id)] = PolledSpectator(state_provider, view)
     return 'RECEIVED USER READY ' + user_id
 
 @app.route('/plain/<user_id>/exit-game')
 def plain_exit_game(user_id):
+    # Or it would keep the game awake for good
+    plain_spectators.pop(int(user_id), None)
     return "EXITING GAME FOR USER " + user_id
 
 @app.route('/plain/<user_id>/update')
 def plain_update(user_id):
-    world_state =  world_state_manager[int(user_id)]
-    return flask.jsonify(world_state.get_updates())
+    # A viewer, so the game has to be awake to be watched
+    if hibernator is not None:
+        hibernator.touch()
+    spectator = plain_spectators[int(user_id)]
+    return flask.jsonify(spectator.get_updates())
 
-def run_game(port):
+def prepare_game(port):
+    """Start everything that doesn't depend on which game this is."""
     global worker_manager
 
+    # The game creator shares WORKER_MANAGER with us, so it can't name game-only managers
+    worker_manager_name = os.environ.get('GAME_WORKER_MANAGER', os.environ.get('WORKER_MANAGER', 'local'))
+    WorkerManagerClass = WORKER_MANAGERS[worker_manager_name]
+    worker_manager = WorkerManagerClass(port=port, worker_pool_size=int(os.environ.get('WORKER_POOL_SIZE', 0)))
+    worker_manager.worker_pool.refill()
+
+
+def run_game(port, config):
+    global turn_manager, hibernator, publisher
+
     print("Running game...")
-    settings = loads(os.environ['settings'])
+    settings = loads(config['settings'])
 
-    api_url = os.environ['GAME_API_URL']
+    api_url = config['GAME_API_URL']
     generator = getattr(map_generator, settings['GENERATOR'])(settings)
-    player_manager = AvatarManager()
+    connection_settings = loads(os.environ.get('WORKER_CONNECTION_SETTINGS', '{}'))
+    health_settings = loads(os.environ.get('WORKER_HEALTH_SETTINGS', '{}'))
+    player_manager = AvatarManager(connection_settings, health_settings)
     game_state = generator.get_game_state(player_manager)
 
     turn_manager = ConcurrentTurnManager(game_state=game_state, end_turn_callback=send_world_update, completion_url=api_url+'complete/')
-    WorkerManagerClass = WORKER_MANAGERS[os.environ.get('WORKER_MANAGER', 'local')]
-    worker_manager = WorkerManagerClass(game_state=game_state, users_url=api_url, port=port)
+    worker_manager.attach(game_state, api_url)
+
+    if config.get('SPECTATOR_SOCKET'):
+        publisher = TurnPublisher(config['SPECTATOR_SOCKET'], recorder,
+                                  settings=loads(os.environ.get('TURN_STREAM_SETTINGS', '{}')))
+
+    hibernator = Hibernator(config.get('GAME_ID', port), turn_manager, worker_manager,
+                            has_viewers=lambda: bool(viewer_count()),
+                            settings=loads(os.environ.get('HIBERNATION_SETTINGS', '{}')),
+                            game_settings=config['settings'],
+                            generate_map=generator.get_map)
+    hibernator.restore_saved_checkpoint()
+    if publisher is not None:
+        publisher.on_viewers = hibernator.touch
+        publisher.start()
 
     worker_manager.start()
     turn_manager.start()
+    hibernator.start()
 
 
 if __name__ == '__main__':
@@ -114,7 +261,19 @@ if __name__ == '__main__':
 
     socketio.init_app(app, resource=os.environ.get('SOCKETIO_RESOURCE', 'socket.io'))
 
-    run_game(int(sys.argv[2]))
+    if os.environ.get('SPECTATOR_GATEWAY'):
+        # Only serve spectators, of the game publishing turns on this socket
+        print("Running spectator gateway...")
+        subscriber = TurnSubscriber(os.environ['SPECTATOR_GATEWAY'], spectators,
+                                    settings=loads(os.environ.get('TURN_STREAM_SETTINGS', '{}')))
+        eventlet.spawn_n(subscriber.run)
+    else:
+        prepare_game(int(sys.argv[2]))
+        if os.environ.get('GAME_STANDBY'):
+            # Wait for the game creator to give us a game through /configure/
+            print("Standing by...")
+        else:
+            run_game(int(sys.argv[2]), os.environ)
 
     socketio.run(
         app,
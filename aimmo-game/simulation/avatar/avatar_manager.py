@@ -7,11 +7,22 @@ class AvatarManager(object):
     Stores all game avatars.
     """
 
-    def __init__(self):
+    def __init__(self, connection_settings=None, health_settings=None):
         self.avatars_by_id = {}
+        self.connection_settings = connection_settings
+        self.health_settings = health_settings
+        # Called with the player's id when an avatar's worker keeps failing
+        self.on_worker_broken = None
+
+    def _worker_broken(self, player_id):
+        if self.on_worker_broken is not None:
+            self.on_worker_broken(player_id)
 
     def add_avatar(self, player_id, worker_url, location):
-        avatar = AvatarWrapper(player_id, location, worker_url, AvatarAppearance("#000", "#ddd", "#777", "#fff"))
+        avatar = AvatarWrapper(player_id, location, worker_url, AvatarAppearance("#000", "#ddd", "#777", "#fff"),
+                               connection_settings=self.connection_settings,
+                               health_settings=self.health_settings,
+                               on_worker_broken=self._worker_broken)
         self.avatars_by_id[player_id] = avatar
         return avatar
 
@@ -20,6 +31,7 @@ class AvatarManager(object):
 
     def remove_avatar(self, user_id):
         if user_id in self.avatars_by_id:
+            self.avatars_by_id[user_id].close()
             del self.avatars_by_id[user_id]
 
     @property
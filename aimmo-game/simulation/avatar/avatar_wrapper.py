@@ -1,4 +1,5 @@
 import logging
+import time
 from collections import Counter
 
 import requests
@@ -6,6 +7,9 @@ import requests
 from simulation.action import ACTIONS, MoveAction, WaitAction
 from simulation.geography.location import Location
 from simulation.avatar.avatar_view import AvatarView
+from simulation.avatar.turn_timings import TurnTimings
+from simulation.avatar.worker_connection import create_worker_connection
+from simulation.avatar.worker_health import WorkerHealth
 
 LOGGER = logging.getLogger(__name__)
 
@@ -16,7 +20,8 @@ class AvatarWrapper(object):
     the player-supplied code.
     """
 
-    def __init__(self, player_id, initial_location, worker_url, avatar_appearance):
+    def __init__(self, player_id, initial_location, worker_url, avatar_appearance,
+                 connection_settings=None, health_settings=None, on_worker_broken=None):
         self.player_id = player_id
         self.location = initial_location
         self.health = 5
@@ -25,11 +30,15 @@ class AvatarWrapper(object):
         self.pickups = Counter() # Empty counter as avatar has not picked anything up yet.
         self.avatar_appearance = avatar_appearance
         self.worker_url = worker_url
+        self._connection = create_worker_connection(worker_url, connection_settings, self._on_disconnect)
         self.effects = set()
         self.resistance = 0
         self.attack_strength = 1
         self.fog_of_war_modifier = 0
         self._action = None
+        self.turn_timings = TurnTimings()
+        self._on_worker_broken = on_worker_broken
+        self.worker_health = WorkerHealth(health_settings, on_broken=self._report_broken_worker)
         self.view = AvatarView(initial_location=Location(0,0), radius=3)
 
     def update_effects(self):
@@ -50,7 +59,12 @@ class AvatarWrapper(object):
         return isinstance(self.action, MoveAction)
 
     def _fetch_action(self, state_view):
-        return requests.post(self.worker_url, json=state_view).json()
+        start = time.time()
+        data = self._connection.fetch_action(state_view)
+        round_trip = time.time() - start
+        self.worker_health.record_success(round_trip)
+        self.turn_timings.record(round_trip, data.get('timings'))
+        return data
 
     def _construct_action(self, data):
         action_data = data['action']
@@ -64,12 +78,21 @@ class AvatarWrapper(object):
             data = self._fetch_action(state_view)
             action = self._construct_action(data)
 
+        except requests.exceptions.HTTPError as err:
+            LOGGER.info('Worker failed to give an action: %s', err)
+            self.worker_health.record_failure()
         except (KeyError, ValueError) as err:
             LOGGER.info('Bad action data supplied: %s', err)
+            self.worker_health.record_bad_response()
         except requests.exceptions.ConnectionError:
             LOGGER.info('Could not connect to worker, probably not ready yet')
+            self.worker_health.record_failure()
+        except requests.exceptions.Timeout:
+            LOGGER.info('Worker took too long to respond')
+            self.worker_health.record_failure()
         except Exception:
             LOGGER.exception("Unknown error while fetching turn data")
+            self.worker_health.record_bad_response()
 
         else:
             self._action = action
@@ -78,9 +101,30 @@ class AvatarWrapper(object):
         self._action = WaitAction(self)
         return False
 
+    def skip_turn(self):
+        """Wait this turn without asking the worker."""
+        self._action = WaitAction(self)
+
     def clear_action(self):
         self._action = None
 
+    def _on_disconnect(self, connection):
+        LOGGER.info('Lost connection to worker for avatar %s', self.player_id)
+
+    def _report_broken_worker(self):
+        LOGGER.warning('Worker for avatar %s keeps failing', self.player_id)
+        if self._on_worker_broken is not None:
+            self._on_worker_broken(self.player_id)
+
+    def turn_metrics(self):
+        metrics = self.turn_timings.summary()
+        metrics['near_deadline'] = self.turn_timings.is_near_deadline(self._connection.timeout[1])
+        metrics['worker_health'] = self.worker_health.summary()
+        return metrics
+
+    def close(self):
+        self._connection.close()
+
     def die(self, respawn_location):
         # TODO: extract settings for health and score loss on death
         self.health = 5
@@ -0,0 +1,84 @@
+from collections import defaultdict, deque
+from numbers import Number
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# The stages of a turn a worker reports timings for
+WORKER_STAGES = ('decode', 'user_code', 'encode')
+
+
+class RollingHistogram(object):
+    """
+    A histogram over the most recent `window` samples only, so it reflects an
+    avatar's current code rather than everything it has ever done.
+    """
+
+    def __init__(self, window=100):
+        self._samples = deque(maxlen=window)
+
+    def add(self, value):
+        self._samples.append(value)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, percent):
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = int(round(percent / 100.0 * (len(ordered) - 1)))
+        return ordered[index]
+
+    def buckets(self):
+        counts = [0] * (len(BUCKETS) + 1)
+        for value in self._samples:
+            index = next((i for i, bound in enumerate(BUCKETS) if value <= bound), len(BUCKETS))
+            counts[index] += 1
+        labels = [str(bound) for bound in BUCKETS] + ['+Inf']
+        return dict(zip(labels, counts))
+
+    def summary(self):
+        if not self._samples:
+            return {'count': 0}
+        return {
+            'count': len(self._samples),
+            'mean': sum(self._samples) / len(self._samples),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'max': max(self._samples),
+            'buckets': self.buckets(),
+        }
+
+
+class TurnTimings(object):
+    """
+    Rolling timings of an avatar's recent turns: the round trip seen by the
+    game, and the wall and CPU time of each stage the worker reports.
+    """
+
+    def __init__(self, window=100):
+        self._histograms = defaultdict(lambda: RollingHistogram(window))
+
+    def record(self, round_trip, worker_timings):
+        self._histograms['round_trip'].add(round_trip)
+        # Untrusted data! Only keep well-formed timings of the stages we
+        # know, so a worker can't make us keep any number of histograms.
+        if not isinstance(worker_timings, dict):
+            return
+        for stage in WORKER_STAGES:
+            timing = worker_timings.get(stage)
+            if not isinstance(timing, dict):
+                continue
+            for clock in ('wall', 'cpu'):
+                value = timing.get(clock)
+                if isinstance(value, Number):
+                    self._histograms['%s_%s' % (stage, clock)].add(value)
+
+    def is_near_deadline(self, deadline, fraction=0.8):
+        """Whether the avatar's slow turns are close to the turn deadline."""
+        p95 = self._histograms['round_trip'].percentile(95)
+        return p95 is not None and p95 >= deadline * fraction
+
+    def summary(self):
+        return {name: histogram.summary() for name, histogram in self._histograms.items()}
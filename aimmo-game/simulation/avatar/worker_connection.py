@@ -0,0 +1,178 @@
+import json
+import logging
+import socket
+import struct
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from six.moves import queue
+from six.moves.urllib.parse import urlparse
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CONNECTION_SETTINGS = {
+    'TRANSPORT': 'http',
+    'POOL_CONNECTIONS': 1,
+    'POOL_MAXSIZE': 2,
+    'MAX_RETRIES': 1,
+    'CONNECT_TIMEOUT': 1.0,
+    'READ_TIMEOUT': 2.0,
+}
+
+
+class WorkerConnection(object):
+    """
+    A persistent (keep-alive) HTTP connection to a single worker.
+
+    Each avatar talks to exactly one worker, so every avatar owns one of these
+    rather than opening a new TCP connection per turn. When a worker is
+    respawned it gets a new URL, and with it a new avatar and connection; the
+    old one is closed when the avatar is removed from the game.
+    """
+
+    def __init__(self, worker_url, settings=None):
+        new_settings = DEFAULT_CONNECTION_SETTINGS.copy()
+        new_settings.update(settings or {})
+
+        self.worker_url = worker_url
+        self.timeout = (new_settings['CONNECT_TIMEOUT'], new_settings['READ_TIMEOUT'])
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=new_settings['POOL_CONNECTIONS'],
+                              pool_maxsize=new_settings['POOL_MAXSIZE'],
+                              max_retries=new_settings['MAX_RETRIES'])
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def fetch_action(self, state_view):
+        response = self._session.post(self.worker_url, json=state_view, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self._session.close()
+
+
+_HEADER = struct.Struct('>I')
+
+
+def _read_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError('Connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _read_frame(sock):
+    (size,) = _HEADER.unpack(_read_exactly(sock, _HEADER.size))
+    return json.loads(_read_exactly(sock, size).decode('utf-8'))
+
+
+def _write_frame(sock, data):
+    payload = json.dumps(data).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+class StreamWorkerConnection(object):
+    """
+    A long-lived channel to a worker over which turns are pushed as
+    length-prefixed JSON frames, instead of one HTTP request per turn.
+
+    Every turn carries a sequence number; replies to turns we already gave up
+    on are dropped. A reader thread notices straight away when the worker's
+    end of the channel goes away and calls `on_disconnect`.
+    """
+
+    _DISCONNECTED = object()
+
+    def __init__(self, worker_url, settings=None, on_disconnect=None):
+        new_settings = DEFAULT_CONNECTION_SETTINGS.copy()
+        new_settings.update(settings or {})
+
+        self.worker_url = worker_url
+        self.timeout = (new_settings['CONNECT_TIMEOUT'], new_settings['READ_TIMEOUT'])
+        self.on_disconnect = on_disconnect
+        self._seq = 0
+        self._socket = None
+        self._replies = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_connected(self):
+        return self._socket is not None
+
+    def _stream_address(self):
+        parsed = urlparse(self.worker_url)
+        details_url = '%s://%s/stream/' % (parsed.scheme, parsed.netloc)
+        port = requests.get(details_url, timeout=self.timeout).json()['port']
+        return parsed.hostname, port
+
+    def _connect(self):
+        try:
+            sock = socket.create_connection(self._stream_address(), timeout=self.timeout[0])
+        except socket.error as err:
+            raise requests.exceptions.ConnectionError(err)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket = sock
+        self._replies = queue.Queue()
+        reader = threading.Thread(target=self._read_loop, args=(sock, self._replies))
+        reader.daemon = True
+        reader.start()
+
+    def _read_loop(self, sock, replies):
+        try:
+            while True:
+                replies.put(_read_frame(sock))
+        except (EOFError, socket.error, ValueError) as err:
+            LOGGER.debug('Stream to %s closed: %s', self.worker_url, err)
+        replies.put(self._DISCONNECTED)
+        with self._lock:
+            if self._socket is not sock:
+                # We closed it ourselves
+                return
+            self._socket = None
+        if self.on_disconnect is not None:
+            self.on_disconnect(self)
+
+    def fetch_action(self, state_view):
+        if self._socket is None:
+            self._connect()
+        self._seq += 1
+        seq = self._seq
+        replies = self._replies
+        try:
+            _write_frame(self._socket, {'seq': seq, 'state': state_view})
+        except (socket.error, AttributeError) as err:
+            raise requests.exceptions.ConnectionError(err)
+        while True:
+            try:
+                reply = replies.get(timeout=self.timeout[1])
+            except queue.Empty:
+                raise requests.exceptions.ReadTimeout('No reply to turn %d' % seq)
+            if reply is self._DISCONNECTED:
+                raise requests.exceptions.ConnectionError('Worker closed the stream')
+            if reply.get('seq') == seq:
+                return reply
+            LOGGER.debug('Dropping late reply to turn %s', reply.get('seq'))
+
+    def close(self):
+        with self._lock:
+            sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+
+def create_worker_connection(worker_url, settings=None, on_disconnect=None):
+    transport = (settings or {}).get('TRANSPORT', DEFAULT_CONNECTION_SETTINGS['TRANSPORT'])
+    if transport == 'stream':
+        return StreamWorkerConnection(worker_url, settings, on_disconnect)
+    return WorkerConnection(worker_url, settings)
@@ -0,0 +1,95 @@
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+DEFAULT_HEALTH_SETTINGS = {
+    # Consecutive failed turns before we stop asking the worker every turn
+    'FAILURE_THRESHOLD': 3,
+    # Seconds between single probe turns while the worker is considered down
+    'PROBE_INTERVAL': 5.0,
+    # Consecutive failed turns (probes included) before asking for a new worker
+    'RESPAWN_THRESHOLD': 6,
+    # Weight of the newest sample in the latency moving average
+    'LATENCY_SMOOTHING': 0.2,
+}
+
+
+class WorkerHealth(object):
+    """
+    A circuit breaker for one avatar's worker.
+
+    While closed, every turn is fetched from the worker. After enough
+    consecutive failures it opens: turns are skipped without contacting the
+    worker, except for one probe turn every PROBE_INTERVAL seconds (while
+    half-open). A successful turn closes it again. If the failures carry on,
+    `on_broken` is called once so the worker can be replaced.
+    """
+
+    def __init__(self, settings=None, on_broken=None, clock=time.time):
+        new_settings = DEFAULT_HEALTH_SETTINGS.copy()
+        new_settings.update(settings or {})
+
+        self.failure_threshold = new_settings['FAILURE_THRESHOLD']
+        self.probe_interval = new_settings['PROBE_INTERVAL']
+        self.respawn_threshold = new_settings['RESPAWN_THRESHOLD']
+        self.latency_smoothing = new_settings['LATENCY_SMOOTHING']
+        self.on_broken = on_broken
+        self._clock = clock
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.latency_ewma = None
+        self._opened_at = None
+        self._reported = False
+
+    def allow_request(self):
+        """Whether to ask the worker for this turn's action."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and self._clock() - self._opened_at >= self.probe_interval:
+            self.state = HALF_OPEN
+            return True
+        # Still open, or a probe is already under way
+        return False
+
+    def record_success(self, latency):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += self.latency_smoothing * (latency - self.latency_ewma)
+        if self.state != CLOSED:
+            LOGGER.info('Worker healthy again after %d failures', self.consecutive_failures)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._reported = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = OPEN
+            self._opened_at = self._clock()
+        if self.consecutive_failures >= self.respawn_threshold and not self._reported:
+            self._reported = True
+            if self.on_broken is not None:
+                self.on_broken()
+
+    def record_bad_response(self):
+        """
+        The worker answered, but not with a usable action. That is the
+        player's code at fault rather than the worker, unless it was a probe,
+        which has to settle the breaker one way or the other.
+        """
+        if self.state != CLOSED:
+            self.record_failure()
+
+    def summary(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'latency_ewma': self.latency_ewma,
+        }
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from eventlet.semaphore import Semaphore
+
+from simulation.geography.cell import Cell
+from simulation.geography.location import Location
+from simulation.pickups import ALL_PICKUPS
+from simulation.turn_manager import state_provider
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HIBERNATION_SETTINGS = {
+    # Seconds without viewers or code changes before the game hibernates (0 for never)
+    'IDLE_TIMEOUT': 900,
+    # Where checkpoints are kept; the system's temporary directory if None
+    'CHECKPOINT_DIR': None,
+    # Seconds between checks for idleness
+    'CHECK_INTERVAL': 10,
+}
+
+PICKUPS_BY_NAME = {pickup.__name__: pickup for pickup in ALL_PICKUPS}
+
+
+def avatar_record(avatar):
+    return {
+        'location': avatar.location.serialise(),
+        'health': avatar.health,
+        'score': avatar.score,
+        'pickups': {pickup.__name__: count for pickup, count in avatar.pickups.items()},
+    }
+
+
+def apply_avatar_record(avatar, record):
+    """Give a newly added avatar back what it had when its game hibernated."""
+    avatar.health = record['health']
+    avatar.score = record['score']
+    avatar.pickups = Counter({PICKUPS_BY_NAME[name]: count
+                              for name, count in record['pickups'].items() if name in PICKUPS_BY_NAME})
+
+
+def checkpoint_game(game_state):
+    """Everything needed to carry on the game later, as JSON-encodable data."""
+    rng_version, rng_internal_state, rng_gauss_next = random.getstate()
+    return {
+        'cells': [
+            {
+                'location': cell.location.serialise(),
+                'habitable': cell.habitable,
+                'pickup': type(cell.pickup).__name__ if cell.pickup else None,
+            } for cell in game_state.world_map.all_cells()
+        ],
+        'avatars': {
+            str(avatar.player_id): avatar_record(avatar)
+            for avatar in game_state.avatar_manager.avatars
+        },
+        'main_avatar_id': game_state.main_avatar_id,
+        'random_state': [rng_version, list(rng_internal_state), rng_gauss_next],
+    }
+
+
+def restore_game(game_state, checkpoint):
+    """
+    Put a checkpointed world back into the game state. Avatars get their
+    locations, health and so on back as they are next added to the game.
+    """
+    grid = {}
+    for cell_data in checkpoint['cells']:
+        location = Location(cell_data['location']['x'], cell_data['location']['y'])
+        cell = Cell(location, habitable=cell_data['habitable'])
+        if cell_data['pickup'] in PICKUPS_BY_NAME:
+            cell.pickup = PICKUPS_BY_NAME[cell_data['pickup']](cell)
+        grid[location] = cell
+    # Swap the grid into the existing map, so anything the level set on it stays
+    game_state.world_map.grid = grid
+    game_state.main_avatar_id = checkpoint['main_avatar_id']
+    game_state.restored_avatars = {int(player_id): record
+                                   for player_id, record in checkpoint['avatars'].items()}
+    rng_version, rng_internal_state, rng_gauss_next = checkpoint['random_state']
+    random.setstate((rng_version, tuple(rng_internal_state), rng_gauss_next))
+
+
+def save_checkpoint(path, checkpoint):
+    # Write then rename, so a crash never leaves half a checkpoint behind
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.rename(temporary_path, path)
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except (IOError, ValueError):
+        return None
+
+
+class Hibernator(threading.Thread):
+    """
+    Puts the game to sleep once it has had no viewers and no code changes for
+    IDLE_TIMEOUT seconds. Turns stop, the world is checkpointed to disk, and
+    every worker is stopped. The next viewer or code change (anything calling
+    `touch`) restores the checkpoint and starts everything again.
+
+    Checkpoints are marked with a hash of the game's settings, so one left
+    by a run of the game with other settings is not restored.
+
+    The world is only dropped from memory while hibernating if
+    `generate_map` can make a new one, in case the checkpoint is lost.
+
+    This class is thread safe
+    """
+    daemon = True
+
+    def __init__(self, game_id, turn_manager, worker_manager, has_viewers,
+                 settings=None, clock=time.time, game_settings='', generate_map=None):
+        new_settings = DEFAULT_HIBERNATION_SETTINGS.copy()
+        new_settings.update(settings or {})
+
+        self.idle_timeout = new_settings['IDLE_TIMEOUT']
+        self.check_interval = new_settings['CHECK_INTERVAL']
+        checkpoint_dir = new_settings['CHECKPOINT_DIR'] or tempfile.gettempdir()
+        self.checkpoint_path = os.path.join(checkpoint_dir, 'aimmo-game-%s.json' % game_id)
+        self.settings_hash = hashlib.sha1(game_settings).hexdigest()
+        self._turn_manager = turn_manager
+        self._worker_manager = worker_manager
+        self._has_viewers = has_viewers
+        self._generate_map = generate_map
+        self._clock = clock
+        self._last_activity = clock()
+        self.hibernating = False
+        self._lock = Semaphore()
+        super(Hibernator, self).__init__()
+
+    def touch(self):
+        """Record activity, waking the game if it is hibernating."""
+        with self._lock:
+            self._last_activity = self._clock()
+            if self.hibernating:
+                self._wake()
+
+    def check(self):
+        """Hibernate the game if it has been idle for long enough."""
+        with self._lock:
+            if self.hibernating or not self.idle_timeout:
+                return
+            if self._has_viewers():
+                self._last_activity = self._clock()
+            elif self._clock() - self._last_activity >= self.idle_timeout:
+                self._hibernate()
+
+    def restore_saved_checkpoint(self):
+        """Carry on from a checkpoint left by an earlier run, if there is one."""
+        with self._lock:
+            checkpoint = load_checkpoint(self.checkpoint_path)
+            if checkpoint is None:
+                return
+            if checkpoint.get('settings_hash') == self.settings_hash:
+                LOGGER.info('Restoring game from %s', self.checkpoint_path)
+                with state_provider as game_state:
+                    restore_game(game_state, checkpoint)
+            else:
+                LOGGER.info('Discarding checkpoint at %s, made with other settings', self.checkpoint_path)
+            os.remove(self.checkpoint_path)
+
+    def take_checkpoint(self):
+        """The game as it is now, for carrying on elsewhere (None if it's lost)."""
+        with self._lock:
+            if self.hibernating:
+                return load_checkpoint(self.checkpoint_path)
+            return self._checkpoint()
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        Carry on from a checkpoint taken from another run of this game, e.g.
+        on the host it was moved from. Workers are restarted, so that avatars
+        get back what they had. Returns False if it was made with other settings.
+        """
+        with self._lock:
+            if checkpoint.get('settings_hash') != self.settings_hash:
+                return False
+            LOGGER.info('Carrying on from a checkpoint handed over')
+            if not self.hibernating:
+                self._turn_manager.pause()
+                self._worker_manager.suspend()
+            with state_provider as game_state:
+                restore_game(game_state, checkpoint)
+            self._remove_checkpoint()
+            self._worker_manager.resume()
+            self._turn_manager.resume()
+            self.hibernating = False
+            self._last_activity = self._clock()
+            return True
+
+    def discard_checkpoint(self):
+        """Delete any checkpoint, as the game is being removed."""
+        with self._lock:
+            self._remove_checkpoint()
+
+    def _remove_checkpoint(self):
+        assert self._lock.locked
+        try:
+            os.remove(self.checkpoint_path)
+        except OSError:
+            pass
+
+    def _checkpoint(self):
+        assert self._lock.locked
+        with state_provider as game_state:
+            checkpoint = checkpoint_game(game_state)
+        checkpoint['settings_hash'] = self.settings_hash
+        return checkpoint
+
+    def _hibernate(self):
+        assert self._lock.locked
+        LOGGER.info('Game idle for %ss, hibernating', self.idle_timeout)
+        self._turn_manager.pause()
+        try:
+            save_checkpoint(self.checkpoint_path, self._checkpoint())
+        except (IOError, OSError) as err:
+            LOGGER.error('Could not checkpoint the game, staying awake: %s', err)
+            self._turn_manager.resume()
+            self._last_activity = self._clock()
+            return
+        self._worker_manager.suspend()
+        if self._generate_map is not None:
+            with state_provider as game_state:
+                # The checkpoint has it all now
+                game_state.world_map.grid = {}
+        self.hibernating = True
+
+    def _wake(self):
+        assert self._lock.locked
+        LOGGER.info('Waking game from %s', self.checkpoint_path)
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        if checkpoint is None:
+            LOGGER.error('Checkpoint at %s is missing or corrupt', self.checkpoint_path)
+            if self._generate_map is not None:
+                LOGGER.warning('Starting the game again with a new map')
+                with state_provider as game_state:
+                    game_state.world_map.grid = self._generate_map().grid
+        else:
+            with state_provider as game_state:
+                restore_game(game_state, checkpoint)
+            os.remove(self.checkpoint_path)
+        self._worker_manager.resume()
+        self._turn_manager.resume()
+        self.hibernating = False
+
+    def run(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.check()
+            except Exception:
+                LOGGER.exception('Error while checking whether to hibernate')
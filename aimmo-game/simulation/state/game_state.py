@@ -1,3 +1,5 @@
+from simulation.hibernation import apply_avatar_record
+from simulation.geography.location import Location
 
 
 class GameState(object):
@@ -9,6 +11,8 @@ class GameState(object):
         self.avatar_manager = avatar_manager
         self._completion_callback = completion_check_callback
         self.main_avatar_id = None
+        # Records of avatars from a restored checkpoint, waiting for them to rejoin
+        self.restored_avatars = {}
 
     def get_state_for(self, avatar_wrapper):
         return {
@@ -18,10 +22,24 @@ class GameState(object):
             }
         }
 
+    def _restored_location(self, record):
+        location = Location(record['location']['x'], record['location']['y'])
+        if not self.world_map.is_on_map(location):
+            return None
+        cell = self.world_map.get_cell(location)
+        if not cell.habitable or cell.is_occupied:
+            return None
+        return location
+
     def add_avatar(self, user_id, worker_url, location=None):
+        record = self.restored_avatars.pop(user_id, None)
+        if location is None and record is not None:
+            location = self._restored_location(record)
         location = self.world_map.get_random_spawn_location() if location is None else location
         avatar = self.avatar_manager.add_avatar(user_id, worker_url, location)
         self.world_map.get_cell(location).avatar = avatar
+        if record is not None:
+            apply_avatar_record(avatar, record)
 
     def remove_avatar(self, user_id):
         try:
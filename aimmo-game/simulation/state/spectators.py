@@ -0,0 +1,369 @@
+import json
+from collections import defaultdict
+
+from eventlet.semaphore import Semaphore
+
+from simulation.state.viewports import SpatialIndex
+from simulation.state.viewports import changed_locations
+from simulation.state.world_state import PlayerRecords
+from simulation.state.world_state import WorldState
+from simulation.state.world_state import records_in
+
+DEFAULT_SPECTATOR_SETTINGS = {
+    # Frames a client may leave unacknowledged. Past that it has fallen
+    # behind: frames for it are dropped until it catches up, and then it is
+    # sent a keyframe instead.
+    'MAX_UNACKNOWLEDGED': 3,
+    # Turns between the keyframes sent to every client, so that any that
+    # has drifted from what it should be showing comes right (0 for never)
+    'KEYFRAME_INTERVAL': 40,
+}
+
+
+def _avatar_locations(game_state):
+    return {avatar.player_id: avatar.location for avatar in game_state.avatar_manager.avatars}
+
+
+def encode(update, players=None):
+    """
+    The update as JSON. Given PlayerRecords, the players in it are spliced
+    in as their cached JSON instead of being encoded again.
+    """
+    if players is None:
+        return json.dumps(update, separators=(',', ':'))
+    rest = dict(update)
+    encoded_players = ','.join(
+        '"%s":[%s]' % (change, ','.join(players.encode(player) for player in player_list))
+        for change, player_list in rest.pop('players').items())
+    if not rest:
+        return '{"players":{%s}}' % encoded_players
+    encoded_rest = json.dumps(rest, separators=(',', ':'))
+    return '{"players":{%s},%s' % (encoded_players, encoded_rest[1:])
+
+
+class ViewGroup(object):
+    """
+    The clients watching one view, the region of the world they have been
+    sent, and the turn it was sent as of.
+    """
+
+    def __init__(self, view, region, turn):
+        self.view = view
+        self.region = region
+        self.members = set()
+        self.last_turn = turn
+        self.keyframe_turn = turn
+        # The encoded keyframe as of last_turn, once someone has needed it
+        self.keyframe = None
+
+
+class Outbox(object):
+    """
+    Keeps track of the frames on their way to one client, so a slow client
+    can't make them pile up. Once MAX_UNACKNOWLEDGED frames are waiting for
+    the client to acknowledge them, later frames are dropped. When it has
+    caught up, it is sent a keyframe: everything in its view, replacing
+    what it was showing, so the dropped frames are never needed.
+    """
+
+    def __init__(self, max_unacknowledged):
+        self.max_unacknowledged = max_unacknowledged
+        self.unacknowledged = 0
+        self.needs_keyframe = False
+        # Frames dropped since the client fell behind, and in total
+        self.lag = 0
+        self.dropped = 0
+        self.keyframes = 0
+        self.resyncs = 0
+
+    def offer(self, keyframe=False):
+        """
+        Whether a frame can be sent to the client now. If not, it's dropped.
+        Any keyframe that can be sent brings the client up to date.
+        """
+        if self.unacknowledged < self.max_unacknowledged and (keyframe or not self.needs_keyframe):
+            self.unacknowledged += 1
+            if keyframe:
+                self.needs_keyframe = False
+                self.lag = 0
+                self.keyframes += 1
+            return True
+        self.needs_keyframe = True
+        self.lag += 1
+        self.dropped += 1
+        return False
+
+    def acknowledge(self):
+        """Record a frame as received, returning whether a keyframe is now due."""
+        self.unacknowledged = max(0, self.unacknowledged - 1)
+        return self.needs_keyframe and self.unacknowledged == 0
+
+    def resync(self):
+        """The client has lost track. Returns whether to send it a keyframe now."""
+        self.resyncs += 1
+        self.needs_keyframe = True
+        return self.unacknowledged < self.max_unacknowledged
+
+    def metrics(self):
+        return {
+            'unacknowledged': self.unacknowledged,
+            'lag': self.lag,
+            'dropped': self.dropped,
+            'keyframes': self.keyframes,
+            'resyncs': self.resyncs,
+        }
+
+
+class Spectators(object):
+    """
+    The socket.io clients watching the game, by session id, grouped by the
+    view they asked for (see viewports.parse_view). Each turn's update is
+    built and encoded once per group, whatever its size, then handed to
+    `send` for each client in the group, through the client's Outbox.
+
+    Each turn, they are given the records of the world's cells that have
+    changed (see WorldRecorder), worked out once whoever is watching, and
+    possibly in another process. The regions the groups have been sent
+    are kept in a spatial index, so each changed cell only goes to the
+    groups whose region contains it. A group whose region has moved (as the
+    avatar it follows has) is only sent the cells coming into or going out
+    of view, so the cost of a turn grows with what changes and not with the
+    size of the world or the number of spectators.
+
+    Frames carry turn numbers. A delta carries the turn it brings a client
+    up to, and the turn it follows on from ('since'). A client that finds
+    it has missed a delta asks to resync, and is sent a keyframe, marked
+    'reset', of its group's view as of the group's last turn. Each group's
+    keyframe is built when first needed and kept until the group's next
+    delta, so resyncs, reconnects and late joiners cost one cached frame.
+    Every KEYFRAME_INTERVAL turns, each group is sent a keyframe in place of
+    its delta.
+
+    `send` is called with a client's session id, an encoded frame and a
+    function to call when the client acknowledges the frame. It must not
+    block, which for socket.io it doesn't, as emitting only queues the
+    frame. Frames are sent while holding the lock, so that they are sent in
+    the order they are built.
+
+    This class is thread safe
+    """
+
+    def __init__(self, send, players=None, settings=None):
+        new_settings = DEFAULT_SPECTATOR_SETTINGS.copy()
+        new_settings.update(settings or {})
+
+        self._send = send
+        # The PlayerRecords the player_dicts in the changes come from
+        self.players = players if players is not None else PlayerRecords()
+        self.max_unacknowledged = new_settings['MAX_UNACKNOWLEDGED']
+        self.keyframe_interval = new_settings['KEYFRAME_INTERVAL']
+        self.turn = 0
+        # Session id -> Outbox
+        self._outboxes = {}
+        # View -> ViewGroup
+        self._groups = {}
+        # Session id -> view
+        self._views = {}
+        self._index = SpatialIndex()
+        # Records of the world's cells, and where its avatars were, as of the last update
+        self._records = {}
+        self._avatar_locations = {}
+        self._lock = Semaphore()
+
+    def _records_in(self, region):
+        assert self._lock.locked
+        if region is None:
+            return {}
+        return {location: self._records[location]
+                for location in region.locations() if location in self._records}
+
+    def _remove(self, sid):
+        assert self._lock.locked
+        view = self._views.pop(sid, None)
+        if view is None:
+            return None
+        group = self._groups[view]
+        group.members.discard(sid)
+        if not group.members:
+            del self._groups[view]
+            self._index.remove(view)
+        return group
+
+    def _deliver(self, sid, frame, keyframe=False):
+        assert self._lock.locked
+        if self._outboxes[sid].offer(keyframe):
+            self._send(sid, frame, lambda *args: self.acknowledge(sid))
+
+    def _keyframe(self, group):
+        assert self._lock.locked
+        if group.keyframe is None:
+            world_state = WorldState()
+            world_state.add_changes((None, record) for record in self._records_in(group.region).values())
+            keyframe = world_state.get_updates()
+            keyframe['reset'] = True
+            keyframe['turn'] = group.last_turn
+            group.keyframe = encode(keyframe, self.players)
+        return group.keyframe
+
+    def _send_keyframe(self, sid):
+        assert self._lock.locked
+        view = self._views.get(sid)
+        if view is not None:
+            self._deliver(sid, self._keyframe(self._groups[view]), keyframe=True)
+
+    def add(self, sid, view):
+        """
+        Put the client in the group watching the view, taking it out of any
+        other. A client changing view is sent the delta from what it was
+        showing to what the group has been sent. A new client is sent the
+        group's keyframe.
+        """
+        with self._lock:
+            if sid not in self._outboxes:
+                self._outboxes[sid] = Outbox(self.max_unacknowledged)
+            old_group = self._remove(sid)
+            group = self._groups.get(view)
+            if group is None:
+                group = ViewGroup(view, view.region(self._avatar_locations), self.turn)
+                self._groups[view] = group
+                self._index.add(view, group.region)
+            group.members.add(sid)
+            self._views[sid] = view
+
+            if old_group is None:
+                self._send_keyframe(sid)
+                return
+            old_records = self._records_in(old_group.region)
+            new_records = self._records_in(group.region)
+            world_state = WorldState()
+            world_state.add_changes((old_records.get(location), new_records.get(location))
+                                    for location in set(old_records) | set(new_records))
+            delta = world_state.get_updates()
+            delta['since'] = old_group.last_turn
+            delta['turn'] = group.last_turn
+            self._deliver(sid, encode(delta, self.players))
+
+    def remove(self, sid):
+        """Take the client out of its group, e.g. as it disconnected."""
+        with self._lock:
+            self._remove(sid)
+            self._outboxes.pop(sid, None)
+
+    def acknowledge(self, sid):
+        """The client has received a frame. Sends it a keyframe if it was behind."""
+        with self._lock:
+            outbox = self._outboxes.get(sid)
+            if outbox is not None and outbox.acknowledge():
+                self._send_keyframe(sid)
+
+    def resync(self, sid):
+        """The client has missed a delta, so send it a keyframe as soon as it can take one."""
+        with self._lock:
+            outbox = self._outboxes.get(sid)
+            if outbox is not None and outbox.resync():
+                self._send_keyframe(sid)
+
+    def _keyframe_due(self, group):
+        return self.keyframe_interval and self.turn - group.keyframe_turn >= self.keyframe_interval
+
+    def apply(self, changes):
+        """Send each group the delta the turn's changes make to its view, or its keyframe."""
+        with self._lock:
+            self.turn = changes.turn
+            records = self._records
+            if changes.full:
+                changed = set(records) | set(changes.records)
+                old_records = {location: records.get(location) for location in changed}
+                records.clear()
+            else:
+                changed = set(changes.records).union(changes.removed)
+                old_records = {location: records.get(location) for location in changed}
+            for location in changes.removed:
+                records.pop(location, None)
+            records.update(changes.records)
+            avatar_locations = changes.avatar_locations
+
+            def old_record(location):
+                if location in old_records:
+                    return old_records[location]
+                return records.get(location)
+
+            # The index holds the regions the groups have been sent, which a
+            # changed cell must be in to matter unless it has just come into view
+            locations_by_view = defaultdict(set)
+            for location in changed:
+                for view in self._index.candidates(location):
+                    locations_by_view[view].add(location)
+
+            new_regions = {}
+            for view, group in self._groups.iteritems():
+                region = view.region(avatar_locations)
+                new_regions[view] = region
+                if region != group.region:
+                    locations_by_view[view].update(changed_locations(group.region, region))
+                    self._index.add(view, region)
+
+            deltas = {}
+            for view, locations in locations_by_view.iteritems():
+                group = self._groups[view]
+                old_region, new_region = group.region, new_regions[view]
+                world_state = WorldState()
+                world_state.add_changes(
+                    (old_record(location) if old_region is not None and old_region.contains(location) else None,
+                     records.get(location) if new_region is not None and new_region.contains(location) else None)
+                    for location in locations)
+                if not world_state.is_empty:
+                    delta = world_state.get_updates()
+                    delta['since'] = group.last_turn
+                    delta['turn'] = self.turn
+                    deltas[view] = delta
+
+            for view, group in self._groups.iteritems():
+                group.region = new_regions[view]
+            self._avatar_locations = avatar_locations
+
+            for view, group in self._groups.iteritems():
+                if view in deltas:
+                    group.last_turn = self.turn
+                    group.keyframe = None
+                if self._keyframe_due(group):
+                    group.keyframe_turn = self.turn
+                    frame = self._keyframe(group)
+                    for sid in group.members:
+                        self._deliver(sid, frame, keyframe=True)
+                elif view in deltas:
+                    frame = encode(deltas[view], self.players)
+                    for sid in group.members:
+                        self._deliver(sid, frame)
+
+    def metrics(self):
+        """How far behind each client is, and how many frames it has missed."""
+        with self._lock:
+            return {sid: outbox.metrics() for sid, outbox in self._outboxes.iteritems()}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._views)
+
+
+class PolledSpectator(object):
+    """
+    A client of the plain routes, which asks for updates when it wants them
+    instead of being sent them each turn. It keeps the records of the cells
+    it has been sent, to work out what has changed since.
+    """
+
+    def __init__(self, game_state, view):
+        self.game_state = game_state
+        self.view = view
+        self._records = {}
+
+    def get_updates(self):
+        with self.game_state as game_state:
+            region = self.view.region(_avatar_locations(game_state))
+            records = records_in(game_state.world_map, region)
+        world_state = WorldState()
+        world_state.add_changes((self._records.get(location), records.get(location))
+                                for location in set(self._records) | set(records))
+        self._records = records
+        return world_state.get_updates()
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import socket
+
+import eventlet
+from eventlet.queue import Full
+from eventlet.queue import LightQueue
+from eventlet.semaphore import Semaphore
+
+from simulation.geography.location import Location
+from simulation.state.world_state import CellRecord
+from simulation.state.world_state import TurnChanges
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TURN_STREAM_SETTINGS = {
+    # Turns a gateway may fall behind before it's disconnected. It then
+    # reconnects and starts again from a snapshot of the world.
+    'MAX_QUEUED_TURNS': 20,
+    # Seconds between a gateway's reports of how many spectators it has,
+    # and between its attempts to reconnect to the game
+    'REPORT_INTERVAL': 5,
+}
+
+
+def encode_changes(changes):
+    """The changes as one line of JSON, to be written to any number of gateways."""
+    return json.dumps({
+        'turn': changes.turn,
+        'full': changes.full,
+        'cells': [[location.x, location.y, record.habitable, record.pickup, record.player]
+                  for location, record in changes.records.iteritems()],
+        'removed': [[location.x, location.y] for location in changes.removed],
+        'avatars': [[player_id, location.x, location.y]
+                    for player_id, location in changes.avatar_locations.iteritems()],
+    }, separators=(',', ':')) + '\n'
+
+
+def decode_changes(line, players):
+    """
+    The changes from a line written by encode_changes. Their player_dicts
+    are shared through the PlayerRecords, as those from a WorldRecorder are.
+    """
+    data = json.loads(line)
+    records = {}
+    for x, y, habitable, pickup, player in data['cells']:
+        location = Location(x, y)
+        if player is not None:
+            player = players.share({str(key): value for key, value in player.items()})
+        records[location] = CellRecord(location, habitable, pickup, player)
+    avatar_locations = {player_id: Location(x, y) for player_id, x, y in data['avatars']}
+    players.retain(avatar_locations)
+    return TurnChanges(data['turn'], records, [Location(x, y) for x, y in data['removed']],
+                       avatar_locations, data['full'])
+
+
+class _Gateway(object):
+    def __init__(self, connection, max_queued_turns):
+        self.connection = connection
+        self.queue = LightQueue(maxsize=max_queued_turns)
+        self.viewers = 0
+
+
+class TurnPublisher(object):
+    """
+    Publishes each turn's changes on a Unix socket, for spectator gateways
+    to serve spectators from, so that they don't take time from the game.
+    The changes are encoded once, however many gateways there are. A new
+    gateway is sent a snapshot of the whole world first. A gateway that
+    falls behind is disconnected, never holding up turns.
+
+    Gateways report how many spectators they have, and `on_viewers` is
+    called when one has some, so that they can wake a hibernating game.
+
+    This class is thread safe
+    """
+
+    def __init__(self, path, recorder, on_viewers=None, settings=None):
+        new_settings = DEFAULT_TURN_STREAM_SETTINGS.copy()
+        new_settings.update(settings or {})
+
+        self.path = path
+        self.max_queued_turns = new_settings['MAX_QUEUED_TURNS']
+        self.on_viewers = on_viewers
+        self._recorder = recorder
+        self._gateways = set()
+        self._lock = Semaphore()
+
+    def start(self):
+        if os.path.exists(self.path):
+            # Left by an earlier run
+            os.remove(self.path)
+        server = eventlet.listen(self.path, family=socket.AF_UNIX)
+        eventlet.spawn_n(self._serve, server)
+
+    def _serve(self, server):
+        while True:
+            connection, _ = server.accept()
+            eventlet.spawn_n(self._handle, connection)
+
+    def _handle(self, connection):
+        gateway = _Gateway(connection, self.max_queued_turns)
+        with self._lock:
+            gateway.queue.put(encode_changes(self._recorder.snapshot()))
+            self._gateways.add(gateway)
+        LOGGER.info('Spectator gateway connected')
+        reader = eventlet.spawn(self._read_reports, gateway)
+        try:
+            while True:
+                line = gateway.queue.get()
+                if line is None:
+                    break
+                connection.sendall(line)
+        except socket.error as err:
+            LOGGER.info('Lost spectator gateway: %s', err)
+        finally:
+            with self._lock:
+                self._gateways.discard(gateway)
+            reader.kill()
+            connection.close()
+
+    def _read_reports(self, gateway):
+        for line in gateway.connection.makefile('r'):
+            try:
+                gateway.viewers = int(json.loads(line)['viewers'])
+            except (ValueError, KeyError, TypeError):
+                LOGGER.warning('Bad report from spectator gateway: %r', line)
+                continue
+            if gateway.viewers and self.on_viewers is not None:
+                self.on_viewers()
+        # The gateway hung up
+        gateway.queue.put(None)
+
+    def publish(self, changes):
+        line = encode_changes(changes)
+        with self._lock:
+            for gateway in list(self._gateways):
+                try:
+                    gateway.queue.put_nowait(line)
+                except Full:
+                    LOGGER.warning('Spectator gateway fell behind, disconnecting it')
+                    self._gateways.discard(gateway)
+                    gateway.connection.shutdown(socket.SHUT_RDWR)
+
+    def viewers(self):
+        with self._lock:
+            return sum(gateway.viewers for gateway in self._gateways)
+
+
+class TurnSubscriber(object):
+    """
+    The gateway's end of a TurnPublisher: applies the changes it publishes
+    to the gateway's spectators, and reports how many there are.
+    Reconnects, starting again from a snapshot, if it loses the game.
+    """
+
+    def __init__(self, path, spectators, settings=None):
+        new_settings = DEFAULT_TURN_STREAM_SETTINGS.copy()
+        new_settings.update(settings or {})
+
+        self.path = path
+        self.report_interval = new_settings['REPORT_INTERVAL']
+        self._spectators = spectators
+
+    def _report(self, connection):
+        try:
+            while True:
+                connection.sendall(json.dumps({'viewers': len(self._spectators)}) + '\n')
+                eventlet.sleep(self.report_interval)
+        except socket.error:
+            # Following the game will find out
+            pass
+
+    def follow(self, connection):
+        """Apply the changes published on the connection until it closes."""
+        reporter = eventlet.spawn(self._report, connection)
+        try:
+            for line in connection.makefile('r'):
+                self._spectators.apply(decode_changes(line, self._spectators.players))
+        finally:
+            reporter.kill()
+
+    def run(self):
+        while True:
+            try:
+                connection = eventlet.connect(self.path, family=socket.AF_UNIX)
+                LOGGER.info('Following game at %s', self.path)
+                self.follow(connection)
+                connection.close()
+                LOGGER.info('Game at %s closed the connection', self.path)
+            except socket.error as err:
+                LOGGER.info('Could not follow game at %s: %s', self.path, err)
+            eventlet.sleep(self.report_interval)
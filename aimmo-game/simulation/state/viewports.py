@@ -0,0 +1,150 @@
+from collections import defaultdict
+from collections import namedtuple
+from numbers import Integral
+
+from simulation.geography.location import Location
+
+# Cells either side of a followed avatar, by default
+DEFAULT_VIEW_RADIUS = 7
+# Widest and tallest a view can be, in cells, to keep zooming out cheap
+MAX_VIEW_SIZE = 101
+# Width and height, in cells, of the squares the spatial index is split into
+BUCKET_SIZE = 16
+
+
+class Region(namedtuple('Region', ['min_x', 'min_y', 'max_x', 'max_y'])):
+    """A rectangle of cells, including its edges."""
+
+    def contains(self, location):
+        return self.min_x <= location.x <= self.max_x and self.min_y <= location.y <= self.max_y
+
+    def locations(self):
+        for x in range(self.min_x, self.max_x + 1):
+            for y in range(self.min_y, self.max_y + 1):
+                yield Location(x, y)
+
+    def intersection(self, other):
+        region = Region(max(self.min_x, other.min_x), max(self.min_y, other.min_y),
+                        min(self.max_x, other.max_x), min(self.max_y, other.max_y))
+        if region.min_x > region.max_x or region.min_y > region.max_y:
+            return None
+        return region
+
+    def minus(self, other):
+        """The parts of this region outside the other, as up to four regions."""
+        if other is None:
+            return [self]
+        overlap = self.intersection(other)
+        if overlap is None:
+            return [self]
+        parts = []
+        if self.min_x < overlap.min_x:
+            parts.append(Region(self.min_x, self.min_y, overlap.min_x - 1, self.max_y))
+        if overlap.max_x < self.max_x:
+            parts.append(Region(overlap.max_x + 1, self.min_y, self.max_x, self.max_y))
+        if self.min_y < overlap.min_y:
+            parts.append(Region(overlap.min_x, self.min_y, overlap.max_x, overlap.min_y - 1))
+        if overlap.max_y < self.max_y:
+            parts.append(Region(overlap.min_x, overlap.max_y + 1, overlap.max_x, self.max_y))
+        return parts
+
+
+def changed_locations(old_region, new_region):
+    """Every location that is in one of the regions but not the other."""
+    for first, second in ((old_region, new_region), (new_region, old_region)):
+        if first is not None:
+            for part in first.minus(second):
+                for location in part.locations():
+                    yield location
+
+
+class FollowAvatar(namedtuple('FollowAvatar', ['avatar_id', 'radius'])):
+    """The square of cells around an avatar, moving with it."""
+
+    def region(self, avatar_locations):
+        location = avatar_locations.get(self.avatar_id)
+        if location is None:
+            return None
+        return Region(location.x - self.radius, location.y - self.radius,
+                      location.x + self.radius, location.y + self.radius)
+
+
+class FixedView(namedtuple('FixedView', ['min_x', 'min_y', 'width', 'height'])):
+    """A rectangle of cells that stays put."""
+
+    def region(self, avatar_locations):
+        return Region(self.min_x, self.min_y, self.min_x + self.width - 1, self.min_y + self.height - 1)
+
+
+def _integer(data, key, minimum=None, maximum=None):
+    value = data.get(key)
+    if not isinstance(value, Integral) or isinstance(value, bool):
+        raise ValueError('%s should be an integer' % key)
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ValueError('%s should be between %s and %s' % (key, minimum, maximum))
+    return value
+
+
+def parse_view(data):
+    """
+    The view a client asked for, which is one of:
+        - An avatar's id, to follow it from DEFAULT_VIEW_RADIUS cells away.
+        - {'avatar': id, 'radius': cells}, to follow an avatar (zooming by
+          changing the radius).
+        - {'x': min_x, 'y': min_y, 'width': cells, 'height': cells}, to
+          watch a fixed rectangle (panning by changing x and y).
+
+    Raises ValueError if the data is none of these.
+    """
+    if isinstance(data, Integral) and not isinstance(data, bool):
+        return FollowAvatar(data, DEFAULT_VIEW_RADIUS)
+    if not isinstance(data, dict):
+        raise ValueError('Unknown view %r' % (data,))
+    if 'avatar' in data:
+        return FollowAvatar(_integer(data, 'avatar'),
+                            _integer(data, 'radius', 0, MAX_VIEW_SIZE // 2)
+                            if 'radius' in data else DEFAULT_VIEW_RADIUS)
+    return FixedView(_integer(data, 'x'), _integer(data, 'y'),
+                     _integer(data, 'width', 1, MAX_VIEW_SIZE),
+                     _integer(data, 'height', 1, MAX_VIEW_SIZE))
+
+
+class SpatialIndex(object):
+    """
+    Keys of regions, filed under each of the BUCKET_SIZE squares of cells
+    they overlap, so the regions a location might be in are found without
+    looking at every region.
+    """
+
+    def __init__(self, bucket_size=BUCKET_SIZE):
+        self._bucket_size = bucket_size
+        self._buckets = defaultdict(set)
+        self._regions = {}
+
+    def _buckets_of(self, region):
+        size = self._bucket_size
+        for x in range(region.min_x // size, region.max_x // size + 1):
+            for y in range(region.min_y // size, region.max_y // size + 1):
+                yield x, y
+
+    def add(self, key, region):
+        self.remove(key)
+        if region is None:
+            return
+        self._regions[key] = region
+        for bucket in self._buckets_of(region):
+            self._buckets[bucket].add(key)
+
+    def remove(self, key):
+        region = self._regions.pop(key, None)
+        if region is None:
+            return
+        for bucket in self._buckets_of(region):
+            self._buckets[bucket].discard(key)
+            if not self._buckets[bucket]:
+                del self._buckets[bucket]
+
+    def candidates(self, location):
+        """Keys of the regions that might contain the location."""
+        size = self._bucket_size
+        return self._buckets.get((location.x // size, location.y // size), ())
@@ -1,11 +1,28 @@
+import json
 from enum import Enum
 from collections import defaultdict
+from collections import namedtuple
+
+from eventlet.semaphore import Semaphore
 
 
 class MapFeature(Enum):
     PICKUP = 'pickup'
     OBSTACLE = 'obstacle'
 
+# What a viewer is shown of a cell: whether it's an obstacle, whether it has
+# a pickup and the player_dict of any avatar on it
+CellRecord = namedtuple('CellRecord', ['location', 'habitable', 'pickup', 'player'])
+
+
+class TurnChanges(namedtuple('TurnChanges', ['turn', 'records', 'removed', 'avatar_locations', 'full'])):
+    """
+    What changed in the world on a turn: the records of the cells that
+    changed (by location), the locations no longer on the map and where
+    every avatar is. Full changes have the record of every cell, replacing
+    whatever was known of the world before.
+    """
+
 
 class WorldState():
     """
@@ -20,17 +37,17 @@ class WorldState():
             * Score points.
             * Pickups.
             * Obstacles.
+
+    The updates are worked out from the records of the cells that the
+    client has been sent and those it should now have (see add_changes).
     """
 
-    def __init__(self, game_state):
-        self.game_state = game_state
+    def __init__(self):
         self.players = defaultdict(dict)
         self.map_features = defaultdict(dict)
         self.clear_updates()
 
     def get_updates(self):
-        self.refresh()
-
         updates = {
             'players'      : dict(self.players),
             'map_features' : dict(self.map_features)
@@ -71,62 +88,180 @@ class WorldState():
     def delete_map_feature(self, map_feature, map_feature_id):
         self.map_features[map_feature]["delete"].append(map_feature_id)
 
-    # Refresh the world state. Basically gather information from the avatar manager
-    # and the world map and organise it.
-    def refresh(self):
-        def player_dict(avatar):
-            return {
-                'id'    : avatar.player_id,
-                'x'     : avatar.location.x,
-                'y'     : avatar.location.y,
-                'score' : avatar.score,
-                'health': avatar.health,
-                # This is temporary, appearance will be more complex later on.
-                'colour': "#%06x" % (avatar.player_id * 4999)
-            }
+    def add_changes(self, changes):
+        """
+        Add the updates that bring a client from one set of cell records to
+        another, given as (old record, new record) pairs for each location
+        where they might differ. A record is None where the cell was or is
+        out of view.
+        """
+        old_players = {}
+        new_players = {}
+        for old, new in changes:
+            if old == new:
+                continue
+            old_obstacle = old is not None and not old.habitable
+            new_obstacle = new is not None and not new.habitable
+            if old_obstacle and not new_obstacle:
+                self.delete_map_feature(MapFeature.OBSTACLE.value, map_feature_dict(old.location))
+            elif new_obstacle and not old_obstacle:
+                self.create_map_feature(MapFeature.OBSTACLE.value, map_feature_dict(new.location))
 
-        def map_feature_dict(map_feature):
-            return {
-                'id' : str(hash(map_feature)),
-                'x'  : map_feature.location.x,
-                'y'  : map_feature.location.y
-            }
+            old_pickup = old is not None and old.pickup
+            new_pickup = new is not None and new.pickup
+            if old_pickup and not new_pickup:
+                self.delete_map_feature(MapFeature.PICKUP.value, map_feature_dict(old.location))
+            elif new_pickup and not old_pickup:
+                self.create_map_feature(MapFeature.PICKUP.value, map_feature_dict(new.location))
+
+            if old is not None and old.player is not None:
+                old_players[old.player['id']] = old.player
+            if new is not None and new.player is not None:
+                new_players[new.player['id']] = new.player
+
+        # Players are matched by id, as moving takes them from one cell to another
+        for player_id, player in new_players.items():
+            if player_id not in old_players:
+                self.create_player(player)
+            elif player != old_players[player_id]:
+                self.update_player(player)
+        for player_id, player in old_players.items():
+            if player_id not in new_players:
+                self.delete_player(player)
+
+    @property
+    def is_empty(self):
+        return not (any(self.players.values()) or
+                    any(changes for feature in self.map_features.values()
+                        for changes in feature.values()))
+
+
+def player_dict(avatar):
+    return {
+        'id'    : avatar.player_id,
+        'x'     : avatar.location.x,
+        'y'     : avatar.location.y,
+        'score' : avatar.score,
+        'health': avatar.health,
+        # This is temporary, appearance will be more complex later on.
+        'colour': "#%06x" % (avatar.player_id * 4999)
+    }
+
+
+def map_feature_dict(location):
+    return {
+        'id' : str(hash(location)),
+        'x'  : location.x,
+        'y'  : location.y
+    }
+
+
+class PlayerRecords(object):
+    """
+    The player_dict of each avatar, kept between turns and only rebuilt when
+    the avatar's location, score or health changes, along with its JSON once
+    someone has needed it. Every cell record, delta and keyframe showing an
+    unchanged avatar shares the same dict and JSON, so telling that the
+    avatar hasn't changed is an identity check and it is never re-encoded.
+    """
+
+    def __init__(self):
+        # Player id -> ((x, y, score, health), player_dict, JSON or None)
+        self._players = {}
+
+    def get(self, avatar):
+        key = (avatar.location.x, avatar.location.y, avatar.score, avatar.health)
+        entry = self._players.get(avatar.player_id)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        if entry is None:
+            player = player_dict(avatar)
+        else:
+            # Keep the rest, such as the colour, from the last one
+            player = dict(entry[1], x=avatar.location.x, y=avatar.location.y,
+                          score=avatar.score, health=avatar.health)
+        self._players[avatar.player_id] = (key, player, None)
+        return player
+
+    def encode(self, player):
+        entry = self._players.get(player['id'])
+        if entry is None or entry[1] is not player:
+            # Not one of ours, or out of date
+            return json.dumps(player, separators=(',', ':'))
+        if entry[2] is None:
+            entry = entry[:2] + (json.dumps(player, separators=(',', ':')),)
+            self._players[player['id']] = entry
+        return entry[2]
+
+    def share(self, player):
+        """
+        The record equal to the player_dict if there is one, else the
+        player_dict, kept for next time. For records that weren't made by
+        `get`, such as those decoded from another process.
+        """
+        entry = self._players.get(player['id'])
+        if entry is not None and entry[1] == player:
+            return entry[1]
+        self._players[player['id']] = (None, player, None)
+        return player
+
+    def retain(self, player_ids):
+        """Forget the avatars that have left the game."""
+        for player_id in set(self._players) - set(player_ids):
+            del self._players[player_id]
+
+
+def cell_record(cell, players=None):
+    if cell.avatar is None:
+        player = None
+    elif players is None:
+        player = player_dict(cell.avatar)
+    else:
+        player = players.get(cell.avatar)
+    return CellRecord(cell.location, cell.habitable, cell.pickup is not None, player)
+
+
+def records_in(world_map, region):
+    """The records of the cells of the map in the region, by location."""
+    if region is None:
+        return {}
+    return {location: cell_record(world_map.get_cell(location))
+            for location in region.locations() if world_map.is_on_map(location)}
+
+
+class WorldRecorder(object):
+    """
+    Keeps the records of the world's cells, working out each turn which of
+    them have changed, once for all spectators wherever they are served.
+
+    This class is thread safe
+    """
+
+    def __init__(self):
+        self.players = PlayerRecords()
+        self.turn = 0
+        self._records = {}
+        self._avatar_locations = {}
+        self._lock = Semaphore()
+
+    def record(self, game_state):
+        """This turn's changes. Call with the game state locked."""
+        with self._lock:
+            records = {cell.location: cell_record(cell, self.players)
+                       for cell in game_state.world_map.all_cells()}
+            avatar_locations = {avatar.player_id: avatar.location
+                                for avatar in game_state.avatar_manager.avatars}
+            self.players.retain(avatar_locations)
+            changed = {location: record for location, record in records.iteritems()
+                       if self._records.get(location) != record}
+            removed = [location for location in self._records if location not in records]
+
+            self.turn += 1
+            self._records = records
+            self._avatar_locations = avatar_locations
+            return TurnChanges(self.turn, changed, removed, avatar_locations, full=False)
 
-        with self.game_state as game_state:
-            # Update active avatars.
-            for player in game_state.avatar_manager.avatars:
-                self.update_player(player_dict(player))
-
-            main_avatar_id = 1
-            avatar_view = game_state.avatar_manager.get_avatar(main_avatar_id).view
-            if avatar_view is None:
-                return
-
-            if avatar_view.is_empty:
-                avatar_view.reveal_all_cells(game_state.world_map)
-                avatar_view.is_empty = False
-
-            # Creation.
-            for cell in avatar_view.cells_to_reveal:
-                # There is an avatar.
-                if cell.avatar is not None:
-                    self.create_player(player_dict(cell.avatar))
-                # Cell is an obstacle.
-                if not cell.habitable:
-                    self.create_map_feature(MapFeature.OBSTACLE.value, map_feature_dict(cell))
-
-            # Updates.
-            for cell in avatar_view.cells_in_view:
-                if cell.add_to_scene is not None:
-                    self.create_map_feature(cell.add_to_scene.value, map_feature_dict(cell))
-                if cell.remove_from_scene is not None:
-                    self.delete_map_feature(cell.remove_from_scene.value, map_feature_dict(cell))
-
-            # Deletion.
-            for cell in avatar_view.cells_to_clear:
-                # There is an avatar.
-                if cell.avatar is not None:
-                    self.delete_player(player_dict(cell.avatar))
-                # Cell is an obstacle.
-                if not cell.habitable:
-                    self.delete_map_feature(MapFeature.OBSTACLE.value, map_feature_dict(cell))
+    def snapshot(self):
+        """The whole world as of the last turn, as full changes."""
+        with self._lock:
+            return TurnChanges(self.turn, dict(self._records), [], dict(self._avatar_locations), full=True)
@@ -1,9 +1,13 @@
 import logging
+import resource
 import time
+from threading import Event
+from threading import Lock
 from threading import RLock
 from threading import Thread
 
 from simulation.action import PRIORITIES
+from simulation.avatar.turn_timings import RollingHistogram
 
 LOGGER = logging.getLogger(__name__)
 
@@ -45,11 +49,38 @@ class TurnManager(Thread):
         state_provider.set_world(game_state)
         self.end_turn_callback = end_turn_callback
         self._completion_url = completion_url
+        self.turn_times = RollingHistogram()
+        self._running = Event()
+        self._running.set()
+        self._turn_lock = Lock()
         super(TurnManager, self).__init__()
 
+    def pause(self):
+        """Stop running turns, waiting for any turn under way to finish."""
+        self._running.clear()
+        with self._turn_lock:
+            pass
+
+    def resume(self):
+        self._running.set()
+
     def run_turn(self):
         raise NotImplementedError("Abstract method.")
 
+    @staticmethod
+    def _avatars_to_ask(avatars):
+        """
+        The avatars whose workers should be asked for an action this turn.
+        The rest have broken workers and just wait, without a request.
+        """
+        avatars_to_ask = []
+        for avatar in avatars:
+            if avatar.worker_health.allow_request():
+                avatars_to_ask.append(avatar)
+            else:
+                avatar.skip_turn()
+        return avatars_to_ask
+
     @staticmethod
     def _register_action(avatar):
         """
@@ -70,21 +101,48 @@ class TurnManager(Thread):
     def _mark_complete(self):
         pass
 
-    def run(self):
-        while True:
-            try:
-                self.run_turn()
+    def load_metrics(self):
+        """
+        How heavy this game is, for the game creator to place it on a host:
+        avatar count, recent turn times (in seconds) and peak memory (in MiB).
+        """
+        with state_provider as game_state:
+            num_avatars = len(game_state.avatar_manager.active_avatars)
+        # ru_maxrss is in kilobytes on Linux
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        return {
+            'avatars': num_avatars,
+            'turn_time': {
+                'p50': self.turn_times.percentile(50),
+                'p95': self.turn_times.percentile(95),
+            },
+            'memory': memory,
+        }
+
+    def _run_turn_and_update(self):
+        start = time.time()
+        try:
+            self.run_turn()
 
-                with state_provider as game_state:
-                    game_state.update_environment()
+            with state_provider as game_state:
+                game_state.update_environment()
 
-                self.end_turn_callback()
-            except Exception:
-                LOGGER.exception('Error while running turn')
+            self.end_turn_callback()
+        except Exception:
+            LOGGER.exception('Error while running turn')
+        self.turn_times.add(time.time() - start)
 
+        with state_provider as game_state:
             if game_state.is_complete():
                 LOGGER.info('Game complete')
                 self._mark_complete()
+
+    def run(self):
+        while True:
+            self._running.wait()
+            with self._turn_lock:
+                if self._running.is_set():
+                    self._run_turn_and_update()
             time.sleep(0.5)
 
 
@@ -96,8 +154,10 @@ class SequentialTurnManager(TurnManager):
         with state_provider as game_state:
             avatars = game_state.avatar_manager.active_avatars
 
+        avatars_to_ask = set(self._avatars_to_ask(avatars))
         for avatar in avatars:
-            self._register_action(avatar)
+            if avatar in avatars_to_ask:
+                self._register_action(avatar)
             with state_provider as game_state:
                 location_to_clear = avatar.action.target_location
                 avatar.action.process(game_state.world_map)
@@ -114,7 +174,7 @@ class ConcurrentTurnManager(TurnManager):
             avatars = game_state.avatar_manager.active_avatars
 
         threads = [Thread(target=self._register_action,
-                          args=(avatar,)) for avatar in avatars]
+                          args=(avatar,)) for avatar in self._avatars_to_ask(avatars)]
 
         [thread.start() for thread in threads]
         [thread.join() for thread in threads]
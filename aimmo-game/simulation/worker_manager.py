@@ -8,15 +8,29 @@ import tempfile
 import threading
 import time
 
+import eventlet
 import requests
 from eventlet.greenpool import GreenPool
 from eventlet.semaphore import Semaphore
 from pykube import HTTPClient
 from pykube import KubeConfig
 from pykube import Pod
+from pykube.exceptions import HTTPError
 
 LOGGER = logging.getLogger(__name__)
 
+# Snapshots of avatar state larger than this (as JSON) are not kept
+MAX_PERSISTENT_STATE_SIZE = 64 * 1024
+
+# Seconds between polls of the game's users, and once the players app has
+# shown it notifies us of changes, when polling is only a backstop
+POLL_INTERVAL = 10
+NOTIFIED_POLL_INTERVAL = 60
+
+# Seconds between snapshots of every worker's avatar state, taken while the
+# workers are healthy, as a worker being replaced often can't be snapshotted
+SNAPSHOT_INTERVAL = 60
+
 
 class _WorkerManagerData(object):
     """
@@ -26,19 +40,45 @@ class _WorkerManagerData(object):
     def __init__(self, game_state, user_codes):
         self._game_state = game_state
         self._user_codes = user_codes
+        self._code_hashes = {}
+        # User id -> (code, code hash) of new code the user's worker failed to load
+        self._rejected_code = {}
+        self._worker_urls = {}
+        self._persistent_states = {}
         self._lock = Semaphore()
 
     def _remove_avatar(self, user_id):
         assert self._lock.locked
         self._game_state.remove_avatar(user_id)
         del self._user_codes[user_id]
+        self._code_hashes.pop(user_id, None)
+        self._rejected_code.pop(user_id, None)
+
+    @staticmethod
+    def _is_same_code(user, code, code_hash):
+        if code_hash is not None and user.get('code_hash') is not None:
+            return code_hash == user['code_hash']
+        return code == user.get('code')
+
+    def _is_code_different(self, user):
+        assert self._lock.locked
+        if user['id'] not in self._user_codes:
+            return True
+        if self._is_same_code(user, self._user_codes[user['id']], self._code_hashes.get(user['id'], None)):
+            return False
+        # Code that failed to load is not tried again until it changes
+        rejected = self._rejected_code.get(user['id'], None)
+        return rejected is None or not self._is_same_code(user, *rejected)
+
+    def is_code_different(self, user):
+        with self._lock:
+            return self._is_code_different(user)
 
     def remove_user_if_code_is_different(self, user):
         with self._lock:
-            existing_code = self._user_codes.get(user['id'], None)
-            if existing_code != user['code']:
+            if self._is_code_different(user):
                 # Remove avatar from the game, so it stops being called for turns
-                if existing_code is not None:
+                if user['id'] in self._user_codes:
                     self._remove_avatar(user['id'])
                 return True
             else:
@@ -49,20 +89,76 @@ class _WorkerManagerData(object):
             # Add avatar back into game
             self._game_state.add_avatar(
                 user_id=user['id'], worker_url="%s/turn/" % worker_url)
+            self._worker_urls[user['id']] = worker_url
+
+    def get_worker_url(self, user_id):
+        with self._lock:
+            return self._worker_urls.get(user_id, None)
+
+    def set_persistent_state(self, user_id, state):
+        with self._lock:
+            self._persistent_states[user_id] = state
+
+    def get_persistent_state(self, user_id):
+        with self._lock:
+            return self._persistent_states.get(user_id, None)
 
     def set_code(self, user):
         with self._lock:
             self._user_codes[user['id']] = user['code']
+            self._code_hashes[user['id']] = user.get('code_hash', None)
+            self._rejected_code.pop(user['id'], None)
+
+    def reject_code(self, user):
+        """Keep the user's current code, but stop treating this code as new."""
+        with self._lock:
+            self._rejected_code[user['id']] = (user['code'], user.get('code_hash', None))
 
     def get_code(self, player_id):
         with self._lock:
             return self._user_codes[player_id]
 
+    def remove_avatars_to_respawn(self, user_ids):
+        """
+        Take the given users' avatars out of the game, returning the users
+        so they can be spawned again with the code they had.
+        """
+        with self._lock:
+            users = []
+            for user_id in user_ids:
+                if user_id not in self._user_codes:
+                    continue
+                users.append({
+                    'id': user_id,
+                    'code': self._user_codes[user_id],
+                    'code_hash': self._code_hashes.get(user_id, None),
+                })
+                self._remove_avatar(user_id)
+            return users
+
+    def get_user_ids(self):
+        with self._lock:
+            return list(self._user_codes)
+
+    def remove_all_avatars(self):
+        """
+        Take every avatar out of the game and forget its code and worker,
+        keeping only its persistent state. Returns the users' ids.
+        """
+        with self._lock:
+            user_ids = list(self._user_codes)
+            for user_id in user_ids:
+                self._remove_avatar(user_id)
+                self._worker_urls.pop(user_id, None)
+            return user_ids
+
     def remove_unknown_avatars(self, known_user_ids):
         with self._lock:
             unknown_user_ids = set(self._user_codes) - frozenset(known_user_ids)
             for u in unknown_user_ids:
                 self._remove_avatar(u)
+                self._worker_urls.pop(u, None)
+                self._persistent_states.pop(u, None)
             return unknown_user_ids
 
     def set_main_avatar(self, avatar_id):
@@ -70,22 +166,119 @@ class _WorkerManagerData(object):
             self._game_state.main_avatar_id = avatar_id
 
 
+class IdleWorker(object):
+    """A started worker that has not been given a player yet."""
+
+    def __init__(self, url, handle):
+        self.url = url
+        self.handle = handle
+
+
+class WorkerPool(object):
+    """
+    Keeps up to `size` idle workers started, so a player's code can be given
+    to one straight away instead of waiting for a new worker to start.
+    This class is thread safe
+    """
+
+    def __init__(self, size, create_idle_worker):
+        self.size = size
+        self._create_idle_worker = create_idle_worker
+        self._idle = []
+        self._starting = 0
+        self._claimed = 0
+        self._misses = 0
+        self._failures = 0
+        self._lock = Semaphore()
+
+    def claim(self):
+        """Take an idle worker from the pool, or None if none are ready."""
+        if not self.size:
+            return None
+        with self._lock:
+            if self._idle:
+                worker = self._idle.pop(0)
+                self._claimed += 1
+            else:
+                worker = None
+                self._misses += 1
+        self.refill()
+        return worker
+
+    def refill(self):
+        """Start, in the background, any workers the pool is missing."""
+        with self._lock:
+            missing = max(0, self.size - len(self._idle) - self._starting)
+            self._starting += missing
+        for _ in range(missing):
+            eventlet.spawn_n(self._start_worker)
+
+    def _start_worker(self):
+        try:
+            worker = self._create_idle_worker()
+        except Exception:
+            LOGGER.exception('Failed to start pooled worker')
+            with self._lock:
+                self._starting -= 1
+                self._failures += 1
+        else:
+            with self._lock:
+                self._starting -= 1
+                self._idle.append(worker)
+
+    def drain(self):
+        """Take every idle worker out of the pool, so they can be stopped."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            return idle
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'starting': self._starting,
+                'claimed': self._claimed,
+                'misses': self._misses,
+                'failures': self._failures,
+            }
+
+
 class WorkerManager(threading.Thread):
     """
     Methods of this class must be thread safe unless explicitly stated.
     """
     daemon = True
 
-    def __init__(self, game_state, users_url, port=5000):
+    def __init__(self, game_state=None, users_url=None, port=5000, worker_pool_size=0):
         """
 
-        :param thread_pool:
+        :param game_state: the game to manage workers for. A standby game
+            server leaves it out, and calls attach() once it is given a game.
+        :param worker_pool_size: number of idle workers to keep started.
         """
-        self._data = _WorkerManagerData(game_state, {})
-        self.users_url = users_url
+        self._data = None
+        self.users_url = None
         self._pool = GreenPool(size=3)
+        self.worker_pool = WorkerPool(worker_pool_size, self.create_idle_worker)
+        self._game_etag = None
+        self._update_requested = threading.Event()
+        self._notified = False
+        self._broken_workers = set()
+        self._broken_workers_lock = Semaphore()
+        self._suspended = False
+        self._update_lock = Semaphore()
+        self._next_snapshot = time.time() + SNAPSHOT_INTERVAL
         self.port = port
         super(WorkerManager, self).__init__()
+        if game_state is not None:
+            self.attach(game_state, users_url)
+
+    def attach(self, game_state, users_url):
+        """Start managing the workers of the given game."""
+        self._data = _WorkerManagerData(game_state, {})
+        self.users_url = users_url
+        game_state.avatar_manager.on_worker_broken = self.report_broken_worker
 
     def get_code(self, player_id):
         return self._data.get_code(player_id)
@@ -93,7 +286,25 @@ class WorkerManager(threading.Thread):
     def get_persistent_state(self, player_id):
         """Get the persistent state for a worker."""
 
-        return None
+        return self._data.get_persistent_state(player_id)
+
+    def save_persistent_state(self, player_id):
+        """Keep a snapshot of the state of the player's current worker."""
+        worker_url = self._data.get_worker_url(player_id)
+        if worker_url is None:
+            return
+        try:
+            response = requests.get('%s/snapshot/' % worker_url, timeout=5)
+            response.raise_for_status()
+            state = response.json()['state']
+        except (requests.RequestException, ValueError, KeyError) as err:
+            # The last snapshot we kept (if any) will have to do
+            LOGGER.info('Could not snapshot worker for user %s: %s', player_id, err)
+            return
+        if len(json.dumps(state)) > MAX_PERSISTENT_STATE_SIZE:
+            LOGGER.info('Snapshot of worker for user %s is too large to keep', player_id)
+            state = None
+        self._data.set_persistent_state(player_id, state)
 
     def create_worker(self, player_id):
         """Create a worker."""
@@ -105,10 +316,91 @@ class WorkerManager(threading.Thread):
 
         raise NotImplemented
 
+    def create_idle_worker(self):
+        """Start a worker with no player, returning an IdleWorker."""
+
+        raise NotImplementedError
+
+    def assign_idle_worker(self, worker, player_id):
+        """Record that a pooled worker now belongs to the given player."""
+
+        raise NotImplementedError
+
+    def remove_idle_worker(self, worker):
+        """Remove a pooled worker that could not be given a player."""
+
+        raise NotImplementedError
+
+    def get_metrics(self):
+        return {
+            'worker_pool': self.worker_pool.stats(),
+        }
+
+    def _wait_for_worker(self, worker_url, timeout=30):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                requests.get(worker_url).raise_for_status()
+                return
+            except requests.RequestException:
+                if time.time() > deadline:
+                    raise EnvironmentError('Worker did not start at %s' % worker_url)
+                time.sleep(0.2)
+
+    def _create_worker_from_pool(self, player_id):
+        worker = self.worker_pool.claim()
+        if worker is None:
+            return None
+        try:
+            requests.post('%s/initialise/' % worker.url, json={
+                'code': self.get_code(player_id),
+                'options': {},
+                'state': self.get_persistent_state(player_id),
+            }).raise_for_status()
+        except requests.RequestException as err:
+            LOGGER.warning('Could not initialise pooled worker for %s: %s', player_id, err)
+            self.remove_idle_worker(worker)
+            return None
+        self.assign_idle_worker(worker, player_id)
+        LOGGER.info("Pooled worker given to %s, listening at %s", player_id, worker.url)
+        return worker.url
+
+    def reload_worker(self, user):
+        """
+        Give a running worker the user's new code without restarting it.
+        Returns False if there is no healthy worker to reload, in which case
+        it has to be respawned instead.
+        """
+        worker_url = self._data.get_worker_url(user['id'])
+        if worker_url is None:
+            return False
+        # In case the worker is lost reloading, and has to be respawned
+        self.save_persistent_state(user['id'])
+        try:
+            response = requests.post('%s/reload/' % worker_url, json={
+                'code': user['code'],
+                'options': {},
+            }, timeout=5)
+        except requests.RequestException as err:
+            LOGGER.info('Could not reload worker for user %s: %s', user['id'], err)
+            return False
+        if response.status_code == 400:
+            # Respawning would not help: the new code does not load anywhere.
+            # get_code (and so any respawn) stays with what the worker runs.
+            LOGGER.info('New code for user %s failed to load, worker kept its old code', user['id'])
+            self._data.reject_code(user)
+            return True
+        if not response.ok:
+            return False
+        self._data.set_code(user)
+        LOGGER.info('Reloaded code for user %s', user['id'])
+        return True
+
     # TODO handle failure
     def spawn(self, user):
-        # Get persistent state from worker
-        persistent_state = self.get_persistent_state(user['id'])  # noqa: F841
+        # Get persistent state from worker, for its replacement, if it can
+        # still give it; otherwise the last snapshot taken is used
+        self.save_persistent_state(user['id'])
 
         # Kill worker
         LOGGER.info("Removing worker for user %s" % user['id'])
@@ -118,7 +410,9 @@ class WorkerManager(threading.Thread):
 
         # Spawn worker
         LOGGER.info("Spawning worker for user %s" % user['id'])
-        worker_url = self.create_worker(user['id'])
+        worker_url = self._create_worker_from_pool(user['id'])
+        if worker_url is None:
+            worker_url = self.create_worker(user['id'])
 
         # Add avatar back into game
         self._data.add_avatar(user, worker_url)
@@ -127,16 +421,67 @@ class WorkerManager(threading.Thread):
     def _parallel_map(self, func, iterable_args):
         list(self._pool.imap(func, iterable_args))
 
+    def _fetch_game(self):
+        """
+        Get the game's users, with the code of only those users whose code
+        hash has changed. Returns (None, None) if the game's revision is
+        the same as at the last update.
+        """
+        headers = {}
+        if self._game_etag is not None:
+            headers['If-None-Match'] = self._game_etag
+        response = requests.get(self.users_url, params={'code': 'false'}, headers=headers)
+        if response.status_code == 304:
+            return None, None
+        response.raise_for_status()
+        game_data = response.json()
+        users = game_data['main']['users']
+
+        # Servers that don't know code=false send all the code anyway
+        missing_code = [user['id'] for user in users if 'code' not in user and self._data.is_code_different(user)]
+        if missing_code:
+            code_response = requests.get(self.users_url, params={'users': ','.join(str(i) for i in missing_code)})
+            code_response.raise_for_status()
+            new_code = {user['id']: user for user in code_response.json()['main']['users']}
+            for user in users:
+                if user['id'] in new_code:
+                    user['code'] = new_code[user['id']]['code']
+                    user['code_hash'] = new_code[user['id']].get('code_hash')
+            # Users who left between the two requests
+            game_data['main']['users'] = [user for user in users if 'code' in user or user['id'] not in missing_code]
+        return game_data, response.headers.get('ETag')
+
     def update(self):
+        with self._update_lock:
+            if not self._suspended:
+                self._update()
+
+    def _snapshot_workers_if_due(self):
+        if time.time() < self._next_snapshot:
+            return
+        self._next_snapshot = time.time() + SNAPSHOT_INTERVAL
+        self._parallel_map(self.save_persistent_state, self._data.get_user_ids())
+
+    def _update(self):
+        # Even if the game itself is unchanged
+        self._respawn_broken_workers()
+        self._snapshot_workers_if_due()
         try:
             LOGGER.info("Waking up")
-            game_data = requests.get(self.users_url).json()
-        except (requests.RequestException, ValueError) as err:
+            game_data, etag = self._fetch_game()
+        except (requests.RequestException, ValueError, KeyError) as err:
             LOGGER.error("Failed to obtain game data : %s", err)
         else:
+            if game_data is None:
+                LOGGER.info("Game unchanged")
+                return
             game = game_data['main']
 
-            # Remove users with different code
+            # Reload the code of healthy workers in place
+            changed_users = [user for user in game['users'] if self._data.is_code_different(user)]
+            self._parallel_map(self.reload_worker, changed_users)
+
+            # Remove users with different code (whose workers could not be reloaded)
             users_to_add = []
             for user in game['users']:
                 if self._data.remove_user_if_code_is_different(user):
@@ -155,11 +500,63 @@ class WorkerManager(threading.Thread):
             # Update main avatar
             self._data.set_main_avatar(game_data['main']['main_avatar'])
 
+            # Only now everything is up to date with this revision
+            self._game_etag = etag
+
+    def suspend(self):
+        """
+        Stop every worker, pooled ones included, and stop updating until
+        resume(). Workers' persistent state is kept for their replacements.
+        """
+        with self._update_lock:
+            self._suspended = True
+        user_ids = self._data.get_user_ids()
+        LOGGER.info('Suspending, stopping workers for users %s', user_ids)
+        self._parallel_map(self.save_persistent_state, user_ids)
+        self._data.remove_all_avatars()
+        self._parallel_map(self.remove_worker, user_ids)
+        for worker in self.worker_pool.drain():
+            self.remove_idle_worker(worker)
+
+    def resume(self):
+        """Start workers for every user again."""
+        with self._update_lock:
+            self._suspended = False
+            # Make the next update fetch every user
+            self._game_etag = None
+        self.worker_pool.refill()
+        self.request_update()
+
+    def request_update(self):
+        """Update now, e.g. because we were told a player's code changed."""
+        self._notified = True
+        self._update_requested.set()
+
+    def report_broken_worker(self, player_id):
+        """Have the player's worker replaced, as it keeps failing to take turns."""
+        with self._broken_workers_lock:
+            self._broken_workers.add(player_id)
+        self._update_requested.set()
+
+    def _respawn_broken_workers(self):
+        with self._broken_workers_lock:
+            player_ids, self._broken_workers = self._broken_workers, set()
+        users = self._data.remove_avatars_to_respawn(player_ids)
+        if users:
+            LOGGER.info('Respawning broken workers for users %s', [user['id'] for user in users])
+        self._parallel_map(self.spawn, users)
+
+    def _wait_for_next_update(self):
+        interval = NOTIFIED_POLL_INTERVAL if self._notified else POLL_INTERVAL
+        self._update_requested.wait(interval)
+        self._update_requested.clear()
+
     def run(self):
+        self.worker_pool.refill()
         while True:
             self.update()
             LOGGER.info("Sleeping")
-            time.sleep(10)
+            self._wait_for_next_update()
 
 
 class LocalWorkerManager(WorkerManager):
@@ -193,6 +590,11 @@ class LocalWorkerManager(WorkerManager):
         with open('{}/avatar.py'.format(data_dir), 'w') as avatar_file:
             avatar_file.write(code)
 
+        state = data.get('state')
+        if state is not None:
+            with open('{}/state.json'.format(data_dir), 'w') as state_file:
+                json.dump(state, state_file)
+
         env['PYTHONPATH'] = data_dir
 
         process = subprocess.Popen(['python', 'service.py', self.host, str(port), str(data_dir)], cwd=self.worker_directory, env=env)
@@ -202,6 +604,8 @@ class LocalWorkerManager(WorkerManager):
             self.host,
             port,
         )
+        # Turns sent before then would fail, and count against its health
+        self._wait_for_worker(worker_url)
         LOGGER.info("Worker started for %s, listening at %s", player_id, worker_url)
         return worker_url
 
@@ -210,39 +614,210 @@ class LocalWorkerManager(WorkerManager):
             self.workers[player_id].kill()
             del self.workers[player_id]
 
+    def create_idle_worker(self):
+        port = self.port_counter.next()
+        process = subprocess.Popen(['python', 'service.py', self.host, str(port)], cwd=self.worker_directory)
+        atexit.register(process.kill)
+        worker_url = 'http://%s:%d' % (
+            self.host,
+            port,
+        )
+        self._wait_for_worker(worker_url)
+        return IdleWorker(worker_url, process)
+
+    def assign_idle_worker(self, worker, player_id):
+        assert(player_id not in self.workers)
+        self.workers[player_id] = worker.handle
+
+    def remove_idle_worker(self, worker):
+        worker.handle.kill()
+
+
+class LocalHostWorkerManager(WorkerManager):
+    """
+    Serves every player from a single local worker host process. Adding a
+    player to the running host is already quick, so there is no pool of
+    idle workers: any WORKER_POOL_SIZE is ignored.
+    """
+
+    host = '127.0.0.1'
+    worker_directory = LocalWorkerManager.worker_directory
+
+    def __init__(self, *args, **kwargs):
+        super(LocalHostWorkerManager, self).__init__(*args, **kwargs)
+        if self.worker_pool.size:
+            LOGGER.info('Worker host has no use for a pool of %d idle workers, not keeping one',
+                        self.worker_pool.size)
+            self.worker_pool.size = 0
+        self.host_url = 'http://%s:%d' % (self.host, self.port + 10)
+        self._host_process = None
+        self._host_lock = Semaphore()
+
+    def _ensure_host(self):
+        with self._host_lock:
+            if self._host_process is None or self._host_process.poll() is not None:
+                self._host_process = subprocess.Popen(
+                    ['python', 'host.py', self.host, str(self.port + 10)],
+                    cwd=self.worker_directory)
+                atexit.register(self._host_process.kill)
+                self._wait_for_worker(self.host_url)
+
+    def _player_url(self, player_id):
+        return '%s/players/%d' % (self.host_url, player_id)
+
+    def create_worker(self, player_id):
+        self._ensure_host()
+        worker_url = self._player_url(player_id)
+        requests.put(worker_url + '/', json={
+            'code': self.get_code(player_id),
+            'options': {},
+            'state': self.get_persistent_state(player_id),
+        }).raise_for_status()
+        LOGGER.info("Worker hosted for %s, listening at %s", player_id, worker_url)
+        return worker_url
+
+    def remove_worker(self, player_id):
+        if self._host_process is None:
+            return
+        try:
+            requests.delete(self._player_url(player_id) + '/')
+        except requests.RequestException as err:
+            LOGGER.warning('Could not remove worker for %s: %s', player_id, err)
+
+
+def _is_pod_ready(pod):
+    status = pod.obj.get('status', {})
+    if status.get('phase') in ('Failed', 'Succeeded'):
+        raise EnvironmentError('Worker pod %s stopped, details %s' % (pod.name, pod.obj))
+    if status.get('phase') != 'Running' or not status.get('podIP'):
+        return False
+    return all(condition['status'] == 'True'
+               for condition in status.get('conditions', []) if condition['type'] == 'Ready')
+
+
+class PodCache(object):
+    """
+    The game's worker pods, kept up to date by a single watch on the API
+    server rather than by polling each new pod and listing pods to remove.
+    This class is thread safe
+    """
+
+    def __init__(self, make_query):
+        """
+
+        :param make_query: returns a fresh pykube query for the pods to cache.
+        """
+        self._make_query = make_query
+        self._pods = {}
+        self._condition = threading.Condition()
+
+    def start(self):
+        thread = threading.Thread(target=self._watch_forever)
+        thread.daemon = True
+        thread.start()
+
+    def _watch_forever(self):
+        while True:
+            try:
+                self._watch()
+            except Exception:
+                LOGGER.exception('Pod watch failed, listing pods again')
+                time.sleep(1)
+
+    def _watch(self):
+        # List everything, then watch for changes from that point on
+        query = self._make_query()
+        pods = list(query)
+        with self._condition:
+            self._pods = {pod.name: pod for pod in pods}
+            self._condition.notify_all()
+        for event in query.watch(since=query.response['metadata']['resourceVersion']):
+            self._apply(event.type, event.object)
+
+    def _apply(self, event_type, pod):
+        with self._condition:
+            if event_type == 'DELETED':
+                self._pods.pop(pod.name, None)
+            else:
+                self._pods[pod.name] = pod
+            self._condition.notify_all()
+
+    def find(self, **labels):
+        with self._condition:
+            return [pod for pod in self._pods.values()
+                    if all(pod.labels.get(key) == value for (key, value) in labels.items())]
+
+    def wait_until_ready(self, name, timeout):
+        """The pod once it is running and ready, as soon as the watch says so."""
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                pod = self._pods.get(name)
+                if pod is not None and _is_pod_ready(pod):
+                    return pod
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise EnvironmentError('Could not start worker %s, details %s' % (
+                        name, pod.obj if pod is not None else None))
+                self._condition.wait(remaining)
+
 
 class KubernetesWorkerManager(WorkerManager):
     """Kubernetes worker manager."""
 
     def __init__(self, *args, **kwargs):
         self.api = HTTPClient(KubeConfig.from_service_account())
-        self.game_id = os.environ['GAME_ID']
-        self.game_url = os.environ['GAME_URL']
+        # Standby game servers don't have a game yet, so label their workers by pod
+        self.game_id = os.environ.get('GAME_ID') or os.environ['HOSTNAME']
+        self.game_url = os.environ.get('GAME_URL')
+        # Workers are found by their game server, which unlike the game doesn't change
+        self._server = os.environ['HOSTNAME']
+        self._pod_cache = PodCache(lambda: Pod.objects(self.api).filter(selector={
+            'app': 'aimmo-game-worker',
+            'server': self._server,
+        }))
+        self._pod_cache.start()
         super(KubernetesWorkerManager, self).__init__(*args, **kwargs)
 
-    def create_worker(self, player_id):
+    def attach(self, game_state, users_url):
+        self.game_url = os.environ['GAME_URL']
+        game_id = os.environ.get('GAME_ID')
+        if game_id and game_id != self.game_id:
+            self._relabel_workers(game_id)
+        super(KubernetesWorkerManager, self).attach(game_state, users_url)
+
+    def _relabel_workers(self, game_id):
+        """Label the workers started while standing by (the idle pool) with our new game."""
+        self.game_id = game_id
+        for pod in self._pod_cache.find():
+            pod.obj['metadata']['labels']['game'] = game_id
+            try:
+                pod.update()
+            except HTTPError as err:
+                LOGGER.warning('Could not relabel worker %s for game %s: %s', pod.name, game_id, err)
+
+    def _create_pod(self, player_label, env):
+        if 'WORKER_RUNTIME' in os.environ:
+            # Which of the worker's runtimes to run (see its run.sh)
+            env = env + [{'name': 'WORKER_RUNTIME', 'value': os.environ['WORKER_RUNTIME']}]
         pod = Pod(
             self.api,
             {
              'kind': 'Pod',
              'apiVersion': 'v1',
              'metadata': {
-                'generateName': "aimmo-%s-worker-%s-" % (self.game_id, player_id),
+                'generateName': "aimmo-%s-worker-%s-" % (self.game_id, player_label),
                 'labels': {
                     'app': 'aimmo-game-worker',
                     'game': self.game_id,
-                    'player': str(player_id),
+                    'server': self._server,
+                    'player': player_label,
                     },
                 },
              'spec': {
                 'containers': [
                     {
-                        'env': [
-                            {
-                                'name': 'DATA_URL',
-                                'value': "%s/player/%d" % (self.game_url, player_id),
-                            },
-                        ],
+                        'env': env,
                         'name': 'aimmo-game-worker',
                         'image': 'ocadotechnology/aimmo-game-worker:%s' % os.environ.get('IMAGE_SUFFIX', 'latest'),
                         'ports': [
@@ -263,29 +838,42 @@ class KubernetesWorkerManager(WorkerManager):
             }
         )
         pod.create()
-        iterations = 0
-        while pod.obj['status']['phase'] == 'Pending':
-            if iterations > 30:
-                raise EnvironmentError('Could not start worker %s, details %s' % (player_id, pod.obj))
-            LOGGER.debug('Waiting for worker %s', player_id)
-            time.sleep(5)
-            pod.reload()
-            iterations += 1
+        LOGGER.debug('Waiting for worker %s', player_label)
+        return self._pod_cache.wait_until_ready(pod.name, timeout=150)
+
+    def create_worker(self, player_id):
+        pod = self._create_pod(str(player_id), [
+            {
+                'name': 'DATA_URL',
+                'value': "%s/player/%d" % (self.game_url, player_id),
+            },
+        ])
         worker_url = "http://%s:5000" % pod.obj['status']['podIP']
         LOGGER.info("Worker started for %s, listening at %s", player_id, worker_url)
         return worker_url
 
+    def create_idle_worker(self):
+        pod = self._create_pod('idle', [])
+        worker_url = "http://%s:5000" % pod.obj['status']['podIP']
+        self._wait_for_worker(worker_url)
+        return IdleWorker(worker_url, pod)
+
+    def assign_idle_worker(self, worker, player_id):
+        # Relabel the pod so remove_worker finds it by player
+        worker.handle.obj['metadata']['labels']['player'] = str(player_id)
+        worker.handle.update()
+
+    def remove_idle_worker(self, worker):
+        worker.handle.delete()
+
     def remove_worker(self, player_id):
-        for pod in Pod.objects(self.api).filter(selector={
-            'app': 'aimmo-game-worker',
-            'game': self.game_id,
-            'player': str(player_id),
-        }):
+        for pod in self._pod_cache.find(player=str(player_id)):
             LOGGER.debug('Removing pod %s', pod.obj['spec'])
             pod.delete()
 
 
 WORKER_MANAGERS = {
     'local': LocalWorkerManager,
+    'local-host': LocalHostWorkerManager,
     'kubernetes': KubernetesWorkerManager,
 }
@@ -1,12 +1,16 @@
 from __future__ import absolute_import
 
-from unittest import TestCase, skip
+from json import loads
+from unittest import TestCase
 
 import service
 from simulation.avatar.avatar_manager import AvatarManager
 from simulation.geography.location import Location
 from simulation.state.game_state import GameState
-from simulation.state.world_state import WorldState
+from simulation.state.spectators import PolledSpectator
+from simulation.state.viewports import DEFAULT_VIEW_RADIUS
+from simulation.state.viewports import FollowAvatar
+from simulation.state.world_state import WorldRecorder
 from simulation.turn_manager import state_provider
 from simulation.world_map import WorldMap
 from .test_simulation.dummy_avatar import MoveEastDummy
@@ -30,6 +34,213 @@ class TestServiceAPI(TestCase):
         response = self.app.get('/')
         self.assertEqual(response.data, 'HEALTHY')
 
+    def test_configure_only_once(self):
+        service.turn_manager = object()
+        try:
+            response = self.app.post('/configure/', json={'settings': '{}'})
+        finally:
+            service.turn_manager = None
+        self.assertEqual(response.status_code, 409)
+
+    def test_standby_notified(self):
+        old_worker_manager = service.worker_manager
+        service.worker_manager = FakeWorkerManager()
+        try:
+            response = self.app.post('/notify/')
+            updates = service.worker_manager.updates_requested
+        finally:
+            service.worker_manager = old_worker_manager
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(updates, 1)
+
+    def test_standby_plain_connect(self):
+        response = self.app.get('/plain/1/connect')
+        self.assertEqual(response.data, 'CONNECT')
+
+    def test_gateway_metrics(self):
+        response = self.app.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(loads(response.data)), ['spectators', 'viewers'])
+
+    def test_gateway_not_notified(self):
+        response = self.app.post('/notify/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_no_player_data_without_game(self):
+        response = self.app.get('/player/1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_plain_exit_removes_spectator(self):
+        service.plain_spectators[1] = PolledSpectator(state_provider, FollowAvatar(1, DEFAULT_VIEW_RADIUS))
+        self.app.get('/plain/1/exit-game')
+        self.assertNotIn(1, service.plain_spectators)
+
+    def test_player_refused_while_hibernating(self):
+        service.hibernator = FakeHibernator()
+        service.hibernator.hibernating = True
+        service.turn_manager = object()
+        try:
+            response = self.app.get('/player/1')
+        finally:
+            service.hibernator = None
+            service.turn_manager = None
+        self.assertEqual(response.status_code, 503)
+
+    def test_plain_update_wakes_game(self):
+        service.hibernator = FakeHibernator()
+        service.hibernator.hibernating = True
+        service.plain_spectators[1] = PolledSpectator(state_provider, FollowAvatar(1, DEFAULT_VIEW_RADIUS))
+        state_provider.set_world(GameState(WorldMap.generate_empty_map(3, 3, {}), SimpleAvatarManager()))
+        try:
+            response = self.app.get('/plain/1/update')
+            hibernator = service.hibernator
+        finally:
+            service.hibernator = None
+            del service.plain_spectators[1]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(hibernator.touched, 1)
+        self.assertFalse(hibernator.hibernating)
+
+    def test_get_checkpoint(self):
+        service.hibernator = FakeHibernator()
+        try:
+            response = self.app.get('/checkpoint/')
+        finally:
+            service.hibernator = None
+        self.assertEqual(loads(response.data), {'cells': []})
+
+    def test_put_checkpoint(self):
+        service.hibernator = FakeHibernator()
+        try:
+            response = self.app.put('/checkpoint/', json={'cells': []})
+            rejected = self.app.put('/checkpoint/', json={'cells': [], 'settings_hash': 'other'})
+            restored = service.hibernator.restored
+        finally:
+            service.hibernator = None
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(rejected.status_code, 409)
+        self.assertEqual(restored, [{'cells': []}])
+
+    def test_delete_checkpoint(self):
+        service.hibernator = FakeHibernator()
+        try:
+            response = self.app.delete('/checkpoint/')
+            hibernator = service.hibernator
+        finally:
+            service.hibernator = None
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hibernator.discarded)
+
+class FakeWorkerManager(object):
+    def __init__(self):
+        self.updates_requested = 0
+
+    def request_update(self):
+        self.updates_requested += 1
+
+class FakeHibernator(object):
+    def __init__(self):
+        self.hibernating = False
+        self.touched = 0
+        self.discarded = False
+        self.restored = []
+
+    def touch(self):
+        self.touched += 1
+        self.hibernating = False
+
+    def discard_checkpoint(self):
+        self.discarded = True
+
+    def take_checkpoint(self):
+        return {'cells': []}
+
+    def restore_checkpoint(self, checkpoint):
+        if 'settings_hash' in checkpoint:
+            return False
+        self.restored.append(checkpoint)
+        return True
+
+
+class TestSpectatorUpdates(TestCase):
+    def setUp(self):
+        service.hibernator = FakeHibernator()
+        service.socketio.init_app(service.app)
+        self.old_spectators = service.spectators
+        self.old_recorder = service.recorder
+        service.recorder = WorldRecorder()
+        service.spectators = service.Spectators(service.send_frame, service.recorder.players)
+        avatar_manager = SimpleAvatarManager()
+        world_map = WorldMap.generate_empty_map(5, 5, {})
+        world_map.get_cell(Location(0, -1)).avatar = avatar_manager.avatars_by_id[1]
+        world_map.get_cell(Location(1, 1)).habitable = False
+        state_provider.set_world(GameState(world_map, avatar_manager))
+
+    def tearDown(self):
+        service.hibernator = None
+        service.spectators = self.old_spectators
+        service.recorder = self.old_recorder
+
+    def connect(self, view):
+        client = service.socketio.test_client(service.app)
+        client.emit('client-ready', view)
+        return client
+
+    def world_updates(self, client):
+        return [loads(message['args'][0]) for message in client.get_received()
+                if message['name'] == 'world-update']
+
+    def test_each_client_gets_one_update(self):
+        clients = [self.connect(1) for _ in range(3)] + [self.connect({'x': 0, 'y': 0, 'width': 2, 'height': 2})]
+        for client in clients:
+            client.get_received()
+        service.send_world_update()
+        updates = [self.world_updates(client) for client in clients]
+        self.assertEqual([len(client_updates) for client_updates in updates], [1, 1, 1, 1])
+        self.assertEqual(updates[0][0]['players']['create'][0]['id'], 1)
+        self.assertEqual(updates[3][0]['players']['create'], [])
+        self.assertEqual(len(updates[3][0]['map_features']['obstacle']['create']), 1)
+
+    def test_late_client_caught_up(self):
+        self.connect(1)
+        service.send_world_update()
+        late = self.connect(1)
+        update, = self.world_updates(late)
+        self.assertEqual(update['players']['create'][0]['id'], 1)
+
+    def test_resync(self):
+        client = self.connect(1)
+        service.send_world_update()
+        client.get_received()
+        client.emit('resync')
+        keyframe, = self.world_updates(client)
+        self.assertTrue(keyframe['reset'])
+        self.assertEqual(keyframe['turn'], 1)
+
+    def test_bad_view_ignored(self):
+        client = self.connect('everything')
+        self.assertEqual(self.world_updates(client), [])
+        self.assertEqual(len(service.spectators), 0)
+
+    def test_disconnected_client_removed(self):
+        client = self.connect(1)
+        client.disconnect()
+        self.assertEqual(len(service.spectators), 0)
+        self.assertEqual(service.spectators.metrics(), {})
+
+    def test_unacknowledged_frames_dropped(self):
+        # The test client never acknowledges what it is sent
+        client = self.connect(1)
+        for _ in range(5):
+            with state_provider as game_state:
+                game_state.avatar_manager.avatars_by_id[1].score += 1
+            service.send_world_update()
+        updates = self.world_updates(client)
+        self.assertEqual(len(updates), service.spectators.max_unacknowledged)
+        metrics, = service.spectators.metrics().values()
+        self.assertEqual(metrics['dropped'], 6 - service.spectators.max_unacknowledged)
+
+
 class TestServiceInternals(TestCase):
     def setUp(self):
         self.user_id = 1
@@ -52,10 +263,8 @@ class TestServiceInternals(TestCase):
                 for y in range(3) for x in range(2)}
         state_provider.set_world(GameState(WorldMap(grid, {}), avatar_manager))
 
-        world_state = WorldState(state_provider)
-        world_state.ready_to_update = True
-
-        return world_state.get_updates()
+        spectator = PolledSpectator(state_provider, FollowAvatar(1, DEFAULT_VIEW_RADIUS))
+        return spectator.get_updates()
 
     def test_player_dict(self):
         player_list = self.setup_world()['players']['create']
@@ -67,7 +276,6 @@ class TestServiceInternals(TestCase):
         self.assertEqual(details['health'], 5)
         self.assertEqual(details['score'], 0)
 
-    @skip("not implemented")
     def test_pickup_list(self):
         result = self.setup_world()['map_features']['pickup']['create']
         pickup_pos_list = [(pickup['x'], pickup['y']) for pickup in result]
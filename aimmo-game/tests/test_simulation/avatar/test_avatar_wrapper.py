@@ -3,9 +3,11 @@ from __future__ import absolute_import
 import json
 from unittest import TestCase
 
+import requests
 from httmock import HTTMock
 
 from simulation.avatar import avatar_wrapper
+from simulation.avatar import worker_health
 
 
 class MockEffect(object):
@@ -47,6 +49,14 @@ def InvalidJSONRequest(url, request):
     return 'EXCEPTION'
 
 
+def ServerErrorRequest(url, request):
+    return {'status_code': 500, 'content': 'Internal Server Error'}
+
+
+def TimeoutRequest(url, request):
+    raise requests.exceptions.ReadTimeout()
+
+
 def NonExistentActionRequest(url, request):
     return json.dumps({'action': {'action_type': 'fake', 'option': {}}})
 
@@ -84,6 +94,52 @@ class TestAvatarWrapper(TestCase):
         self.take_turn(request_mock)
         self.assertEqual(actions_created, [], 'No action should have been applied')
 
+    def test_turn_timings_recorded(self):
+        self.take_turn()
+        self.assertEqual(self.avatar.turn_timings.summary()['round_trip']['count'], 1)
+        self.assertFalse(self.avatar.turn_metrics()['near_deadline'])
+
+    def test_worker_timeout(self):
+        self.take_turn(TimeoutRequest)
+        self.assertEqual(actions_created, [], 'No action should have been applied')
+        self.assertIsInstance(self.avatar.action, avatar_wrapper.WaitAction)
+
+    def test_failures_open_breaker(self):
+        broken = []
+        self.avatar = avatar_wrapper.AvatarWrapper(1, None, 'http://test', None,
+                                                   health_settings={'FAILURE_THRESHOLD': 2, 'RESPAWN_THRESHOLD': 3},
+                                                   on_worker_broken=broken.append)
+        self.take_turn(TimeoutRequest)
+        self.assertTrue(self.avatar.worker_health.allow_request())
+        self.take_turn(TimeoutRequest)
+        self.assertFalse(self.avatar.worker_health.allow_request())
+        self.take_turn(TimeoutRequest)
+        self.assertEqual(broken, [1])
+        self.assertEqual(self.avatar.turn_metrics()['worker_health']['consecutive_failures'], 3)
+
+    def test_bad_action_data_is_not_a_worker_failure(self):
+        self.take_turn(InvalidJSONRequest)
+        self.assertEqual(self.avatar.worker_health.consecutive_failures, 0)
+
+    def test_server_error_is_a_worker_failure(self):
+        self.take_turn(ServerErrorRequest)
+        self.assertEqual(self.avatar.worker_health.consecutive_failures, 1)
+
+    def test_bad_probe_settles_breaker(self):
+        self.avatar = avatar_wrapper.AvatarWrapper(1, None, 'http://test', None,
+                                                   health_settings={'FAILURE_THRESHOLD': 1, 'PROBE_INTERVAL': 0})
+        self.take_turn(TimeoutRequest)
+        self.assertTrue(self.avatar.worker_health.allow_request())
+        self.take_turn(InvalidJSONRequest)
+        self.assertEqual(self.avatar.worker_health.state, worker_health.OPEN)
+        self.assertTrue(self.avatar.worker_health.allow_request())
+        self.take_turn()
+        self.assertEqual(self.avatar.worker_health.state, worker_health.CLOSED)
+
+    def test_skip_turn_waits(self):
+        self.avatar.skip_turn()
+        self.assertIsInstance(self.avatar.action, avatar_wrapper.WaitAction)
+
     def add_effects(self, num=2):
         effects = []
         for _ in range(num):
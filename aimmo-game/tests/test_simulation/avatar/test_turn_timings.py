@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+
+from unittest import TestCase
+
+from simulation.avatar.turn_timings import RollingHistogram, TurnTimings
+
+
+class TestRollingHistogram(TestCase):
+    def test_empty_summary(self):
+        self.assertEqual(RollingHistogram().summary(), {'count': 0})
+        self.assertIsNone(RollingHistogram().percentile(50))
+
+    def test_only_keeps_window(self):
+        histogram = RollingHistogram(window=3)
+        for value in (10, 0.1, 0.2, 0.3):
+            histogram.add(value)
+        self.assertEqual(len(histogram), 3)
+        self.assertEqual(histogram.summary()['max'], 0.3)
+
+    def test_percentiles(self):
+        histogram = RollingHistogram()
+        for value in range(1, 101):
+            histogram.add(value / 100.0)
+        self.assertEqual(histogram.percentile(50), 0.51)
+        self.assertEqual(histogram.percentile(95), 0.95)
+
+    def test_buckets(self):
+        histogram = RollingHistogram()
+        for value in (0.0005, 0.002, 0.003, 3):
+            histogram.add(value)
+        buckets = histogram.buckets()
+        self.assertEqual(buckets['0.001'], 1)
+        self.assertEqual(buckets['0.005'], 2)
+        self.assertEqual(buckets['+Inf'], 1)
+        self.assertEqual(sum(buckets.values()), 4)
+
+
+class TestTurnTimings(TestCase):
+    def test_record_worker_timings(self):
+        timings = TurnTimings()
+        timings.record(0.05, {'user_code': {'wall': 0.04, 'cpu': 0.03}})
+        summary = timings.summary()
+        self.assertEqual(summary['round_trip']['max'], 0.05)
+        self.assertEqual(summary['user_code_wall']['max'], 0.04)
+        self.assertEqual(summary['user_code_cpu']['max'], 0.03)
+
+    def test_malformed_timings_ignored(self):
+        timings = TurnTimings()
+        timings.record(0.05, None)
+        timings.record(0.05, {'user_code': 'slow', 'decode': {'wall': 'x', 'cpu': 0.01}})
+        self.assertEqual(sorted(timings.summary()), ['decode_cpu', 'round_trip'])
+
+    def test_unknown_stages_ignored(self):
+        timings = TurnTimings()
+        timings.record(0.05, {'stage_%d' % i: {'wall': 0.01, 'cpu': 0.01} for i in range(10)})
+        self.assertEqual(sorted(timings.summary()), ['round_trip'])
+
+    def test_near_deadline(self):
+        timings = TurnTimings()
+        self.assertFalse(timings.is_near_deadline(1.0))
+        timings.record(0.5, {})
+        self.assertFalse(timings.is_near_deadline(1.0))
+        timings.record(0.9, {})
+        self.assertTrue(timings.is_near_deadline(1.0))
@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+
+import json
+import socket
+import threading
+from unittest import TestCase
+
+import requests
+from httmock import HTTMock
+
+from simulation.avatar import worker_connection
+from simulation.avatar.avatar_manager import AvatarManager
+from simulation.avatar.worker_connection import WorkerConnection
+
+
+class RecordingRequest(object):
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, url, request):
+        self.requests.append(request)
+        return json.dumps({'action': {'action_type': 'wait'}})
+
+
+class TestWorkerConnection(TestCase):
+    def test_fetch_action_posts_state(self):
+        mocker = RecordingRequest()
+        connection = WorkerConnection('http://test/turn/')
+        with HTTMock(mocker):
+            data = connection.fetch_action({'test': True})
+        self.assertEqual(data, {'action': {'action_type': 'wait'}})
+        self.assertEqual(len(mocker.requests), 1)
+        self.assertEqual(json.loads(mocker.requests[0].body), {'test': True})
+
+    def test_session_is_reused(self):
+        connection = WorkerConnection('http://test/turn/')
+        session = connection._session
+        with HTTMock(RecordingRequest()):
+            connection.fetch_action({})
+            connection.fetch_action({})
+        self.assertIs(connection._session, session)
+
+    def test_default_settings(self):
+        connection = WorkerConnection('http://test/turn/')
+        self.assertEqual(connection.timeout, (1.0, 2.0))
+        adapter = connection._session.get_adapter('http://test/turn/')
+        self.assertEqual(adapter._pool_maxsize, 2)
+        self.assertEqual(adapter.max_retries.total, 1)
+
+    def test_settings_override_defaults(self):
+        connection = WorkerConnection('http://test/turn/', {'READ_TIMEOUT': 5, 'POOL_MAXSIZE': 4})
+        self.assertEqual(connection.timeout, (1.0, 5))
+        adapter = connection._session.get_adapter('http://test/turn/')
+        self.assertEqual(adapter._pool_maxsize, 4)
+
+
+class TestAvatarManagerConnections(TestCase):
+    def test_settings_passed_to_avatars(self):
+        manager = AvatarManager({'READ_TIMEOUT': 7})
+        avatar = manager.add_avatar(1, 'http://test/turn/', None)
+        self.assertEqual(avatar._connection.timeout, (1.0, 7))
+
+    def test_connection_closed_on_removal(self):
+        manager = AvatarManager()
+        avatar = manager.add_avatar(1, 'http://test/turn/', None)
+        closed = []
+        avatar._connection.close = lambda: closed.append(True)
+        manager.remove_avatar(1)
+        self.assertEqual(closed, [True])
+
+
+class FakeStreamWorker(object):
+    """Accepts one stream and answers each turn with `respond(frame)`."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.connection = None
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        self.connection, _ = self.listener.accept()
+        try:
+            while True:
+                frame = worker_connection._read_frame(self.connection)
+                for reply in self.respond(frame):
+                    worker_connection._write_frame(self.connection, reply)
+        except (EOFError, socket.error):
+            pass
+
+    def stream_details(self, url, request):
+        return json.dumps({'port': self.port})
+
+    def close(self):
+        self.connection.shutdown(socket.SHUT_RDWR)
+        self.connection.close()
+        self.listener.close()
+
+
+class TestStreamWorkerConnection(TestCase):
+    def connect(self, respond, settings=None, on_disconnect=None):
+        self.worker = FakeStreamWorker(respond)
+        connection = worker_connection.StreamWorkerConnection(
+            'http://127.0.0.1:%d/turn/' % self.worker.port, settings, on_disconnect)
+        self.addCleanup(connection.close)
+        return connection
+
+    def fetch(self, connection, state):
+        with HTTMock(self.worker.stream_details):
+            return connection.fetch_action(state)
+
+    def test_turns_over_one_stream(self):
+        connection = self.connect(lambda frame: [{'seq': frame['seq'], 'action': frame['state']}])
+        self.assertEqual(self.fetch(connection, {'turn': 1})['action'], {'turn': 1})
+        self.assertEqual(self.fetch(connection, {'turn': 2})['action'], {'turn': 2})
+        self.assertEqual(connection._seq, 2)
+
+    def test_late_replies_dropped(self):
+        def respond(frame):
+            return [{'seq': frame['seq'] - 1, 'action': 'late'}, {'seq': frame['seq'], 'action': 'on time'}]
+        connection = self.connect(respond)
+        self.assertEqual(self.fetch(connection, {})['action'], 'on time')
+
+    def test_timeout(self):
+        connection = self.connect(lambda frame: [], {'READ_TIMEOUT': 0.05})
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.fetch(connection, {})
+
+    def test_disconnect_noticed(self):
+        disconnected = threading.Event()
+        connection = self.connect(lambda frame: [{'seq': frame['seq']}],
+                                  on_disconnect=lambda connection: disconnected.set())
+        self.fetch(connection, {})
+        self.worker.close()
+        self.assertTrue(disconnected.wait(1))
+        self.assertFalse(connection.is_connected)
+
+    def test_transport_setting(self):
+        self.assertIsInstance(worker_connection.create_worker_connection('http://test/turn/'),
+                              worker_connection.WorkerConnection)
+        self.assertIsInstance(
+            worker_connection.create_worker_connection('http://test/turn/', {'TRANSPORT': 'stream'}),
+            worker_connection.StreamWorkerConnection)
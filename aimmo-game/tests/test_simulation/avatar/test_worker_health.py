@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+
+from unittest import TestCase
+
+from simulation.avatar import worker_health
+from simulation.avatar.worker_health import WorkerHealth
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestWorkerHealth(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.broken = []
+        self.health = WorkerHealth({'FAILURE_THRESHOLD': 2, 'PROBE_INTERVAL': 5, 'RESPAWN_THRESHOLD': 4},
+                                   on_broken=lambda: self.broken.append(True), clock=self.clock)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.health.record_failure()
+
+    def test_closed_until_threshold(self):
+        self.fail(1)
+        self.assertEqual(self.health.state, worker_health.CLOSED)
+        self.assertTrue(self.health.allow_request())
+        self.fail(1)
+        self.assertEqual(self.health.state, worker_health.OPEN)
+        self.assertFalse(self.health.allow_request())
+
+    def test_single_probe_after_interval(self):
+        self.fail(2)
+        self.clock.now = 5
+        self.assertTrue(self.health.allow_request())
+        self.assertEqual(self.health.state, worker_health.HALF_OPEN)
+        self.assertFalse(self.health.allow_request())
+
+    def test_successful_probe_closes(self):
+        self.fail(2)
+        self.clock.now = 5
+        self.health.allow_request()
+        self.health.record_success(0.1)
+        self.assertEqual(self.health.state, worker_health.CLOSED)
+        self.assertEqual(self.health.consecutive_failures, 0)
+
+    def test_bad_response_only_fails_probes(self):
+        self.health.record_bad_response()
+        self.assertEqual(self.health.consecutive_failures, 0)
+        self.fail(2)
+        self.clock.now = 5
+        self.health.allow_request()
+        self.health.record_bad_response()
+        self.assertEqual(self.health.state, worker_health.OPEN)
+
+    def test_failed_probe_reopens(self):
+        self.fail(2)
+        self.clock.now = 5
+        self.health.allow_request()
+        self.fail(1)
+        self.assertEqual(self.health.state, worker_health.OPEN)
+        self.assertFalse(self.health.allow_request())
+        self.clock.now = 10
+        self.assertTrue(self.health.allow_request())
+
+    def test_broken_reported_once(self):
+        self.fail(3)
+        self.assertEqual(self.broken, [])
+        self.fail(3)
+        self.assertEqual(self.broken, [True])
+
+    def test_latency_ewma(self):
+        self.health.record_success(1.0)
+        self.assertEqual(self.health.latency_ewma, 1.0)
+        self.health.record_success(2.0)
+        self.assertAlmostEqual(self.health.latency_ewma, 1.2)
+        self.assertEqual(self.health.summary(), {
+            'state': worker_health.CLOSED,
+            'consecutive_failures': 0,
+            'latency_ewma': self.health.latency_ewma,
+        })
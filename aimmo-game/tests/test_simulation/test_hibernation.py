@@ -0,0 +1,258 @@
+from __future__ import absolute_import
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from simulation.avatar.avatar_manager import AvatarManager
+from simulation.geography.location import Location
+from simulation.hibernation import Hibernator, checkpoint_game, restore_game
+from simulation.pickups import DeliveryPickup
+from simulation.state.game_state import GameState
+from simulation.turn_manager import state_provider
+from simulation.world_map import WorldMap
+
+
+def new_game_state():
+    return GameState(WorldMap.generate_empty_map(5, 5, {}), AvatarManager())
+
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.game_state = new_game_state()
+        world_map = self.game_state.world_map
+        world_map.get_cell(Location(1, 1)).habitable = False
+        pickup_cell = world_map.get_cell(Location(-1, 0))
+        pickup_cell.pickup = DeliveryPickup(pickup_cell)
+        self.game_state.add_avatar(1, 'http://worker', Location(2, 2))
+        self.game_state.main_avatar_id = 1
+        avatar = self.game_state.avatar_manager.get_avatar(1)
+        avatar.score = 7
+        avatar.health = 3
+        avatar.pickups[DeliveryPickup] += 2
+
+    def restored(self):
+        # Through JSON, as it would be on disk
+        checkpoint = json.loads(json.dumps(checkpoint_game(self.game_state)))
+        game_state = new_game_state()
+        restore_game(game_state, checkpoint)
+        return game_state
+
+    def test_world_restored(self):
+        game_state = self.restored()
+        self.assertEqual(game_state.world_map.num_cells, 25)
+        self.assertFalse(game_state.world_map.get_cell(Location(1, 1)).habitable)
+        self.assertIsInstance(game_state.world_map.get_cell(Location(-1, 0)).pickup, DeliveryPickup)
+        self.assertEqual(game_state.main_avatar_id, 1)
+        # Avatars are only restored once they rejoin
+        self.assertEqual(len(game_state.avatar_manager.avatars), 0)
+
+    def test_avatar_restored_when_added(self):
+        game_state = self.restored()
+        game_state.add_avatar(1, 'http://new-worker')
+        avatar = game_state.avatar_manager.get_avatar(1)
+        self.assertEqual(avatar.location, Location(2, 2))
+        self.assertEqual(game_state.world_map.get_cell(Location(2, 2)).avatar, avatar)
+        self.assertEqual((avatar.score, avatar.health), (7, 3))
+        self.assertEqual(avatar.pickups[DeliveryPickup], 2)
+        self.assertEqual(game_state.restored_avatars, {})
+
+    def test_avatar_moved_if_location_taken(self):
+        game_state = self.restored()
+        game_state.add_avatar(2, 'http://other-worker', Location(2, 2))
+        game_state.add_avatar(1, 'http://new-worker')
+        self.assertNotEqual(game_state.avatar_manager.get_avatar(1).location, Location(2, 2))
+        self.assertEqual(game_state.avatar_manager.get_avatar(1).score, 7)
+
+    def test_random_state_restored(self):
+        checkpoint = json.loads(json.dumps(checkpoint_game(self.game_state)))
+        expected = [random.random() for _ in range(3)]
+        restore_game(new_game_state(), checkpoint)
+        self.assertEqual([random.random() for _ in range(3)], expected)
+
+
+class FakeTurnManager(object):
+    def __init__(self):
+        self.running = True
+
+    def pause(self):
+        self.running = False
+
+    def resume(self):
+        self.running = True
+
+
+class FakeWorkerManager(object):
+    def __init__(self):
+        self.suspended = False
+
+    def suspend(self):
+        self.suspended = True
+        with state_provider as game_state:
+            game_state.remove_avatar(1)
+
+    def resume(self):
+        self.suspended = False
+
+
+class TestHibernator(unittest.TestCase):
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.game_state = new_game_state()
+        self.game_state.add_avatar(1, 'http://worker', Location(0, 1))
+        state_provider.set_world(self.game_state)
+        self.now = 0
+        self.viewers = False
+        self.turn_manager = FakeTurnManager()
+        self.worker_manager = FakeWorkerManager()
+        self.hibernator = self.construct_hibernator({'IDLE_TIMEOUT': 60})
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def construct_hibernator(self, settings, game_settings='{"GENERATOR": "Main"}',
+                             generate_map=lambda: WorldMap.generate_empty_map(3, 3, {})):
+        settings['CHECKPOINT_DIR'] = self.checkpoint_dir
+        return Hibernator(1, self.turn_manager, self.worker_manager, lambda: self.viewers,
+                          settings, clock=lambda: self.now, game_settings=game_settings,
+                          generate_map=generate_map)
+
+    def test_stays_awake_until_idle(self):
+        self.now = 59
+        self.hibernator.check()
+        self.assertFalse(self.hibernator.hibernating)
+        self.now = 60
+        self.hibernator.check()
+        self.assertTrue(self.hibernator.hibernating)
+
+    def test_viewers_keep_game_awake(self):
+        self.viewers = True
+        self.now = 100
+        self.hibernator.check()
+        self.viewers = False
+        self.now = 150
+        self.hibernator.check()
+        self.assertFalse(self.hibernator.hibernating)
+
+    def test_activity_keeps_game_awake(self):
+        self.now = 50
+        self.hibernator.touch()
+        self.now = 100
+        self.hibernator.check()
+        self.assertFalse(self.hibernator.hibernating)
+
+    def test_never_hibernates_without_timeout(self):
+        hibernator = self.construct_hibernator({'IDLE_TIMEOUT': 0})
+        self.now = 10 ** 6
+        hibernator.check()
+        self.assertFalse(hibernator.hibernating)
+
+    def test_hibernate(self):
+        self.now = 60
+        self.hibernator.check()
+        self.assertFalse(self.turn_manager.running)
+        self.assertTrue(self.worker_manager.suspended)
+        self.assertTrue(os.path.exists(self.hibernator.checkpoint_path))
+        self.assertEqual(self.game_state.world_map.grid, {})
+
+    def test_wake(self):
+        self.now = 60
+        self.hibernator.check()
+        self.hibernator.touch()
+        self.assertFalse(self.hibernator.hibernating)
+        self.assertTrue(self.turn_manager.running)
+        self.assertFalse(self.worker_manager.suspended)
+        self.assertEqual(self.game_state.world_map.num_cells, 25)
+        self.assertFalse(os.path.exists(self.hibernator.checkpoint_path))
+        self.game_state.add_avatar(1, 'http://new-worker')
+        self.assertEqual(self.game_state.avatar_manager.get_avatar(1).location, Location(0, 1))
+
+    def test_wake_with_corrupt_checkpoint(self):
+        self.now = 60
+        self.hibernator.check()
+        with open(self.hibernator.checkpoint_path, 'w') as checkpoint_file:
+            checkpoint_file.write('{"cells": [')
+        self.hibernator.touch()
+        self.assertFalse(self.hibernator.hibernating)
+        self.assertEqual(self.game_state.world_map.num_cells, 9)
+        self.game_state.add_avatar(1, 'http://new-worker')
+
+    def test_wake_with_missing_checkpoint(self):
+        self.now = 60
+        self.hibernator.check()
+        os.remove(self.hibernator.checkpoint_path)
+        self.hibernator.touch()
+        self.assertEqual(self.game_state.world_map.num_cells, 9)
+
+    def test_world_kept_without_map_generator(self):
+        hibernator = self.construct_hibernator({'IDLE_TIMEOUT': 60}, generate_map=None)
+        self.now = 60
+        hibernator.check()
+        self.assertTrue(hibernator.hibernating)
+        os.remove(hibernator.checkpoint_path)
+        hibernator.touch()
+        self.assertEqual(self.game_state.world_map.num_cells, 25)
+        self.game_state.add_avatar(1, 'http://new-worker')
+
+    def test_restore_checkpoint_from_earlier_run(self):
+        self.now = 60
+        self.hibernator.check()
+        self.game_state.world_map.grid = {}
+        hibernator = self.construct_hibernator({'IDLE_TIMEOUT': 60})
+        hibernator.restore_saved_checkpoint()
+        self.assertEqual(self.game_state.world_map.num_cells, 25)
+        self.assertFalse(os.path.exists(hibernator.checkpoint_path))
+
+    def test_checkpoint_with_other_settings_discarded(self):
+        self.now = 60
+        self.hibernator.check()
+        self.game_state.world_map.grid = {}
+        hibernator = self.construct_hibernator({'IDLE_TIMEOUT': 60}, game_settings='{"GENERATOR": "Level1"}')
+        hibernator.restore_saved_checkpoint()
+        self.assertEqual(self.game_state.world_map.grid, {})
+        self.assertFalse(os.path.exists(hibernator.checkpoint_path))
+
+    def test_checkpoint_handed_over(self):
+        self.game_state.avatar_manager.get_avatar(1).score = 3
+        checkpoint = json.loads(json.dumps(self.hibernator.take_checkpoint()))
+        self.game_state.avatar_manager.get_avatar(1).score = 9
+        self.assertTrue(self.hibernator.restore_checkpoint(checkpoint))
+        self.assertFalse(self.worker_manager.suspended)
+        self.assertTrue(self.turn_manager.running)
+        self.assertEqual(self.game_state.world_map.num_cells, 25)
+        self.game_state.add_avatar(1, 'http://new-worker')
+        self.assertEqual(self.game_state.avatar_manager.get_avatar(1).score, 3)
+
+    def test_checkpoint_taken_while_hibernating(self):
+        self.now = 60
+        self.hibernator.check()
+        checkpoint = self.hibernator.take_checkpoint()
+        self.assertEqual(len(checkpoint['cells']), 25)
+        self.assertTrue(self.hibernator.restore_checkpoint(checkpoint))
+        self.assertFalse(self.hibernator.hibernating)
+        self.assertFalse(os.path.exists(self.hibernator.checkpoint_path))
+
+    def test_checkpoint_from_other_settings_not_handed_over(self):
+        checkpoint = self.hibernator.take_checkpoint()
+        hibernator = self.construct_hibernator({'IDLE_TIMEOUT': 60}, game_settings='{"GENERATOR": "Level1"}')
+        self.assertFalse(hibernator.restore_checkpoint(checkpoint))
+
+    def test_discard_checkpoint(self):
+        self.now = 60
+        self.hibernator.check()
+        self.hibernator.discard_checkpoint()
+        self.assertFalse(os.path.exists(self.hibernator.checkpoint_path))
+        self.hibernator.discard_checkpoint()
+
+    def test_stays_awake_if_checkpoint_fails(self):
+        shutil.rmtree(self.checkpoint_dir)
+        self.now = 60
+        self.hibernator.check()
+        os.mkdir(self.checkpoint_dir)
+        self.assertFalse(self.hibernator.hibernating)
+        self.assertTrue(self.turn_manager.running)
+        self.assertFalse(self.worker_manager.suspended)
+        self.assertEqual(self.game_state.world_map.num_cells, 25)
@@ -0,0 +1,331 @@
+from __future__ import absolute_import
+
+import json
+import unittest
+
+from simulation.geography.location import Location
+from simulation.state.game_state import GameState
+from simulation.state.spectators import Outbox
+from simulation.state.spectators import PolledSpectator
+from simulation.state.spectators import Spectators
+from simulation.state.spectators import encode
+from simulation.state.viewports import FixedView
+from simulation.state.viewports import FollowAvatar
+from simulation.state.world_state import PlayerRecords
+from simulation.state.world_state import WorldRecorder
+from simulation.turn_manager import GameStateProvider
+from simulation.world_map import WorldMap
+from .dummy_avatar import DummyAvatarManager
+from .dummy_avatar import WaitDummy
+from .maps import MockPickup
+
+LEFT = FixedView(-5, -5, 5, 11)
+RIGHT = FixedView(1, -5, 5, 11)
+
+
+def ids(updates, kind='players', change='create'):
+    if kind == 'players':
+        changes = updates['players'][change]
+    else:
+        changes = updates['map_features'][kind][change]
+    return sorted((item['x'], item['y']) if kind != 'players' else item['id'] for item in changes)
+
+
+class TestOutbox(unittest.TestCase):
+    def test_frames_dropped_when_behind(self):
+        outbox = Outbox(max_unacknowledged=2)
+        self.assertEqual([outbox.offer() for _ in range(4)], [True, True, False, False])
+        self.assertEqual(outbox.metrics(),
+                         {'unacknowledged': 2, 'lag': 2, 'dropped': 2, 'keyframes': 0, 'resyncs': 0})
+
+    def test_keyframe_due_once_caught_up(self):
+        outbox = Outbox(max_unacknowledged=1)
+        outbox.offer()
+        # The client acknowledged in time
+        self.assertFalse(outbox.acknowledge())
+        outbox.offer()
+        self.assertFalse(outbox.offer())
+        self.assertTrue(outbox.acknowledge())
+        # Deltas wait for the keyframe
+        self.assertFalse(outbox.offer())
+        self.assertTrue(outbox.offer(keyframe=True))
+        self.assertEqual(outbox.metrics(),
+                         {'unacknowledged': 1, 'lag': 0, 'dropped': 2, 'keyframes': 1, 'resyncs': 0})
+        self.assertFalse(outbox.acknowledge())
+        self.assertTrue(outbox.offer())
+
+    def test_resync(self):
+        outbox = Outbox(max_unacknowledged=1)
+        self.assertTrue(outbox.resync())
+        self.assertTrue(outbox.needs_keyframe)
+        outbox.offer(keyframe=True)
+        # Full, so the keyframe waits for the client to catch up
+        self.assertFalse(outbox.resync())
+        self.assertTrue(outbox.acknowledge())
+
+
+class TestEncode(unittest.TestCase):
+    def test_cached_players_spliced_in(self):
+        players = PlayerRecords()
+        player = players.get(WaitDummy(1, Location(2, 3)))
+        update = {
+            'players': {'create': [player], 'update': [], 'delete': [{'id': 2}]},
+            'map_features': {'obstacle': {'create': [{'x': 1}], 'delete': []}},
+            'turn': 4,
+        }
+        self.assertEqual(json.loads(encode(update, players)), json.loads(encode(update)))
+
+
+class TestSpectators(unittest.TestCase):
+    def setUp(self):
+        self.world_map = WorldMap.generate_empty_map(11, 11, {})
+        self.avatar_manager = DummyAvatarManager()
+        self.state_provider = GameStateProvider()
+        self.state_provider.set_world(GameState(self.world_map, self.avatar_manager))
+        self.frames = []
+        self.encoded_frames = []
+        self.outstanding = []
+        self.recorder = WorldRecorder()
+        self.spectators = Spectators(self.send, self.recorder.players,
+                                     settings={'MAX_UNACKNOWLEDGED': 2, 'KEYFRAME_INTERVAL': 0})
+        self.add_obstacle(-3, 0)
+        self.add_obstacle(3, 0)
+
+    def send(self, sid, frame, on_delivered):
+        self.encoded_frames.append(frame)
+        self.frames.append((sid, json.loads(frame)))
+        self.outstanding.append((sid, on_delivered))
+
+    def acknowledge(self, sid=None):
+        """Have the client (or every client) acknowledge its frames."""
+        callbacks = [callback for frame_sid, callback in self.outstanding if sid in (None, frame_sid)]
+        self.outstanding = [(frame_sid, callback) for frame_sid, callback in self.outstanding
+                            if sid not in (None, frame_sid)]
+        for callback in callbacks:
+            callback()
+
+    def frames_for(self, sid):
+        return [frame for frame_sid, frame in self.frames if frame_sid == sid]
+
+    def sent(self):
+        """The frames sent since last asked, by client, acknowledging them."""
+        frames, self.frames = dict(self.frames), []
+        self.acknowledge()
+        return frames
+
+    def add(self, sid, view):
+        self.spectators.add(sid, view)
+        return self.sent().get(sid)
+
+    def apply_turn(self):
+        with self.state_provider as game_state:
+            self.spectators.apply(self.recorder.record(game_state))
+
+    def turn(self):
+        self.apply_turn()
+        return self.sent()
+
+    def add_obstacle(self, x, y):
+        self.world_map.get_cell_by_coords(x, y).habitable = False
+
+    def add_avatar(self, player_id, x, y):
+        avatar = WaitDummy(player_id, Location(x, y))
+        self.avatar_manager.add_avatar_directly(avatar)
+        self.world_map.get_cell(avatar.location).avatar = avatar
+        return avatar
+
+    def move_avatar(self, avatar, x, y):
+        self.world_map.get_cell(avatar.location).avatar = None
+        avatar.location = Location(x, y)
+        self.world_map.get_cell(avatar.location).avatar = avatar
+
+    def test_first_client_of_view_sent_it_on_next_turn(self):
+        self.add_avatar(1, -2, 2)
+        self.add_avatar(2, 2, 2)
+        self.assertEqual(ids(self.add('a', LEFT)), [])
+
+        frames = self.turn()
+        self.assertEqual(frames.keys(), ['a'])
+        self.assertEqual(ids(frames['a']), [1])
+        self.assertEqual(ids(frames['a'], 'obstacle'), [(-3, 0)])
+
+    def test_group_shares_frame(self):
+        self.spectators.add('a', LEFT)
+        self.spectators.add('b', LEFT)
+        self.sent()
+        frames = self.turn()
+        self.assertEqual(sorted(frames.keys()), ['a', 'b'])
+        self.assertEqual(frames['a'], frames['b'])
+
+    def test_late_client_sent_keyframe(self):
+        self.add_avatar(1, -2, 2)
+        self.add('a', LEFT)
+        self.turn()
+        keyframe = self.add('b', LEFT)
+        self.assertTrue(keyframe['reset'])
+        self.assertEqual(keyframe['turn'], 1)
+        self.assertEqual(ids(keyframe), [1])
+        self.assertEqual(ids(keyframe, 'obstacle'), [(-3, 0)])
+
+    def test_deltas_follow_on(self):
+        avatar = self.add_avatar(1, -2, 2)
+        self.assertEqual(self.add('a', LEFT)['turn'], 0)
+        self.assertEqual((self.turn()['a']['since'], self.spectators.turn), (0, 1))
+        self.turn()
+        self.move_avatar(avatar, -2, 1)
+        delta = self.turn()['a']
+        # Nothing was sent on turn 2
+        self.assertEqual((delta['since'], delta['turn']), (1, 3))
+
+    def test_keyframe_cached_until_next_delta(self):
+        avatar = self.add_avatar(1, -2, 2)
+        self.add('a', LEFT)
+        self.turn()
+        self.encoded_frames = []
+        self.spectators.add('b', LEFT)
+        self.spectators.resync('a')
+        first, second = self.encoded_frames
+        self.assertIs(first, second)
+
+        self.sent()
+        self.move_avatar(avatar, -2, 1)
+        self.turn()
+        self.spectators.resync('a')
+        keyframe = self.sent()['a']
+        self.assertEqual((keyframe['turn'], keyframe['players']['create'][0]['y']), (2, 1))
+
+    def test_periodic_keyframes(self):
+        self.spectators.keyframe_interval = 2
+        self.add('a', LEFT)
+        self.assertNotIn('reset', self.turn()['a'])
+        self.assertTrue(self.turn()['a']['reset'])
+        self.assertEqual(self.turn(), {})
+
+    def test_nothing_sent_without_changes(self):
+        self.add('a', LEFT)
+        self.turn()
+        self.assertEqual(self.turn(), {})
+
+    def test_changes_only_sent_to_views_containing_them(self):
+        self.add('a', LEFT)
+        self.add('b', RIGHT)
+        self.turn()
+
+        self.world_map.get_cell_by_coords(-2, -2).pickup = MockPickup()
+        frames = self.turn()
+        self.assertEqual(frames.keys(), ['a'])
+        self.assertEqual(ids(frames['a'], 'pickup'), [(-2, -2)])
+
+    def test_avatar_moving_between_views(self):
+        avatar = self.add_avatar(1, -1, 0)
+        self.add('a', LEFT)
+        self.add('b', RIGHT)
+        self.turn()
+
+        self.move_avatar(avatar, 1, 0)
+        frames = self.turn()
+        self.assertEqual(ids(frames['a'], change='delete'), [1])
+        self.assertEqual(ids(frames['b'], change='create'), [1])
+
+        avatar.health = 2
+        frames = self.turn()
+        self.assertEqual(frames.keys(), ['b'])
+        self.assertEqual(frames['b']['players']['update'][0]['health'], 2)
+
+    def test_only_changed_players_sent(self):
+        moving = self.add_avatar(1, -2, 2)
+        self.add_avatar(2, -4, 2)
+        self.add('a', LEFT)
+        self.turn()
+        moving.score = 1
+        delta = self.turn()['a']
+        self.assertEqual(ids(delta, change='update'), [1])
+        self.assertEqual(ids(delta, change='create'), [])
+
+    def test_followed_avatar_moves_view(self):
+        avatar = self.add_avatar(1, 1, 0)
+        self.add('a', FollowAvatar(1, 1))
+        self.assertEqual(ids(self.turn()['a'], 'obstacle'), [])
+
+        self.move_avatar(avatar, 2, 0)
+        update = self.turn()['a']
+        self.assertEqual(ids(update, 'obstacle'), [(3, 0)])
+        self.assertEqual(ids(update, change='update'), [1])
+
+        self.move_avatar(avatar, 0, 0)
+        update = self.turn()['a']
+        self.assertEqual(ids(update, 'obstacle', 'delete'), [(3, 0)])
+
+    def test_panning_sends_difference(self):
+        self.add('a', FixedView(-3, -1, 3, 3))
+        self.turn()
+        update = self.add('a', FixedView(1, -1, 3, 3))
+        self.assertEqual((update['since'], update['turn']), (1, 1))
+        self.assertEqual(ids(update, 'obstacle', 'delete'), [(-3, 0)])
+        self.assertEqual(ids(update, 'obstacle', 'create'), [(3, 0)])
+
+    def test_slow_client_sent_keyframe_once_caught_up(self):
+        avatar = self.add_avatar(1, -2, 2)
+        self.spectators.add('slow', LEFT)
+        self.spectators.add('fast', LEFT)
+        for y in (1, 0, -1):
+            self.move_avatar(avatar, -2, y)
+            self.apply_turn()
+            # Only the fast client acknowledges
+            self.acknowledge('fast')
+        # The catch-up and the first turn, then nothing
+        self.assertEqual(len(self.frames_for('slow')), 2)
+        self.assertEqual(len(self.frames_for('fast')), 4)
+        self.assertEqual(self.spectators.metrics()['slow'],
+                         {'unacknowledged': 2, 'lag': 2, 'dropped': 2, 'keyframes': 1, 'resyncs': 0})
+
+        self.frames = []
+        self.acknowledge()
+        keyframe, = self.frames_for('slow')
+        self.assertTrue(keyframe['reset'])
+        self.assertEqual(ids(keyframe), [1])
+        self.assertEqual(keyframe['players']['create'][0]['y'], -1)
+        self.assertEqual(ids(keyframe, 'obstacle'), [(-3, 0)])
+        self.assertEqual(self.spectators.metrics()['slow']['lag'], 0)
+
+    def test_full_changes_replace_world(self):
+        avatar = self.add_avatar(1, -2, 2)
+        self.add('a', LEFT)
+        self.turn()
+        # As for a gateway following the game again after losing it
+        self.move_avatar(avatar, -2, 1)
+        with self.state_provider as game_state:
+            self.recorder.record(game_state)
+        del self.world_map.grid[Location(-3, 0)]
+        with self.state_provider as game_state:
+            self.recorder.record(game_state)
+        self.spectators.apply(self.recorder.snapshot())
+        delta = self.sent()['a']
+        self.assertEqual((delta['since'], delta['turn']), (1, 3))
+        self.assertEqual(ids(delta, change='update'), [1])
+        self.assertEqual(ids(delta, 'obstacle', 'delete'), [(-3, 0)])
+
+    def test_empty_group_dropped(self):
+        self.spectators.add('a', LEFT)
+        self.spectators.add('b', LEFT)
+        self.spectators.remove('a')
+        self.spectators.remove('b')
+        self.assertEqual(len(self.spectators), 0)
+        self.assertEqual(self.spectators.metrics(), {})
+        self.sent()
+        self.assertEqual(self.turn(), {})
+
+    def test_remove_unknown_client(self):
+        self.spectators.remove('a')
+
+    def test_polled_spectator(self):
+        avatar = self.add_avatar(1, 0, 0)
+        spectator = PolledSpectator(self.state_provider, FollowAvatar(1, 3))
+        update = spectator.get_updates()
+        self.assertEqual(ids(update), [1])
+        self.assertEqual(ids(update, 'obstacle'), [(-3, 0), (3, 0)])
+
+        self.move_avatar(avatar, 1, 0)
+        update = spectator.get_updates()
+        self.assertEqual(ids(update, change='update'), [1])
+        self.assertEqual(ids(update, 'obstacle', 'delete'), [(-3, 0)])
@@ -242,6 +242,35 @@ class TestTurnManager(unittest.TestCase):
         self.sequential_move_chain_consecutive_avatars_fails()
         self.sequential_move_chain_fails_collision()
 
+    def broken_worker_skipped(self, construct_manager):
+        construct_manager([MoveEastDummy, MoveEastDummy], [ORIGIN, ABOVE_ORIGIN])
+        broken, healthy = self.get_avatar(0), self.get_avatar(1)
+        for _ in range(broken.worker_health.failure_threshold):
+            broken.worker_health.record_failure()
+        asked = []
+        for avatar in (broken, healthy):
+            def decide_action(state_view, avatar=avatar, decide_action=avatar.decide_action):
+                asked.append(avatar)
+                return decide_action(state_view)
+            avatar.decide_action = decide_action
+        self.run_turn()
+        self.assertEqual(asked, [healthy])
+        self.assert_at(broken, ORIGIN)
+        self.assert_at(healthy, Location(1, 1))
+
+    def test_broken_worker_skipped(self):
+        self.broken_worker_skipped(self.construct_concurrent_turn_manager)
+        self.broken_worker_skipped(self.construct_sequential_turn_manager)
+
+    def test_load_metrics(self):
+        turn_manager = self.construct_concurrent_turn_manager([WaitDummy, WaitDummy], [ORIGIN, ABOVE_ORIGIN])
+        turn_manager.turn_times.add(0.1)
+        turn_manager.turn_times.add(0.3)
+        load = turn_manager.load_metrics()
+        self.assertEqual(load['avatars'], 2)
+        self.assertEqual(load['turn_time']['p95'], 0.3)
+        self.assertGreater(load['memory'], 0)
+
 
 if __name__ == '__main__':
     unittest.main()
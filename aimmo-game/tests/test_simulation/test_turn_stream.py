@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import eventlet
+
+from simulation.geography.location import Location
+from simulation.state.game_state import GameState
+from simulation.state.spectators import Spectators
+from simulation.state.turn_stream import TurnPublisher
+from simulation.state.turn_stream import TurnSubscriber
+from simulation.state.turn_stream import _Gateway
+from simulation.state.turn_stream import decode_changes
+from simulation.state.turn_stream import encode_changes
+from simulation.state.viewports import FixedView
+from simulation.state.world_state import PlayerRecords
+from simulation.state.world_state import WorldRecorder
+from simulation.world_map import WorldMap
+from .dummy_avatar import DummyAvatarManager
+from .dummy_avatar import WaitDummy
+
+
+def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        eventlet.sleep(0.01)
+    raise AssertionError('Timed out')
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.shut_down = False
+
+    def shutdown(self, how):
+        self.shut_down = True
+
+
+class TestTurnStream(unittest.TestCase):
+    def setUp(self):
+        self.world_map = WorldMap.generate_empty_map(5, 5, {})
+        self.world_map.get_cell_by_coords(1, 1).habitable = False
+        self.avatar_manager = DummyAvatarManager()
+        self.game_state = GameState(self.world_map, self.avatar_manager)
+        self.avatar = WaitDummy(1, Location(0, 0))
+        self.avatar_manager.add_avatar_directly(self.avatar)
+        self.world_map.get_cell(self.avatar.location).avatar = self.avatar
+        self.recorder = WorldRecorder()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'game.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_encoding(self):
+        changes = self.recorder.record(self.game_state)
+        players = PlayerRecords()
+        decoded = decode_changes(encode_changes(changes), players)
+        self.assertEqual(decoded, changes)
+        # Equal records are shared, as the recorder's are
+        again = decode_changes(encode_changes(changes), players)
+        self.assertIs(again.records[Location(0, 0)].player, decoded.records[Location(0, 0)].player)
+
+    def test_gateway_follows_game(self):
+        viewers_reported = []
+        publisher = TurnPublisher(self.path, self.recorder, on_viewers=lambda: viewers_reported.append(True))
+        self.recorder.record(self.game_state)
+        publisher.start()
+
+        frames = []
+        spectators = Spectators(lambda sid, frame, on_delivered: frames.append(json.loads(frame)))
+        spectators.add('a', FixedView(-2, -2, 5, 5))
+        subscriber = TurnSubscriber(self.path, spectators, settings={'REPORT_INTERVAL': 0.01})
+        connection = eventlet.connect(self.path, family=socket.AF_UNIX)
+        follower = eventlet.spawn(subscriber.follow, connection)
+        try:
+            # Starting from a snapshot
+            wait_for(lambda: len(frames) == 2)
+            self.assertEqual(frames[1]['players']['create'][0]['id'], 1)
+            wait_for(lambda: publisher.viewers() == 1)
+            self.assertTrue(viewers_reported)
+
+            self.avatar.score = 2
+            publisher.publish(self.recorder.record(self.game_state))
+            wait_for(lambda: len(frames) == 3)
+            self.assertEqual(frames[2]['players']['update'][0]['score'], 2)
+        finally:
+            follower.kill()
+            connection.close()
+
+    def test_slow_gateway_disconnected(self):
+        publisher = TurnPublisher(self.path, self.recorder, settings={'MAX_QUEUED_TURNS': 1})
+        gateway = _Gateway(FakeConnection(), publisher.max_queued_turns)
+        publisher._gateways.add(gateway)
+        publisher.publish(self.recorder.record(self.game_state))
+        self.assertFalse(gateway.connection.shut_down)
+        publisher.publish(self.recorder.record(self.game_state))
+        self.assertTrue(gateway.connection.shut_down)
+        self.assertEqual(publisher.viewers(), 0)
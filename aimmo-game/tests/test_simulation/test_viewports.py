@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+
+import unittest
+
+from simulation.geography.location import Location
+from simulation.state.viewports import DEFAULT_VIEW_RADIUS
+from simulation.state.viewports import FixedView
+from simulation.state.viewports import FollowAvatar
+from simulation.state.viewports import MAX_VIEW_SIZE
+from simulation.state.viewports import Region
+from simulation.state.viewports import SpatialIndex
+from simulation.state.viewports import changed_locations
+from simulation.state.viewports import parse_view
+
+
+class TestRegion(unittest.TestCase):
+    def test_contains(self):
+        region = Region(-1, -1, 1, 2)
+        self.assertTrue(region.contains(Location(-1, 2)))
+        self.assertFalse(region.contains(Location(2, 0)))
+        self.assertEqual(len(list(region.locations())), 12)
+
+    def test_minus(self):
+        region = Region(0, 0, 3, 3)
+        self.assertEqual(region.minus(Region(10, 10, 11, 11)), [region])
+        self.assertEqual(region.minus(Region(-1, -1, 4, 4)), [])
+        remaining = set()
+        for part in region.minus(Region(1, 1, 2, 2)):
+            remaining.update(part.locations())
+        self.assertEqual(len(remaining), 12)
+        self.assertNotIn(Location(1, 1), remaining)
+
+    def test_changed_locations(self):
+        changed = set(changed_locations(Region(0, 0, 2, 2), Region(1, 0, 3, 2)))
+        self.assertEqual(changed, {Location(x, y) for x in (0, 3) for y in range(3)})
+        self.assertEqual(len(set(changed_locations(None, Region(0, 0, 1, 1)))), 4)
+
+
+class TestParseView(unittest.TestCase):
+    def test_avatar_id(self):
+        self.assertEqual(parse_view(3), FollowAvatar(3, DEFAULT_VIEW_RADIUS))
+
+    def test_follow_avatar(self):
+        self.assertEqual(parse_view({'avatar': 3, 'radius': 2}), FollowAvatar(3, 2))
+
+    def test_fixed_view(self):
+        view = parse_view({'x': -2, 'y': 1, 'width': 5, 'height': 3})
+        self.assertEqual(view, FixedView(-2, 1, 5, 3))
+        self.assertEqual(view.region({}), Region(-2, 1, 2, 3))
+
+    def test_bad_views(self):
+        for data in ('1', None, True, {'avatar': 'a'}, {'avatar': 1, 'radius': MAX_VIEW_SIZE},
+                     {'x': 0, 'y': 0, 'width': 0, 'height': 1}, {'x': 0, 'y': 0, 'width': 1}):
+            with self.assertRaises(ValueError):
+                parse_view(data)
+
+    def test_followed_avatar_missing(self):
+        self.assertIsNone(FollowAvatar(3, 1).region({}))
+        self.assertEqual(FollowAvatar(3, 1).region({3: Location(1, 1)}), Region(0, 0, 2, 2))
+
+
+class TestSpatialIndex(unittest.TestCase):
+    def test_candidates(self):
+        index = SpatialIndex(bucket_size=4)
+        index.add('a', Region(0, 0, 3, 3))
+        index.add('b', Region(-6, -6, 1, 1))
+        self.assertEqual(set(index.candidates(Location(1, 1))), {'a', 'b'})
+        self.assertEqual(set(index.candidates(Location(-5, -5))), {'b'})
+        self.assertEqual(set(index.candidates(Location(20, 20))), set())
+
+    def test_moving_and_removing(self):
+        index = SpatialIndex(bucket_size=4)
+        index.add('a', Region(0, 0, 3, 3))
+        index.add('a', Region(8, 8, 9, 9))
+        self.assertEqual(set(index.candidates(Location(1, 1))), set())
+        self.assertEqual(set(index.candidates(Location(9, 9))), {'a'})
+        index.remove('a')
+        self.assertEqual(set(index.candidates(Location(9, 9))), set())
@@ -1,13 +1,23 @@
 from __future__ import absolute_import
 
+import json
+import threading
+import time
 import unittest
 from json import dumps
 
+import eventlet
 from httmock import HTTMock
+from six.moves.urllib.parse import parse_qs
 
+from simulation import worker_manager
 from simulation.avatar.avatar_manager import AvatarManager
 from simulation.state.game_state import GameState
+from simulation.worker_manager import IdleWorker
+from simulation.worker_manager import LocalHostWorkerManager
+from simulation.worker_manager import PodCache
 from simulation.worker_manager import WorkerManager
+from simulation.worker_manager import WorkerPool
 from .maps import InfiniteMap
 
 
@@ -110,3 +120,528 @@ class TestWorkerManager(unittest.TestCase):
             self.worker_manager.update()
         self.assertNotIn(1, self.worker_manager.final_workers)
         self.assertNotIn(1, self.game_state.avatar_manager.avatars_by_id)
+
+
+class ConditionalRequestMock(RequestMock):
+    """Answers like the players app: with code hashes, revisions and 304s."""
+
+    def __init__(self, num_users):
+        super(ConditionalRequestMock, self).__init__(num_users)
+        self.requests = []
+
+    def revision(self):
+        return '"%s"' % hash(tuple((user['id'], user['code']) for user in self.value['main']['users']))
+
+    def __call__(self, url, request):
+        query = parse_qs(url.query)
+        self.requests.append(query)
+        if request.headers.get('If-None-Match') == self.revision():
+            return {'status_code': 304, 'headers': {'ETag': self.revision()}}
+        users = []
+        for user in self.value['main']['users']:
+            if 'users' in query and str(user['id']) not in query['users'][0].split(','):
+                continue
+            users.append(dict(user, code_hash=str(hash(user['code']))))
+            if query.get('code') == ['false']:
+                del users[-1]['code']
+        main = dict(self.value['main'], users=users)
+        return {'status_code': 200, 'content': dumps({'main': main}), 'headers': {'ETag': self.revision()}}
+
+
+class TestConditionalFetching(unittest.TestCase):
+    def setUp(self):
+        self.game_state = GameState(InfiniteMap(), AvatarManager())
+        self.worker_manager = ConcreteWorkerManager(self.game_state, 'http://test')
+
+    def test_unchanged_game_not_fetched_again(self):
+        mocker = ConditionalRequestMock(3)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            del mocker.requests[:]
+            self.worker_manager.update()
+        self.assertEqual(mocker.requests, [{'code': ['false']}])
+        self.assertEqual(self.worker_manager.added_workers, [])
+
+    def test_only_changed_code_fetched(self):
+        mocker = ConditionalRequestMock(3)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            del mocker.requests[:]
+            mocker.change_code(1, 'changed 1')
+            self.worker_manager.update()
+        self.assertEqual(mocker.requests, [{'code': ['false']}, {'users': ['1']}])
+        self.assertEqual(self.worker_manager.added_workers, [1])
+        self.assertEqual(self.worker_manager.get_code(1), 'changed 1')
+
+    def test_new_users_fetched(self):
+        mocker = ConditionalRequestMock(2)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+        self.assertEqual(mocker.requests, [{'code': ['false']}, {'users': ['0,1']}])
+        self.assertEqual(self.worker_manager.get_code(0), 'code for 0')
+
+
+class TestUpdateRequests(unittest.TestCase):
+    def setUp(self):
+        self.worker_manager = ConcreteWorkerManager(GameState(InfiniteMap(), AvatarManager()), 'http://test')
+
+    def test_requested_update_does_not_wait(self):
+        self.worker_manager.request_update()
+        start = time.time()
+        self.worker_manager._wait_for_next_update()
+        self.assertLess(time.time() - start, 1)
+        self.assertFalse(self.worker_manager._update_requested.is_set())
+
+    def test_polls_less_once_notified(self):
+        waits = []
+        self.worker_manager._update_requested.wait = waits.append
+        self.worker_manager._wait_for_next_update()
+        self.worker_manager.request_update()
+        self.worker_manager._wait_for_next_update()
+        self.assertEqual(waits, [worker_manager.POLL_INTERVAL, worker_manager.NOTIFIED_POLL_INTERVAL])
+
+
+class TestSuspending(unittest.TestCase):
+    def setUp(self):
+        self.game_state = GameState(InfiniteMap(), AvatarManager())
+        self.worker_manager = ConcreteWorkerManager(self.game_state, 'http://test')
+
+    def test_suspend_and_resume(self):
+        with HTTMock(ConditionalRequestMock(2)):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            self.worker_manager.suspend()
+            self.assertEqual(sorted(self.worker_manager.removed_workers), [0, 1])
+            self.assertEqual(len(self.game_state.avatar_manager.avatars), 0)
+
+            # Nothing is started again while suspended
+            self.worker_manager.update()
+            self.assertEqual(self.worker_manager.added_workers, [])
+
+            self.worker_manager.resume()
+            self.assertTrue(self.worker_manager._update_requested.is_set())
+            self.worker_manager.update()
+        self.assertEqual(sorted(self.worker_manager.added_workers), [0, 1])
+        self.assertEqual(len(self.game_state.avatar_manager.avatars), 2)
+
+
+class TestStandby(unittest.TestCase):
+    def test_attach_game_later(self):
+        worker_manager = ConcreteWorkerManager(port=5000)
+        game_state = GameState(InfiniteMap(), AvatarManager())
+        worker_manager.attach(game_state, 'http://test')
+        with HTTMock(RequestMock(2)):
+            worker_manager.update()
+        self.assertEqual(len(game_state.avatar_manager.avatars), 2)
+        self.assertEqual(game_state.avatar_manager.on_worker_broken, worker_manager.report_broken_worker)
+
+
+class TestBrokenWorkers(unittest.TestCase):
+    def setUp(self):
+        self.game_state = GameState(InfiniteMap(), AvatarManager(health_settings={'RESPAWN_THRESHOLD': 1}))
+        self.worker_manager = ConcreteWorkerManager(self.game_state, 'http://test')
+
+    def test_broken_worker_respawned_even_if_game_unchanged(self):
+        mocker = ConditionalRequestMock(2)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            old_avatar = self.game_state.avatar_manager.get_avatar(1)
+            old_avatar.worker_health.record_failure()
+            self.assertTrue(self.worker_manager._update_requested.is_set())
+            self.worker_manager.update()
+        self.assertEqual(self.worker_manager.removed_workers, [1])
+        self.assertEqual(self.worker_manager.added_workers, [1])
+        self.assertIsNot(self.game_state.avatar_manager.get_avatar(1), old_avatar)
+        self.assertEqual(self.worker_manager.get_code(1), 'code for 1')
+
+    def test_respawn_only_once(self):
+        with HTTMock(ConditionalRequestMock(1)):
+            self.worker_manager.update()
+            self.worker_manager.report_broken_worker(0)
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            self.worker_manager.update()
+        self.assertEqual(self.worker_manager.added_workers, [])
+
+
+class ReloadableWorkerManager(ConcreteWorkerManager):
+    def create_worker(self, player_id):
+        super(ReloadableWorkerManager, self).create_worker(player_id)
+        return 'http://worker-%d' % player_id
+
+
+class ReloadMock(RequestMock):
+    def __init__(self, num_users, status_code=200):
+        super(ReloadMock, self).__init__(num_users)
+        self.status_code = status_code
+        self.reloaded = {}
+
+    def __call__(self, url, request):
+        if url.path == '/reload/':
+            self.reloaded[url.netloc] = json.loads(request.body)['code']
+            return {'status_code': self.status_code, 'content': 'RELOADED'}
+        return super(ReloadMock, self).__call__(url, request)
+
+
+class TestReloadingWorkerManager(unittest.TestCase):
+    def setUp(self):
+        self.game_state = GameState(InfiniteMap(), AvatarManager())
+        self.worker_manager = ReloadableWorkerManager(self.game_state, 'http://test')
+
+    def change_code(self, mocker):
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.worker_manager.clear()
+            self.avatar = self.game_state.avatar_manager.get_avatar(0)
+            mocker.change_code(0, 'changed 0')
+            self.worker_manager.update()
+
+    def test_code_reloaded_in_place(self):
+        mocker = ReloadMock(2)
+        self.change_code(mocker)
+        self.assertEqual(mocker.reloaded, {'worker-0': 'changed 0'})
+        self.assertEqual(self.worker_manager.removed_workers, [])
+        self.assertEqual(self.worker_manager.added_workers, [])
+        self.assertEqual(self.worker_manager.get_code(0), 'changed 0')
+        self.assertIs(self.game_state.avatar_manager.get_avatar(0), self.avatar)
+
+    def test_code_that_fails_to_load_is_not_respawned(self):
+        mocker = ReloadMock(1, status_code=400)
+        self.change_code(mocker)
+        self.assertEqual(self.worker_manager.added_workers, [])
+        # What the worker still runs
+        self.assertEqual(self.worker_manager.get_code(0), 'code for 0')
+
+    def test_code_that_fails_to_load_is_not_tried_again(self):
+        mocker = ReloadMock(1, status_code=400)
+        self.change_code(mocker)
+        mocker.reloaded = {}
+        with HTTMock(mocker):
+            self.worker_manager.update()
+        self.assertEqual(mocker.reloaded, {})
+        self.assertEqual(self.worker_manager.removed_workers, [])
+        mocker.status_code = 200
+        mocker.change_code(0, 'fixed 0')
+        with HTTMock(mocker):
+            self.worker_manager.update()
+        self.assertEqual(mocker.reloaded, {'worker-0': 'fixed 0'})
+        self.assertEqual(self.worker_manager.get_code(0), 'fixed 0')
+
+    def test_respawn_after_failed_reload_keeps_old_code(self):
+        mocker = ReloadMock(1, status_code=400)
+        self.change_code(mocker)
+        with HTTMock(mocker):
+            self.worker_manager.report_broken_worker(0)
+            self.worker_manager.update()
+        self.assertEqual(self.worker_manager.added_workers, [0])
+        self.assertEqual(self.worker_manager.get_code(0), 'code for 0')
+
+    def test_unhealthy_worker_respawned(self):
+        mocker = ReloadMock(1, status_code=503)
+        self.change_code(mocker)
+        self.assertEqual(self.worker_manager.removed_workers, [0])
+        self.assertEqual(self.worker_manager.added_workers, [0])
+        self.assertEqual(self.worker_manager.get_code(0), 'changed 0')
+
+
+class SnapshotMock(ReloadMock):
+    def __init__(self, num_users, state):
+        super(SnapshotMock, self).__init__(num_users, status_code=503)
+        self.state = state
+        self.snapshotted = []
+        self.dead_workers = set()
+
+    def __call__(self, url, request):
+        if url.path == '/snapshot/':
+            if url.netloc in self.dead_workers:
+                return {'status_code': 503}
+            self.snapshotted.append(url.netloc)
+            return json.dumps({'state': self.state})
+        if url.path == '/reload/':
+            # Lost reloading, so it has to be respawned
+            self.dead_workers.add(url.netloc)
+        return super(SnapshotMock, self).__call__(url, request)
+
+
+class TestPersistentState(unittest.TestCase):
+    def setUp(self):
+        self.game_state = GameState(InfiniteMap(), AvatarManager())
+        self.worker_manager = ReloadableWorkerManager(self.game_state, 'http://test')
+
+    def respawn(self, mocker):
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            mocker.change_code(0, 'changed 0')
+            self.worker_manager.update()
+
+    def test_state_kept_when_worker_replaced(self):
+        mocker = SnapshotMock(2, {'known_walls': [[1, 2]]})
+        self.respawn(mocker)
+        # Before reloading, as the worker can't be snapshotted after
+        self.assertEqual(mocker.snapshotted, ['worker-0'])
+        self.assertEqual(self.worker_manager.get_persistent_state(0), {'known_walls': [[1, 2]]})
+        self.assertIsNone(self.worker_manager.get_persistent_state(1))
+
+    def test_workers_snapshotted_periodically(self):
+        mocker = SnapshotMock(2, {'seen': 1})
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            self.assertEqual(mocker.snapshotted, [])
+            self.worker_manager._next_snapshot = 0
+            self.worker_manager.update()
+        self.assertEqual(sorted(mocker.snapshotted), ['worker-0', 'worker-1'])
+        self.assertEqual(self.worker_manager.get_persistent_state(1), {'seen': 1})
+
+    def test_large_state_not_kept(self):
+        mocker = SnapshotMock(1, 'x' * (65 * 1024))
+        self.respawn(mocker)
+        self.assertIsNone(self.worker_manager.get_persistent_state(0))
+
+    def test_state_forgotten_with_user(self):
+        mocker = SnapshotMock(1, {'seen': 1})
+        self.respawn(mocker)
+        with HTTMock(mocker):
+            del mocker.value['main']['users'][0]
+            self.worker_manager.update()
+        self.assertIsNone(self.worker_manager.get_persistent_state(0))
+
+
+class PooledWorkerManager(ConcreteWorkerManager):
+    def __init__(self, *args, **kwargs):
+        self.assigned_workers = {}
+        self.removed_idle_workers = []
+        self.idle_counter = iter(range(1000))
+        super(PooledWorkerManager, self).__init__(*args, **kwargs)
+
+    def create_idle_worker(self):
+        return IdleWorker('http://idle-%d' % next(self.idle_counter), None)
+
+    def assign_idle_worker(self, worker, player_id):
+        self.assigned_workers[player_id] = worker.url
+
+    def remove_idle_worker(self, worker):
+        self.removed_idle_workers.append(worker.url)
+
+
+class InitialiseMock(RequestMock):
+    def __init__(self, num_users, status_code=200):
+        super(InitialiseMock, self).__init__(num_users)
+        self.status_code = status_code
+        self.initialised = {}
+
+    def __call__(self, url, request):
+        if url.path == '/initialise/':
+            self.initialised[url.netloc] = json.loads(request.body)
+            return {'status_code': self.status_code, 'content': 'INITIALISED'}
+        return super(InitialiseMock, self).__call__(url, request)
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+
+    def create_idle_worker(self):
+        worker = IdleWorker('http://%d' % len(self.created), None)
+        self.created.append(worker)
+        return worker
+
+    def fill(self, pool):
+        pool.refill()
+        while pool.stats()['starting']:
+            eventlet.sleep()
+
+    def test_empty_pool_never_gives_workers(self):
+        pool = WorkerPool(0, self.create_idle_worker)
+        self.assertIsNone(pool.claim())
+        self.assertEqual(pool.stats()['misses'], 0)
+        self.assertEqual(self.created, [])
+
+    def test_refill_starts_missing_workers(self):
+        pool = WorkerPool(3, self.create_idle_worker)
+        self.fill(pool)
+        self.assertEqual(len(self.created), 3)
+        self.assertEqual(pool.stats()['idle'], 3)
+
+    def test_claim_takes_idle_worker_and_refills(self):
+        pool = WorkerPool(2, self.create_idle_worker)
+        self.fill(pool)
+        self.assertIs(pool.claim(), self.created[0])
+        stats = pool.stats()
+        self.assertEqual((stats['idle'], stats['starting'], stats['claimed']), (1, 1, 1))
+
+    def test_claim_from_drained_pool_is_a_miss(self):
+        pool = WorkerPool(1, self.create_idle_worker)
+        self.assertIsNone(pool.claim())
+        self.assertEqual(pool.stats()['misses'], 1)
+
+    def test_failed_start_is_counted(self):
+        def fail():
+            raise EnvironmentError('no')
+        pool = WorkerPool(1, fail)
+        pool.refill()
+        eventlet.sleep()
+        stats = pool.stats()
+        self.assertEqual((stats['idle'], stats['starting'], stats['failures']), (0, 0, 1))
+
+
+class TestPooledWorkerManager(unittest.TestCase):
+    def setUp(self):
+        self.game_state = GameState(InfiniteMap(), AvatarManager())
+        self.worker_manager = PooledWorkerManager(self.game_state, 'http://test', worker_pool_size=2)
+        pool = self.worker_manager.worker_pool
+        pool.refill()
+        while pool.stats()['starting']:
+            eventlet.sleep()
+        # Keep the pool drained once used, so tests see exactly two pooled workers
+        pool.refill = lambda: None
+
+    def test_pooled_workers_used_first(self):
+        mocker = InitialiseMock(3)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+        self.assertEqual(sorted(self.worker_manager.assigned_workers.values()), ['http://idle-0', 'http://idle-1'])
+        self.assertEqual(len(self.worker_manager.added_workers), 1)
+        for player_id, url in self.worker_manager.assigned_workers.items():
+            self.assertEqual(mocker.initialised[url[len('http://'):]],
+                             {'code': 'code for %s' % player_id, 'options': {}, 'state': None})
+            self.assertEqual(self.game_state.avatar_manager.get_avatar(player_id).worker_url, url + '/turn/')
+
+    def test_kept_state_given_to_pooled_worker(self):
+        self.worker_manager._data.set_persistent_state(0, {'seen': 1})
+        mocker = InitialiseMock(1)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+        self.assertEqual(mocker.initialised['idle-0']['state'], {'seen': 1})
+
+    def test_failed_initialise_falls_back_to_new_worker(self):
+        mocker = InitialiseMock(1, status_code=500)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+        self.assertEqual(self.worker_manager.removed_idle_workers, ['http://idle-0'])
+        self.assertEqual(self.worker_manager.added_workers, [0])
+
+    def test_metrics(self):
+        self.assertEqual(self.worker_manager.get_metrics()['worker_pool']['idle'], 2)
+
+
+class StartedHostWorkerManager(LocalHostWorkerManager):
+    def _ensure_host(self):
+        self._host_process = object()
+
+
+class HostRequestMock(RequestMock):
+    def __init__(self, num_users):
+        super(HostRequestMock, self).__init__(num_users)
+        self.host_requests = []
+
+    def __call__(self, url, request):
+        if '/players/' in url.path:
+            self.host_requests.append((request.method, url.path, request.body))
+            return 'OK'
+        return super(HostRequestMock, self).__call__(url, request)
+
+
+class TestLocalHostWorkerManager(unittest.TestCase):
+    def setUp(self):
+        self.game_state = GameState(InfiniteMap(), AvatarManager())
+        self.worker_manager = StartedHostWorkerManager(self.game_state, 'http://test', port=5000)
+
+    def test_no_worker_pool(self):
+        worker_manager = StartedHostWorkerManager(self.game_state, 'http://test', port=5000, worker_pool_size=2)
+        worker_manager.worker_pool.refill()
+        self.assertEqual(worker_manager.worker_pool.stats()['starting'], 0)
+        self.assertIsNone(worker_manager.worker_pool.claim())
+
+    def test_workers_added_to_host(self):
+        mocker = HostRequestMock(2)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+        puts = sorted((path, json.loads(body)) for method, path, body in mocker.host_requests if method == 'PUT')
+        self.assertEqual(puts, [
+            ('/players/0/', {'code': 'code for 0', 'options': {}, 'state': None}),
+            ('/players/1/', {'code': 'code for 1', 'options': {}, 'state': None}),
+        ])
+        self.assertEqual(self.game_state.avatar_manager.get_avatar(1).worker_url,
+                         'http://127.0.0.1:5010/players/1/turn/')
+
+    def test_workers_removed_from_host(self):
+        mocker = HostRequestMock(2)
+        with HTTMock(mocker):
+            self.worker_manager.update()
+            del mocker.value['main']['users'][1]
+            self.worker_manager.update()
+        self.assertIn(('DELETE', '/players/1/', None), mocker.host_requests)
+
+
+class FakePod(object):
+    def __init__(self, name, phase='Pending', player='1', ready=True):
+        self.name = name
+        self.labels = {'player': player}
+        self.obj = {'status': {'phase': phase}}
+        if phase == 'Running':
+            self.obj['status']['podIP'] = '10.0.0.1'
+            self.obj['status']['conditions'] = [{'type': 'Ready', 'status': str(ready)}]
+
+
+class FakePodQuery(object):
+    def __init__(self, pods, events):
+        self.pods = pods
+        self.events = events
+        self.response = {'metadata': {'resourceVersion': '7'}}
+        self.watched_since = None
+
+    def __iter__(self):
+        return iter(self.pods)
+
+    def watch(self, since):
+        self.watched_since = since
+        return iter(self.events)
+
+
+class WatchEvent(object):
+    def __init__(self, type, object):
+        self.type = type
+        self.object = object
+
+
+class TestPodCache(unittest.TestCase):
+    def cache(self, pods, events=()):
+        self.query = FakePodQuery(pods, events)
+        cache = PodCache(lambda: self.query)
+        cache._watch()
+        return cache
+
+    def test_listed_pods_found_by_label(self):
+        cache = self.cache([FakePod('a', player='1'), FakePod('b', player='2')])
+        self.assertEqual([pod.name for pod in cache.find(player='2')], ['b'])
+        self.assertEqual(self.query.watched_since, '7')
+
+    def test_watch_events_applied(self):
+        cache = self.cache([FakePod('a')], [
+            WatchEvent('ADDED', FakePod('b')),
+            WatchEvent('MODIFIED', FakePod('a', player='3')),
+            WatchEvent('DELETED', FakePod('b')),
+        ])
+        self.assertEqual([(pod.name, pod.labels['player']) for pod in cache.find()], [('a', '3')])
+
+    def test_ready_pod_returned_straight_away(self):
+        cache = self.cache([FakePod('a', phase='Running')])
+        self.assertEqual(cache.wait_until_ready('a', timeout=1).name, 'a')
+
+    def test_waits_for_readiness_event(self):
+        cache = self.cache([FakePod('a')])
+        threading.Timer(0.05, cache._apply, ('MODIFIED', FakePod('a', phase='Running'))).start()
+        self.assertEqual(cache.wait_until_ready('a', timeout=5).obj['status']['phase'], 'Running')
+
+    def test_not_ready_times_out(self):
+        cache = self.cache([FakePod('a', phase='Running', ready=False)])
+        with self.assertRaises(EnvironmentError):
+            cache.wait_until_ready('a', timeout=0.05)
+
+    def test_failed_pod_raises(self):
+        cache = self.cache([FakePod('a', phase='Failed')])
+        with self.assertRaises(EnvironmentError):
+            cache.wait_until_ready('a', timeout=1)
@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+
+import unittest
+
+from simulation.geography.location import Location
+from simulation.state.game_state import GameState
+from simulation.state.world_state import PlayerRecords
+from simulation.state.world_state import WorldRecorder
+from simulation.world_map import WorldMap
+from .dummy_avatar import DummyAvatarManager
+from .dummy_avatar import WaitDummy
+
+
+class TestPlayerRecords(unittest.TestCase):
+    def setUp(self):
+        self.players = PlayerRecords()
+        self.avatar = WaitDummy(1, Location(0, 0))
+
+    def test_unchanged_avatar_shares_record(self):
+        player = self.players.get(self.avatar)
+        self.assertIs(self.players.get(self.avatar), player)
+        self.assertIs(self.players.encode(player), self.players.encode(player))
+
+    def test_changed_avatar_gets_new_record(self):
+        player = self.players.get(self.avatar)
+        encoded = self.players.encode(player)
+        self.avatar.location = Location(1, 0)
+        self.avatar.score = 3
+        new_player = self.players.get(self.avatar)
+        self.assertEqual((new_player['x'], new_player['score']), (1, 3))
+        self.assertEqual(new_player['colour'], player['colour'])
+        self.assertNotEqual(self.players.encode(new_player), encoded)
+        # The old record is still encoded correctly
+        self.assertIn('"x":0', self.players.encode(player))
+
+    def test_retain(self):
+        player = self.players.get(self.avatar)
+        self.players.retain([])
+        self.assertIsNot(self.players.get(self.avatar), player)
+
+
+class TestWorldRecorder(unittest.TestCase):
+    def setUp(self):
+        self.world_map = WorldMap.generate_empty_map(3, 3, {})
+        self.avatar_manager = DummyAvatarManager()
+        self.game_state = GameState(self.world_map, self.avatar_manager)
+        self.recorder = WorldRecorder()
+
+    def test_first_turn_records_everything(self):
+        changes = self.recorder.record(self.game_state)
+        self.assertEqual((changes.turn, len(changes.records), changes.full), (1, 9, False))
+
+    def test_only_changes_recorded(self):
+        self.recorder.record(self.game_state)
+        avatar = WaitDummy(1, Location(0, 0))
+        self.avatar_manager.add_avatar_directly(avatar)
+        self.world_map.get_cell(avatar.location).avatar = avatar
+        changes = self.recorder.record(self.game_state)
+        self.assertEqual(changes.records.keys(), [Location(0, 0)])
+        self.assertEqual(changes.records[Location(0, 0)].player['id'], 1)
+        self.assertEqual(changes.avatar_locations, {1: Location(0, 0)})
+        self.assertEqual(self.recorder.record(self.game_state).records, {})
+
+    def test_removed_cells(self):
+        self.recorder.record(self.game_state)
+        del self.world_map.grid[Location(1, 1)]
+        self.assertEqual(self.recorder.record(self.game_state).removed, [Location(1, 1)])
+
+    def test_snapshot(self):
+        self.recorder.record(self.game_state)
+        snapshot = self.recorder.snapshot()
+        self.assertEqual((snapshot.turn, len(snapshot.records), snapshot.full), (1, 9, True))
@@ -128,6 +128,15 @@ def get_url(game):
 
 AIMMO_GAME_SERVER_LOCATION_FUNCTION = get_url
 
+def get_notify_url(game):
+    if os.environ.get('AIMMO_MODE', '') == 'minikube':
+        # Games aren't reachable from outside the cluster; they'll poll instead
+        return None
+    else:
+        return 'http://127.0.0.1:%d/notify/' % (6001 + int(game) * 1000)
+
+AIMMO_GAME_NOTIFY_URL_FUNCTION = get_notify_url
+
 try:
     from example_project.local_settings import *  # pylint: disable=E0611
 except ImportError:
@@ -3,4 +3,8 @@ from django.conf import settings
 #: URL function for locating the game server, takes one parameter `game`
 GAME_SERVER_LOCATION_FUNCTION = getattr(settings, 'AIMMO_GAME_SERVER_LOCATION_FUNCTION', None)
 
+#: URL function for telling a running game its players or code changed, takes one parameter `game`.
+#: Returning None (or leaving this unset) leaves the game to notice by polling.
+GAME_NOTIFY_URL_FUNCTION = getattr(settings, 'AIMMO_GAME_NOTIFY_URL_FUNCTION', None)
+
 MAX_LEVEL = 1
@@ -12,16 +12,9 @@ class Avatar(object):
             return AttackAction(direction_of_other_avatar)
         import random
 
-        direction_to_other_player = self.direction_to(next(cell.location for cell in world_map.all_cells() if cell.avatar and cell.location != avatar_state.location))
-        if direction_to_other_player:
-            return MoveAction(random.choice(directions + ((direction_to_other_player,) * 10)))
+        other_avatar_cells = world_map.nearest_avatars(self.location)
+        if other_avatar_cells:
+            direction_to_other_player = world_map.direction_towards(self.location, other_avatar_cells[0].location)
+            if direction_to_other_player:
+                return MoveAction(random.choice(directions + ((direction_to_other_player,) * 10)))
         return MoveAction(random.choice(directions))
-
-    def direction_to(self, location):
-        from simulation.geography import direction
-        vector_to = location - self.location
-        if vector_to.x != 0:
-            return direction.Direction(1 if vector_to.x > 0 else -1, 0)
-        if vector_to.y != 0:
-            return direction.Direction(0, 1 if vector_to.y > 0 else -1)
-        return None
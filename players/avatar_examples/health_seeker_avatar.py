@@ -21,9 +21,9 @@ class Avatar(object):
         return abs(a.x - b.x) + abs(a.y - b.y)
 
     def get_closest_pickup_location(self):
-        pickup_cells = list(self.world_map.pickup_cells())
+        pickup_cells = self.world_map.nearest_pickups(self.avatar_state.location)
         if pickup_cells:
-            c = min(pickup_cells, key=lambda cell: self.distance_between(cell.location, self.avatar_state.location))
+            c = pickup_cells[0]
             print('targeting', c)
             return c.location
         else:
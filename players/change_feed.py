@@ -0,0 +1,115 @@
+"""
+A feed of games being added, reconfigured and removed, so the game creator
+can follow changes as they happen instead of re-reading every game.
+
+A GameChange is recorded whenever a game is saved with a different listing,
+completed or deleted, and its id is the feed's revision. Requests for changes
+since a revision may wait for some to happen: they are woken straight away by
+changes made in this process, and check for changes made by other processes
+every CHECK_INTERVAL seconds.
+
+Changes are recorded one at a time, so they are committed in the order of
+their ids. Otherwise a change could commit after one with a higher id had
+been read, and be skipped by anyone following the feed from that revision.
+"""
+import threading
+import time
+from json import dumps, loads
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from players.models import Game, GameChange
+
+#: Longest a request may wait for changes, in seconds
+MAX_WAIT = 30
+CHECK_INTERVAL = 1
+
+_changed = threading.Condition()
+
+
+def _record(game_id, listing):
+    """Record the game's new listing, or its removal if listing is None."""
+    with transaction.atomic():
+        # Every recorder locks the same row, the first change, until it commits
+        list(GameChange.objects.select_for_update().order_by('id')[:1])
+        latest = GameChange.objects.filter(game_id=game_id).order_by('-id').first()
+        if listing is None:
+            if latest is None or latest.removed:
+                return
+            change = GameChange(game_id=game_id, removed=True)
+        else:
+            encoded = dumps(listing, sort_keys=True)
+            if latest is not None and not latest.removed and latest.listing == encoded:
+                return
+            change = GameChange(game_id=game_id, listing=encoded)
+        change.save()
+    with _changed:
+        _changed.notify_all()
+
+
+def latest_revision():
+    latest = GameChange.objects.order_by('-id').first()
+    return latest.id if latest is not None else 0
+
+
+def _snapshot():
+    revision = latest_revision()
+    return {
+        'revision': revision,
+        'snapshot': True,
+        'games': {game.pk: game.listing() for game in Game.objects.exclude_inactive()},
+        'removed': [],
+    }
+
+
+def _changes(since):
+    # Only each game's latest change matters
+    latest = {}
+    for change in GameChange.objects.filter(id__gt=since).order_by('id'):
+        latest[change.game_id] = change
+    if not latest:
+        return None
+    return {
+        'revision': max(change.id for change in latest.values()),
+        'snapshot': False,
+        'games': {game_id: loads(change.listing)
+                  for game_id, change in latest.items() if not change.removed},
+        'removed': [game_id for game_id, change in latest.items() if change.removed],
+    }
+
+
+def changes_since(since, wait=0):
+    """
+    The games added or reconfigured (with their listings), and the ids of
+    those removed, after the given revision. Revision 0 (or one we don't know)
+    gets a snapshot of every active game instead.
+
+    Raises ValueError unless wait is between 0 and MAX_WAIT.
+    """
+    # Written so as to be False for NaN too
+    if not 0 <= wait <= MAX_WAIT:
+        raise ValueError('wait must be between 0 and %s seconds' % MAX_WAIT)
+    if since <= 0 or since > latest_revision():
+        return _snapshot()
+    deadline = time.time() + wait
+    while True:
+        changes = _changes(since)
+        if changes is not None:
+            return changes
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return {'revision': since, 'snapshot': False, 'games': {}, 'removed': []}
+        with _changed:
+            _changed.wait(min(CHECK_INTERVAL, remaining))
+
+
+@receiver(post_save, sender=Game)
+def game_saved(sender, instance, **kwargs):
+    _record(instance.pk, instance.listing() if instance.is_active else None)
+
+
+@receiver(post_delete, sender=Game)
+def game_deleted(sender, instance, **kwargs):
+    _record(instance.pk, None)
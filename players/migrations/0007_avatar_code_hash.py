@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_code(apps, schema_editor):
+    Avatar = apps.get_model('players', 'Avatar')
+    for avatar in Avatar.objects.all():
+        avatar.code_hash = hashlib.sha1(avatar.code.encode('utf-8')).hexdigest()
+        avatar.save(update_fields=['code_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0006_game_static_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avatar',
+            name='code_hash',
+            field=models.CharField(max_length=40, editable=False, blank=True),
+        ),
+        migrations.RunPython(hash_existing_code, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations, models
+
+
+def record_existing_games(apps, schema_editor):
+    Game = apps.get_model('players', 'Game')
+    GameChange = apps.get_model('players', 'GameChange')
+    for game in Game.objects.filter(completed=False):
+        settings = {
+            'TARGET_NUM_CELLS_PER_AVATAR': game.target_num_cells_per_avatar,
+            'TARGET_NUM_SCORE_LOCATIONS_PER_AVATAR': game.target_num_score_locations_per_avatar,
+            'SCORE_DESPAWN_CHANCE': game.score_despawn_chance,
+            'TARGET_NUM_PICKUPS_PER_AVATAR': game.target_num_pickups_per_avatar,
+            'PICKUP_SPAWN_CHANCE': game.pickup_spawn_chance,
+            'OBSTACLE_RATIO': game.obstacle_ratio,
+            'START_HEIGHT': game.start_height,
+            'START_WIDTH': game.start_width,
+            'GENERATOR': game.generator,
+        }
+        listing = {'name': game.name, 'settings': json.dumps(settings)}
+        GameChange.objects.create(game_id=game.pk, listing=json.dumps(listing, sort_keys=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('players', '0007_avatar_code_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameChange',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('game_id', models.IntegerField(db_index=True)),
+                ('removed', models.BooleanField(default=False)),
+                ('listing', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(record_existing_games, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
+import hashlib
 from base64 import urlsafe_b64encode
+from json import dumps
 from os import urandom
 
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
 
 from players import app_settings
 
@@ -15,6 +19,10 @@ def generate_auth_token():
     return urlsafe_b64encode(urandom(16))
 
 
+def hash_code(code):
+    return hashlib.sha1(code.encode('utf-8')).hexdigest()
+
+
 class GameQuerySet(models.QuerySet):
     def for_user(self, user):
         if user.is_authenticated():
@@ -68,6 +76,13 @@ class Game(models.Model):
             'GENERATOR': self.generator,
         }
 
+    def listing(self):
+        """What the game creator needs to run the game."""
+        return {
+            'name': self.name,
+            'settings': dumps(self.settings_as_dict()),
+        }
+
     def save(self, *args, **kwargs):
         super(Game, self).full_clean()
         super(Game, self).save(*args, **kwargs)
@@ -77,11 +92,26 @@ class Avatar(models.Model):
     owner = models.ForeignKey(User)
     game = models.ForeignKey(Game)
     code = models.TextField()
+    # Lets games check for new code without downloading all of it. It is
+    # set whenever an avatar is saved (fixtures included), but a queryset
+    # update() of code bypasses that and has to set code_hash too.
+    code_hash = models.CharField(max_length=40, blank=True, editable=False)
     auth_token = models.CharField(max_length=24, default=generate_auth_token)
 
     class Meta:
         unique_together = ('owner', 'game')
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'code' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'code_hash'}
+        super(Avatar, self).save(*args, **kwargs)
+
+
+@receiver(pre_save, sender=Avatar)
+def _hash_avatar_code(sender, instance, **kwargs):
+    instance.code_hash = hash_code(instance.code)
+
 
 class LevelAttempt(models.Model):
     level_number = models.IntegerField()
@@ -90,3 +120,20 @@ class LevelAttempt(models.Model):
 
     class Meta:
         unique_together = ('level_number', 'user')
+
+
+class GameChange(models.Model):
+    """
+    A game being added, reconfigured or removed (deleted or completed). The
+    ids of these make up the change feed's revisions.
+    """
+    # Not a foreign key, as the game may have been deleted
+    game_id = models.IntegerField(db_index=True)
+    removed = models.BooleanField(default=False)
+    # The game's listing (as JSON) when it was added or reconfigured
+    listing = models.TextField(blank=True)
+
+
+# Connect the receivers that notify games of changes
+from players import change_feed  # noqa: E402,F401
+from players import notifications  # noqa: E402,F401
@@ -0,0 +1,70 @@
+"""
+Tells running games straight away when their players or code change, rather
+than leaving them to notice on their next poll of the games API. Someone
+opening their code is sent too, as it wakes a hibernating game.
+
+Where to reach a game comes from AIMMO_GAME_NOTIFY_URL_FUNCTION; without one
+(or if it returns None for a game) nothing is sent and games find changes by
+polling as before. Notifications are best effort for the same reason.
+"""
+import logging
+import threading
+
+import requests
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from players import app_settings
+from players.models import Avatar, Game
+
+LOGGER = logging.getLogger(__name__)
+
+NOTIFY_TIMEOUT = 2
+
+
+def _post(url, event):
+    try:
+        requests.post(url, json=event, timeout=NOTIFY_TIMEOUT).raise_for_status()
+    except requests.RequestException as err:
+        LOGGER.info('Could not notify game at %s: %s', url, err)
+
+
+def notify_game(game_id, reason, **details):
+    """Send the game an event in the background, so saving isn't held up."""
+    url_function = app_settings.GAME_NOTIFY_URL_FUNCTION
+    url = url_function(game_id) if url_function is not None else None
+    if url is None:
+        return
+    event = dict(details, game=game_id, reason=reason)
+    thread = threading.Thread(target=_post, args=(url, event))
+    thread.daemon = True
+    thread.start()
+
+
+@receiver(post_save, sender=Avatar)
+def avatar_saved(sender, instance, **kwargs):
+    notify_game(instance.game_id, 'code_changed', user=instance.owner_id)
+
+
+@receiver(post_delete, sender=Avatar)
+def avatar_deleted(sender, instance, **kwargs):
+    notify_game(instance.game_id, 'users_changed', user=instance.owner_id)
+
+
+@receiver(post_save, sender=Game)
+def game_saved(sender, instance, created, **kwargs):
+    if not created:
+        notify_game(instance.pk, 'game_changed')
+
+
+@receiver(m2m_changed, sender=Game.can_play.through)
+def game_players_changed(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Changed from the user's side, e.g. user.playable_games.add(game)
+        game_ids = kwargs['pk_set'] or []
+    else:
+        game_ids = [instance.pk]
+    for game_id in game_ids:
+        notify_game(game_id, 'users_changed')
@@ -15,6 +15,15 @@ const CONTROLS = Object.create({
 
         this.viewer.reDrawWorldLayout();
     },
+    clearWorld: function () {
+        this.world.players.length = 0;
+        this.world.pickups.length = 0;
+        for (var x in this.world.layout) {
+            for (var y in this.world.layout[x]) {
+                this.world.layout[x][y] = 0;
+            }
+        }
+    },
     processUpdate: function (players, mapFeatures) {
         var i, j;
 
@@ -96,8 +105,21 @@ const CONTROLS = Object.create({
 });
 
 // Updates.
+// The turn the world shown is as of, or null while waiting for a keyframe.
+var lastTurn = null;
+
+// Returns false if the update can't be applied, as an earlier one is missing.
 function worldUpdate(data) {
+    if (data["reset"]) {
+        // A keyframe replaces everything shown so far.
+        CONTROLS.clearWorld();
+    } else if (lastTurn === null || data["since"] !== lastTurn) {
+        lastTurn = null;
+        return false;
+    }
+    lastTurn = data["turn"];
     CONTROLS.processUpdate(data["players"], data["map_features"]);
+    return true;
 }
 
 // Initialisation.
@@ -132,11 +154,23 @@ $(document).ready(function() {
         var socket = io.connect(GAME_URL_BASE, { path: GAME_URL_PATH });
         socket.on('world-init', function() {
             worldInit();
-            socket.emit('client-ready', 1);
+            // Watch the cells laid out by worldInit.
+            socket.emit('client-ready', {x: -7, y: -7, width: 15, height: 15});
         });
 
-        socket.on('world-update', function(msg) {
-            worldUpdate(msg);
+        var resyncing = false;
+        socket.on('world-update', function(msg, ack) {
+            var data = JSON.parse(msg);
+            if (worldUpdate(data)) {
+                resyncing = false;
+            } else if (!resyncing) {
+                resyncing = true;
+                socket.emit('resync');
+            }
+            // Let the server know we're keeping up.
+            if (ack) {
+                ack();
+            }
         });
     }
 });
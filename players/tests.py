@@ -1,10 +1,15 @@
+import json
 import logging
+import threading
+import time
 
 from django.contrib.auth.models import AnonymousUser, User
 from django.core.urlresolvers import reverse
 from django.test import Client, TestCase
 
-from players import models, views
+from httmock import HTTMock
+
+from players import change_feed, models, notifications, views
 
 views.app_settings.GAME_SERVER_LOCATION_FUNCTION = lambda num: ('base %s' % num, 'path %s' % num)
 
@@ -207,18 +212,24 @@ class TestViews(TestCase):
             'main': {
                 'parameters': [],
                 'main_avatar': 1,
+                'revision': views._game_revision(self.game, [(1, models.hash_code(self.CODE)),
+                                                             (2, models.hash_code('test2')),
+                                                             (3, models.hash_code('test3'))]),
                 'users': [
                     {
                         'id': 1,
                         'code': self.CODE,
+                        'code_hash': models.hash_code(self.CODE),
                     },
                     {
                         'id': 2,
                         'code': 'test2',
+                        'code_hash': models.hash_code('test2'),
                     },
                     {
                         'id': 3,
                         'code': 'test3',
+                        'code_hash': models.hash_code('test3'),
                     },
                 ]
             }
@@ -227,6 +238,51 @@ class TestViews(TestCase):
         response = c.get(reverse('aimmo/game_details', kwargs={'id': 1}))
         self.assertJSONEqual(response.content, expected)
 
+    def add_two_avatars(self):
+        user2 = User.objects.create_user(username='2', password='password')
+        models.Avatar(owner=self.user, code=self.CODE, game=self.game).save()
+        avatar2 = models.Avatar(owner=user2, code='test2', game=self.game)
+        avatar2.save()
+        return avatar2
+
+    def test_games_api_hashes_only(self):
+        self.add_two_avatars()
+        c = Client()
+        response = c.get(reverse('aimmo/game_details', kwargs={'id': 1}), {'code': 'false'})
+        users = json.loads(response.content)['main']['users']
+        self.assertEqual([sorted(user) for user in users], [['code_hash', 'id'], ['code_hash', 'id']])
+
+    def test_games_api_selected_users(self):
+        avatar2 = self.add_two_avatars()
+        c = Client()
+        response = c.get(reverse('aimmo/game_details', kwargs={'id': 1}), {'users': str(avatar2.owner_id)})
+        self.assertEqual(json.loads(response.content)['main']['users'],
+                         [{'id': avatar2.owner_id, 'code': 'test2', 'code_hash': models.hash_code('test2')}])
+
+    def test_games_api_bad_user_ids(self):
+        c = Client()
+        for users in ('abc', '1,'):
+            response = c.get(reverse('aimmo/game_details', kwargs={'id': 1}), {'users': users})
+            self.assertEqual(response.status_code, 400)
+
+    def test_code_hash_saved_with_code(self):
+        avatar2 = self.add_two_avatars()
+        avatar2.code = 'changed'
+        avatar2.save(update_fields=['code'])
+        self.assertEqual(models.Avatar.objects.get(pk=avatar2.pk).code_hash, models.hash_code('changed'))
+
+    def test_games_api_not_modified(self):
+        avatar2 = self.add_two_avatars()
+        c = Client()
+        url = reverse('aimmo/game_details', kwargs={'id': 1})
+        etag = c.get(url)['ETag']
+        self.assertEqual(c.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        avatar2.code = 'changed'
+        avatar2.save()
+        response = c.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_games_api_for_non_existant_game(self):
         c = Client()
         response = c.get(reverse('aimmo/game_details', kwargs={'id': 5}))
@@ -302,3 +358,141 @@ class TestModels(TestCase):
         self.game.completed = True
         self.game.save()
         self.assertFalse(self.game.is_active)
+
+
+class ImmediateThread(object):
+    def __init__(self, target, args):
+        self.target, self.args = target, args
+
+    def start(self):
+        self.target(*self.args)
+
+
+class TestNotifications(TestCase):
+    def setUp(self):
+        self.events = []
+        self.old_url_function = notifications.app_settings.GAME_NOTIFY_URL_FUNCTION
+        self.old_thread = notifications.threading.Thread
+        notifications.app_settings.GAME_NOTIFY_URL_FUNCTION = lambda game: 'http://game-%s/notify/' % game
+        notifications.threading.Thread = ImmediateThread
+        self.user = User.objects.create_user('test', 'test@example.com', 'password')
+        self.game = models.Game(id=1, name='test')
+        self.game.save()
+
+    def tearDown(self):
+        notifications.app_settings.GAME_NOTIFY_URL_FUNCTION = self.old_url_function
+        notifications.threading.Thread = self.old_thread
+
+    def record(self, url, request):
+        self.events.append((url.netloc, json.loads(request.body)))
+        return 'OK'
+
+    def test_code_change_notified(self):
+        avatar = models.Avatar(owner=self.user, code='code', game=self.game)
+        with HTTMock(self.record):
+            avatar.save()
+        self.assertEqual(self.events, [('game-1', {'game': 1, 'reason': 'code_changed', 'user': self.user.pk})])
+
+    def test_membership_change_notified(self):
+        with HTTMock(self.record):
+            self.game.can_play.add(self.user)
+            self.user.playable_games.remove(self.game)
+        self.assertEqual([event['reason'] for (_, event) in self.events], ['users_changed', 'users_changed'])
+
+    def test_opening_code_notified(self):
+        models.Avatar(owner=self.user, code='code', game=self.game).save()
+        client = Client()
+        client.login(username='test', password='password')
+        with HTTMock(self.record):
+            client.get(reverse('aimmo/code', kwargs={'id': 1}))
+        self.assertEqual(self.events, [('game-1', {'game': 1, 'reason': 'code_opened', 'user': self.user.pk})])
+
+    def test_nothing_sent_without_url(self):
+        notifications.app_settings.GAME_NOTIFY_URL_FUNCTION = lambda game: None
+        with HTTMock(self.record):
+            models.Avatar(owner=self.user, code='code', game=self.game).save()
+        self.assertEqual(self.events, [])
+
+    def test_unreachable_game_ignored(self):
+        def fail(url, request):
+            return {'status_code': 503}
+        with HTTMock(fail):
+            models.Avatar(owner=self.user, code='code', game=self.game).save()
+
+
+class TestChangeFeed(TestCase):
+    def setUp(self):
+        self.game = models.Game(id=1, name='test')
+        self.game.save()
+
+    def get_changes(self, since, wait=0):
+        response = Client().get(reverse('aimmo/games'), {'since': since, 'wait': wait})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_snapshot(self):
+        changes = self.get_changes(0)
+        self.assertTrue(changes['snapshot'])
+        self.assertEqual(changes['revision'], change_feed.latest_revision())
+        self.assertEqual(changes['games'], {'1': self.game.listing()})
+
+    def test_no_changes(self):
+        revision = self.get_changes(0)['revision']
+        self.game.save()
+        self.assertEqual(self.get_changes(revision),
+                         {'revision': revision, 'snapshot': False, 'games': {}, 'removed': []})
+
+    def test_added_changed_and_removed(self):
+        revision = self.get_changes(0)['revision']
+        models.Game(id=2, name='new').save()
+        self.game.name = 'renamed'
+        self.game.save()
+        changes = self.get_changes(revision)
+        self.assertFalse(changes['snapshot'])
+        self.assertEqual(sorted(changes['games']), ['1', '2'])
+        self.assertEqual(changes['games']['1']['name'], 'renamed')
+
+        self.game.completed = True
+        self.game.save()
+        models.Game.objects.get(id=2).delete()
+        changes = self.get_changes(changes['revision'])
+        self.assertEqual(changes['games'], {})
+        self.assertEqual(sorted(changes['removed']), [1, 2])
+
+    def test_wait_returns_early_on_change(self):
+        revision = self.get_changes(0)['revision']
+        changed = threading.Event()
+        real_changes = change_feed._changes
+        change_feed._changes = lambda since: real_changes(since - 1) if changed.is_set() else None
+
+        def change():
+            changed.set()
+            with change_feed._changed:
+                change_feed._changed.notify_all()
+        timer = threading.Timer(0.1, change)
+        timer.start()
+        start = time.time()
+        try:
+            changes = change_feed.changes_since(revision, wait=5)
+        finally:
+            change_feed._changes = real_changes
+            timer.join()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(changes['games'], {1: self.game.listing()})
+
+    def test_wait_times_out(self):
+        revision = self.get_changes(0)['revision']
+        start = time.time()
+        self.assertEqual(self.get_changes(revision, wait=0.2)['games'], {})
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_bad_revision(self):
+        response = Client().get(reverse('aimmo/games'), {'since': 'latest'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_wait(self):
+        for wait in ('nan', 'inf', '-1', 'soon'):
+            response = Client().get(reverse('aimmo/games'), {'since': 1, 'wait': wait})
+            self.assertEqual(response.status_code, 400)
+        with self.assertRaises(ValueError):
+            change_feed.changes_since(1, float('nan'))
@@ -1,19 +1,19 @@
+import hashlib
 import logging
 import os
 
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, Http404
 from django.http import JsonResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.views.generic import TemplateView
 
-from json import dumps
 from models import Avatar, Game, LevelAttempt
-from players import forms
+from players import change_feed, forms, notifications
 from . import app_settings
 
 LOGGER = logging.getLogger(__name__)
@@ -52,37 +52,90 @@ def code(request, id):
         avatar.save()
         return _post_code_success_response('Your code was saved!<br><br><a href="%s">Watch</a>' % reverse('aimmo/watch', kwargs={'id': game.id}))
     else:
+        # Someone about to edit code wants the game running, if it hibernated
+        notifications.notify_game(game.id, 'code_opened', user=request.user.pk)
         return HttpResponse(avatar.code)
 
 
 def list_games(request):
+    """
+    All active games. With since=<revision>, only the games added, changed or
+    removed after that revision instead; wait=<seconds> then holds the request
+    open until there are some (see change_feed).
+    """
+    if 'since' in request.GET:
+        try:
+            since = int(request.GET['since'])
+            wait = float(request.GET.get('wait', 0))
+        except ValueError:
+            return HttpResponseBadRequest('since and wait must be numbers')
+        # Written so as to be False for NaN too
+        if not 0 <= wait < float('inf'):
+            return HttpResponseBadRequest('wait must be a number of seconds')
+        return JsonResponse(change_feed.changes_since(since, min(wait, change_feed.MAX_WAIT)))
     response = {
-        game.pk:
-            {
-                'name': game.name,
-                'settings': dumps(game.settings_as_dict()),
-            } for game in Game.objects.exclude_inactive()
+        game.pk: game.listing() for game in Game.objects.exclude_inactive()
     }
     return JsonResponse(response)
 
 
+def _game_revision(game, avatars):
+    """Changes whenever any of the game's users, or their code, change."""
+    revision = hashlib.sha1(str(game.main_user_id))
+    for owner_id, code_hash in sorted(avatars):
+        revision.update(';%s:%s' % (owner_id, code_hash))
+    return revision.hexdigest()
+
+
 def get_game(request, id):
+    """
+    The game's users and their code.
+
+    Pass code=false to get only hashes of each user's code, and users=1,2 to
+    get only the listed users. The response carries the game's revision as
+    its ETag, so pollers can send If-None-Match and get a 304 back.
+    """
     game = get_object_or_404(Game, id=id)
+    avatars = list(game.avatar_set.values_list('owner_id', 'code_hash'))
+    revision = _game_revision(game, avatars)
+    etag = '"%s"' % revision
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    include_code = request.GET.get('code') != 'false'
+    avatar_set = game.avatar_set.all()
+    if request.GET.get('users'):
+        try:
+            user_ids = [int(user_id) for user_id in request.GET['users'].split(',')]
+        except ValueError:
+            return HttpResponseBadRequest('users must be a comma separated list of ids')
+        avatar_set = avatar_set.filter(owner_id__in=user_ids)
+    if not include_code:
+        avatar_set = avatar_set.defer('code')
+
     response = {
         'main': {
             'parameters': [],
             'main_avatar': None,
+            'revision': revision,
             'users': [],
         }
     }
-    for avatar in game.avatar_set.all():
-        if avatar.owner_id == game.main_user_id:
-            response['main']['main_avatar'] = avatar.owner_id
-        response['main']['users'].append({
+    if any(owner_id == game.main_user_id for (owner_id, _) in avatars):
+        response['main']['main_avatar'] = game.main_user_id
+    for avatar in avatar_set:
+        user = {
             'id': avatar.owner_id,
-            'code': avatar.code,
-        })
-    return JsonResponse(response)
+            'code_hash': avatar.code_hash,
+        }
+        if include_code:
+            user['code'] = avatar.code
+        response['main']['users'].append(user)
+    response = JsonResponse(response)
+    response['ETag'] = etag
+    return response
 
 
 @csrf_exempt